@@ -1,12 +1,28 @@
 # -*- coding: utf-8 -*-
 """
-IBTrACS_v04_exploring.py
+IBTrACSv04_exploring.py
 
 Takes a CSV-formatted IBTrACSv04 file from
 https://www.ncdc.noaa.gov/ibtracs/index.php?name=ib-v4-access
-and extracts the columns needed for populating the NOAA OCM
-Historical Hurricane Tracks web site:
-    coast.noaa.gov/hurricanes
+and counts how complete each agency's winds and pressures are, by basin
+and decade, to choose the order of WIND_PRIORITY in config.ini.  For each
+observation the processing uses the wind and pressure of the first agency
+in WIND_PRIORITY that has a wind.
+
+Only the season, basin and agency wind and pressure columns are read, with
+their types given, by pyarrow's CSV reader if it is installed and pandas'
+otherwise.
+The non-missing values are counted in one groupby over basin and decade.
+The counts are kept in the CHECKPOINTS directory under a hash of the file,
+so profiling the same download again takes only the time to hash it.
+
+    python3 IBTrACSv04_exploring.py
+    python3 IBTrACSv04_exploring.py --basins WP,SI --since 1980
+    python3 IBTrACSv04_exploring.py --update config.ini
+
+The last writes the agencies, most winds first, as WIND_PRIORITY.  This
+needs pandas, and pyarrow for its faster reader:
+    pip3 install pandas pyarrow
 
 Created on Mon Jul 15 12:50:34 2019
     7/18/2019 Playing with Pandas
@@ -14,77 +30,172 @@ Created on Mon Jul 15 12:50:34 2019
 @author: Dave.Eslinger
 """
 
-import pandas as pd
 import os
-#import datetime as dt
-print(os.getcwd())
-workDir = "." # C: at work, K: at home
-dataDir = workDir + "/data"  # Data location
-
-ibRaw = dataDir + "/ibtracsData.csv"
-ibdf = pd.read_csv(ibRaw, 
-                   na_values = ['-1',' '],
-                   parse_dates = [6,7],
-                   infer_datetime_format = True,
-#                   nrows = 200, 
-                   header = [0,1])  
-cnames = next(zip(*ibdf))
-ibdf.columns = cnames
-
-print(ibdf.head(3))
-ibdf.describe()
-ibdf.info()
-
-""" Extract all wind speeds """
-winds = ibdf.filter(like='_WIND')
-winds.describe()
-winds.info()
-
-press = ibdf.filter(like='_PRES')
-
-# =============================================================================
-# print(ibdf.info)
-# ibdf.LAT.unique()
-# 
-# smalldf = ibdf.loc[(ibdf['SEASON'] == 2015) & (ibdf['BASIN'] != 'NA') & (ibdf['BASIN'] != 'EP')]
-# print(smalldf.head(10))
-# print(smalldf.info)
-# smalldf.USA_WIND.unique()  # WOOT!  Appears to be no missing values in this column
-# smalldf.USA_PRES.unique()  # WOOT!  Appears to be no missing values in this column
-# #smalldf.USA_WIND.unique()  # WOOT!  Appears to be no missing values in this column
-# print(smalldf)
-# smalldf.describe()
-# ibUSA = ibdf.filter(regex=r'USA')
-# ibUSA.head(3)
-# bar = ibUSA.drop(ibUSA.index[0])
-# bar.head(3)
-# print(ibUSA.index[0])
-# ibUSA.info()
-# 
-# foo = ibUSA[ibUSA.USA_LAT != 'degrees_north'] #.index[0])
-# foo.head(3)
-# print(foo)
-# with open(ibRaw, "r") as rawObsFile :
-#     headers = rawObsFile.readline().split(",")
-#     units = rawObsFile.readline().split(",")
-#     # head3 = ib.readline()
-#     # head4 = ib.readline()
-#     """ Read first IBTrACS Record """
-#     lineVals = rawObsFile.readline() # First Storm record in IBTrACS
-#     vals = lineVals.split(",")
-#     while (vals[1] != "2018"):
-#         lineVals = rawObsFile.readline() # First Storm record in IBTrACS
-#         vals = lineVals.split(",")
-#     # Found some 2018 data
-#     #print(headers[0:26])
-#     #print(units[0:26])
-#     print(headers[0:12], headers[19:21], headers[23:26])
-#     #while True: # Read and print out the "USA" 2018 data
-#     while vals[1] != "2018": # Read and print out the "USA" 2018 data
-#         lineVals = rawObsFile.readline()
-#         if not lineVals: # Finds EOF
-#             break # Break on EOF
-#         else: # Data read: Parse it and test to see if it is a new storm
-#             vals = lineVals.split(",")
-#             print(vals[0:12], vals[19:21], vals[23:26])
-# =============================================================================
+import re
+import time
+import hashlib
+import argparse
+
+import pandas as pd
+
+import hht # Local python package
+from hht.readers import IB_HEADER_ROWS
+from hht.storms import WIND_COLUMNS
+
+""" IBTrACSv04 columns read besides the agency winds and pressures """
+SEASON_COLUMN = 1
+BASIN_COLUMN = 3
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    ENGINE = 'pyarrow'
+except ImportError:
+    ENGINE = 'pandas' # Its C parser, several times slower
+
+
+def fileDigest(fileName):
+    """ BLAKE2b of the contents of fileName, the key of its profile """
+    h = hashlib.blake2b(digest_size=16)
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def readColumns(fileName):
+    """ SEASON, BASIN and each agency's <AGENCY>_WIND and <AGENCY>_PRES
+        from an IBTrACS file, NaN where missing """
+    columns = {SEASON_COLUMN: 'SEASON', BASIN_COLUMN: 'BASIN'}
+    for agency, column in WIND_COLUMNS.items():
+        columns[column] = agency + '_WIND'
+        columns[column + 1] = agency + '_PRES'
+    """ Every column is named, so they are chosen and typed by name """
+    with open(fileName) as f:
+        names = ['COLUMN' + str(k) for k in range(len(f.readline().split(',')))]
+    for column, name in columns.items():
+        names[column] = name
+    """ ' ' is IBTrACS' missing value, and NA the North Atlantic """
+    if ENGINE == 'pyarrow':
+        types = {name: pa.float64() for name in columns.values()}
+        types['SEASON'] = pa.int32()
+        types['BASIN'] = pa.dictionary(pa.int32(), pa.string())
+        return pacsv.read_csv(fileName, read_options=pacsv.ReadOptions(
+            skip_rows=IB_HEADER_ROWS, column_names=names),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=list(columns.values()), column_types=types,
+                null_values=[' ', ''])).to_pandas()
+    dtypes = {name: 'float64' for name in columns.values()}
+    dtypes['SEASON'] = 'int32'
+    dtypes['BASIN'] = 'category'
+    return pd.read_csv(fileName, header=None, names=names,
+                       skiprows=IB_HEADER_ROWS, usecols=list(columns.values()),
+                       dtype=dtypes, na_values=[' ', ''],
+                       keep_default_na=False)
+
+
+def countColumns(data):
+    """ Number of observations, and of non-missing values of each agency
+        wind and pressure, by BASIN and DECADE """
+    counts = data.drop(columns=['SEASON', 'BASIN']).notna()
+    counts.insert(0, 'OBSERVATIONS', True)
+    return counts.groupby([data['BASIN'], (data['SEASON'] // 10*10).rename(
+        'DECADE')], observed=True).sum()
+
+
+def loadProfile(fileName, cacheDir, refresh=False):
+    """ countColumns of an IBTrACS file, from cacheDir if it was counted
+        before.  Returns (counts, cacheFileName, whether from the cache). """
+    cacheFileName = os.path.join(cacheDir, 'ibtracsProfile_' +
+                                 fileDigest(fileName) + '.csv')
+    if not refresh and os.path.exists(cacheFileName):
+        counts = pd.read_csv(cacheFileName, index_col=['BASIN', 'DECADE'],
+                             keep_default_na=False)
+        return counts, cacheFileName, True
+    counts = countColumns(readColumns(fileName))
+    os.makedirs(cacheDir, exist_ok=True)
+    counts.to_csv(cacheFileName + '.tmp')
+    os.replace(cacheFileName + '.tmp', cacheFileName)
+    return counts, cacheFileName, False
+
+
+def select(counts, basins=None, since=None):
+    """ The rows of counts for the basins and the decades from since on """
+    keep = pd.Series(True, index=counts.index)
+    if basins:
+        keep &= counts.index.get_level_values('BASIN').isin(basins)
+    if since is not None:
+        keep &= counts.index.get_level_values('DECADE') >= since // 10*10
+    return counts[keep.values]
+
+
+def windPriority(counts):
+    """ The agencies, most winds first, and in their WIND_COLUMNS order for
+        equal numbers """
+    winds = counts[[agency + '_WIND' for agency in WIND_COLUMNS]].sum()
+    return sorted(WIND_COLUMNS, key=lambda agency: -winds[agency + '_WIND'])
+
+
+def updateConfig(fileName, agencies):
+    """ Sets WIND_PRIORITY in the [PARAMETERS] of the config.ini fileName to
+        agencies, keeping the rest of the file as it is """
+    line = 'WIND_PRIORITY = ' + ', '.join(agencies)
+    with open(fileName) as f:
+        text = f.read()
+    text, found = re.subn(r'(?m)^WIND_PRIORITY\s*[=:].*$', line, text)
+    if not found:
+        text, found = re.subn(r'(?m)^\[PARAMETERS\]\s*$',
+                              lambda m: m.group(0) + '\n' + line, text)
+    if not found:
+        raise ValueError('No [PARAMETERS] section in ' + fileName)
+    with open(fileName, 'w') as f:
+        f.write(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Count the winds and pressures of each agency in the '
+        'IBTrACS file by basin and decade, to order WIND_PRIORITY')
+    parser.add_argument('--config', default='./config.ini',
+                        help='config.ini giving the data and checkpoint directories')
+    parser.add_argument('--file', help='IBTrACS file, the one in the data '
+                        'directory if none')
+    parser.add_argument('--basins', help='comma separated basins to count, '
+                        'e.g. WP,SI, all if none')
+    parser.add_argument('--since', type=int, metavar='YEAR',
+                        help='count the decades from this year on')
+    parser.add_argument('--refresh', action='store_true',
+                        help='count again even if the file was counted before')
+    parser.add_argument('--update', metavar='CONFIG',
+                        help='write the order found as WIND_PRIORITY in this config.ini')
+    args = parser.parse_args()
+
+    cfg = hht.Config.fromFile(args.config)
+    start = time.perf_counter()
+    counts, cacheFileName, cached = loadProfile(
+        args.file or cfg.ibtracsFileName, cfg.checkpointDir, args.refresh)
+    print("{0} {1} in {2:.1f} s".format(
+        "Read counts from" if cached else "Counted with " + ENGINE +
+        ", saved to", cacheFileName, time.perf_counter() - start))
+
+    counts = select(counts, args.basins and
+                    [basin.strip() for basin in args.basins.split(',')],
+                    args.since)
+    winds = counts[[agency + '_WIND' for agency in WIND_COLUMNS]]
+    winds.columns = list(WIND_COLUMNS)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print("\nObservations with a wind, by agency:")
+        print(pd.concat([counts['OBSERVATIONS'], winds], axis=1).to_string())
+    total = counts.sum()
+    print("\n{0:>12} {1:>10} {2:>10} {3:>8}".format(
+        'AGENCY', 'WINDS', 'PRESSURES', 'PERCENT'))
+    agencies = windPriority(counts)
+    for agency in agencies:
+        print("{0:>12} {1:>10} {2:>10} {3:>7.1f}%".format(
+            agency, total[agency + '_WIND'], total[agency + '_PRES'],
+            100.*total[agency + '_WIND']/max(total['OBSERVATIONS'], 1)))
+    print("\nCurrent: WIND_PRIORITY = " + ', '.join(cfg.WIND_PRIORITY))
+    print("By wind count: WIND_PRIORITY = " + ', '.join(agencies))
+    if args.update:
+        updateConfig(args.update, agencies)
+        print("Written to " + args.update)
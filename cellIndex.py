@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Reverse index from a fixed global lat/lon grid to the storms that passed
+through each cell, published as static JSON so the web client can answer
+"which storms came near here" with one fetch and no database.
+
+Every segment is rasterized in bulk with NumPy by sampling points along it
+at a quarter of the cell size, in continuous longitudes so segments across
+180 (including those split by BREAK180) land on both sides of it.  Each
+cell lists the storms that touched it, sorted by storm ID, each with the
+highest Saffir-Simpson category the storm had inside that cell.
+
+Cells are grouped into SHARD_DEGREES square shards, written as
+cells/<shard row>_<shard column>.json:
+    {"cells": {"<cell>": [[storm ID, category], ...], ...}}
+where, for a cell size cs,
+    cell row    = floor((lat + 90)/cs), cell column = floor((lon + 180)/cs)
+    cell        = cell row*(360/cs) + cell column
+    shard row   = floor((lat + 90)/SHARD_DEGREES), and the same for column
+
+cells/manifest.json keeps the grid settings plus a hash of each storm and
+the shards it touches.  On the next run only shards touched by added,
+changed or removed storms are written again, so unchanged files keep their
+web cache entries.
+
+"""
+
+import os
+import glob
+import json
+import hashlib
+
+import numpy as np
+
+from kinematics import catOrder, wrapLon # Local python module
+
+""" Size of the square shards, in degrees """
+SHARD_DEGREES = 10.
+
+
+def rasterize(storms, cellSize):
+    """ Cells touched by every storm.  Returns arrays (cell, storm index,
+        category rank) with one entry per distinct (cell, storm), holding
+        the highest category rank of the storm's segments in that cell.
+        Ranks index kinematics.catOrder. """
+    stormOf = []
+    lat0, lon0, lat1, lon1, ranks = [], [], [], [], []
+    for s, storm in enumerate(storms):
+        for seg in storm.segs:
+            stormOf.append(s)
+            lat0.append(seg.startLat)
+            lon0.append(seg.startLon)
+            lat1.append(seg.endLat)
+            lon1.append(seg.endLon)
+            ranks.append(catOrder.index(seg.saffir) if seg.saffir in catOrder
+                         else 0)
+    stormOf = np.array(stormOf, dtype=np.int64)
+    ranks = np.array(ranks, dtype=np.int64)
+    sy = np.array(lat0, dtype=float)
+    ey = np.array(lat1, dtype=float)
+    """ Continuous longitudes: start in -180 to 180, end the short way """
+    sx = wrapLon(lon0)
+    ex = sx + wrapLon(np.array(lon1, dtype=float) - np.array(lon0, dtype=float))
+
+    step = cellSize/4.
+    counts = (np.ceil(np.maximum(np.abs(ex - sx), np.abs(ey - sy))/step)
+              .astype(np.int64) + 1)
+    segs = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = k/np.maximum(counts[segs] - 1, 1)
+    lat = sy[segs] + t*(ey[segs] - sy[segs])
+    lon = wrapLon(sx[segs] + t*(ex[segs] - sx[segs]))
+
+    numRows = int(np.ceil(180./cellSize))
+    numCols = int(np.ceil(360./cellSize))
+    rows = np.clip(np.floor((lat + 90.)/cellSize).astype(np.int64), 0, numRows - 1)
+    cols = np.clip(np.floor((lon + 180.)/cellSize).astype(np.int64), 0, numCols - 1)
+    cells = rows*numCols + cols
+
+    """ Highest category for each distinct (cell, storm) """
+    keys, inverse = np.unique(cells*len(storms) + stormOf[segs],
+                              return_inverse=True)
+    best = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(best, inverse, ranks[segs])
+    return keys // len(storms), keys % len(storms), best
+
+
+def _shardOf(cells, cellSize):
+    numCols = int(np.ceil(360./cellSize))
+    perShard = int(round(SHARD_DEGREES/cellSize))
+    return ['%d_%d' % (c // numCols // perShard, c % numCols // perShard)
+            for c in cells]
+
+
+def _stormHashes(storms):
+    """ Hash of the positions and categories of each storm ID's segments """
+    hashes = {}
+    for storm in storms:
+        h = hashes.setdefault(storm.uid, hashlib.sha1())
+        h.update(repr([(seg.startLat, seg.startLon, seg.endLat, seg.endLon,
+                        seg.saffir) for seg in storm.segs]).encode('utf-8'))
+    return {uid: h.hexdigest() for uid, h in hashes.items()}
+
+
+def writeCellIndex(dirName, storms, cellSize):
+    """ Writes or updates the cell index shards for the processed storms.
+        Returns (shards written, shards deleted, storms changed). """
+    os.makedirs(dirName, exist_ok=True)
+    manifestName = os.path.join(dirName, 'manifest.json')
+    old = {}
+    if os.path.exists(manifestName):
+        with open(manifestName) as f:
+            old = json.load(f)
+    sameGrid = (old.get('cellSize') == cellSize
+                and old.get('shardDegrees') == SHARD_DEGREES)
+    oldStorms = old.get('storms', {}) if sameGrid else {}
+
+    cells, stormIndex, ranks = rasterize(storms, cellSize)
+    shards = _shardOf(cells, cellSize)
+    uids = [storm.uid for storm in storms]
+
+    newStorms = {uid: {'hash': h, 'shards': set()}
+                 for uid, h in _stormHashes(storms).items()}
+    for shard, s in zip(shards, stormIndex):
+        newStorms[uids[s]]['shards'].add(shard)
+
+    changed = ({uid for uid in newStorms
+                if oldStorms.get(uid, {}).get('hash') != newStorms[uid]['hash']}
+               | (set(oldStorms) - set(newStorms)))
+    dirty = set()
+    for uid in changed:
+        dirty.update(oldStorms.get(uid, {}).get('shards', []))
+        dirty.update(newStorms.get(uid, {}).get('shards', []))
+
+    """ Contents of the dirty shards only """
+    contents = {}
+    for shard, cell, s, rank in zip(shards, cells, stormIndex, ranks):
+        if shard in dirty:
+            contents.setdefault(shard, {}).setdefault(str(cell), []).append(
+                [uids[s], catOrder[rank]])
+    numWritten = 0
+    for shard, shardCells in contents.items():
+        for entries in shardCells.values():
+            entries.sort()
+        with open(os.path.join(dirName, shard + '.json'), 'w') as f:
+            json.dump({'cells': shardCells}, f, separators=(',', ':'))
+        numWritten += 1
+
+    """ Dirty shards with nothing left in them, and every shard from an
+        index with other grid settings """
+    numDeleted = 0
+    for path in glob.glob(os.path.join(dirName, '*_*.json')):
+        shard = os.path.basename(path)[:-len('.json')]
+        if shard not in contents and (shard in dirty or not sameGrid):
+            os.remove(path)
+            numDeleted += 1
+
+    with open(manifestName, 'w') as f:
+        json.dump({'cellSize': cellSize, 'shardDegrees': SHARD_DEGREES,
+                   'storms': {uid: {'hash': v['hash'],
+                                    'shards': sorted(v['shards'])}
+                              for uid, v in newStorms.items()}},
+                  f, separators=(',', ':'))
+    return numWritten, numDeleted, len(changed)
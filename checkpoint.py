@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk checkpoints of the storms between the stages of annualDataUpdate.py,
+so a later stage can be rerun without reading and checking all the raw data
+again.
+
+The storms are stored by column rather than as objects: one list per storm
+attribute and one per observation attribute, with every observation of
+every storm end to end.  Columns that are all floats or all times are kept
+as NumPy arrays.  Any other values the stage wants to pass on, such as
+counters for the log, go in a dictionary saved alongside, with the
+[PARAMETERS] of config.ini so a stale checkpoint can be spotted.  The qa
+stage sends storms to its worker processes as the same columns.
+
+"""
+
+import os
+import pickle
+import datetime as dt
+
+import numpy as np
+
+
+def toColumn(values):
+    """ NumPy array of a column if it has a single simple type, else a list """
+    if values and all(type(v) is float for v in values):
+        return np.array(values, dtype=float)
+    if values and all(type(v) is dt.datetime for v in values):
+        return np.array(values, dtype='datetime64[us]')
+    return list(values)
+
+
+def fromColumn(column):
+    """ Python values of a column, as they were before saving """
+    if isinstance(column, np.ndarray):
+        return column.tolist()
+    return column
+
+
+def saveStorms(fileName, storms, values, parameters):
+    """ Writes the storms, a dictionary of other values and the
+        configuration parameters to fileName.  Returns the file size. """
+    stormKeys = sorted({key for storm in storms for key in vars(storm)
+                        if key != 'segs'})
+    segs = [seg for storm in storms for seg in storm.segs]
+    segKeys = sorted({key for seg in segs for key in vars(seg)})
+    data = {'numSegs': [len(storm.segs) for storm in storms],
+            'storms': {key: toColumn([getattr(storm, key, None)
+                                     for storm in storms])
+                       for key in stormKeys},
+            'segs': {key: toColumn([getattr(seg, key, None) for seg in segs])
+                     for key in segKeys},
+            'values': values,
+            'parameters': dict(parameters)}
+    os.makedirs(os.path.dirname(fileName) or '.', exist_ok=True)
+    """ Write to a temporary file first so a failure never leaves a
+        partial checkpoint behind """
+    with open(fileName + '.tmp', 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fileName + '.tmp', fileName)
+    return os.path.getsize(fileName)
+
+
+def loadStorms(fileName, stormClass, segClass):
+    """ Reads a checkpoint written by saveStorms.  Returns (storms, values,
+        parameters), rebuilding the storms as stormClass objects whose segs
+        are segClass objects. """
+    with open(fileName, 'rb') as f:
+        data = pickle.load(f)
+    stormCols = {key: fromColumn(col) for key, col in data['storms'].items()}
+    segCols = {key: fromColumn(col) for key, col in data['segs'].items()}
+
+    segs = []
+    for k in range(sum(data['numSegs'])):
+        seg = segClass.__new__(segClass)
+        seg.__dict__.update((key, col[k]) for key, col in segCols.items())
+        segs.append(seg)
+    storms = []
+    first = 0
+    for i, numSegs in enumerate(data['numSegs']):
+        storm = stormClass.__new__(stormClass)
+        storm.__dict__.update((key, col[i]) for key, col in stormCols.items())
+        storm.segs = segs[first:first + numSegs]
+        first += numSegs
+        storms.append(storm)
+    return storms, data['values'], data['parameters']
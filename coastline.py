@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Landfall and coastal zone tagging of the storm segments against a land
+polygon shapefile, e.g. the Natural Earth 1:50m land polygons:
+    https://www.naturalearthdata.com/downloads/50m-physical-vectors/
+
+The polygon edges are read once into a LandIndex, a regular lat/lon grid
+kept in compressed row form like stormQuery.SegmentIndex.  Every segment is
+only tested against the edges in the grid cells its bounding box touches,
+so the work grows with the number of segments, not segments times
+polygons.
+
+Whether an observation is over land is found by ray casting for the first
+observation of each storm only.  After that each segment changes sides
+once per coastline edge it crosses.  Polygons must be in -180 to 180 and
+split at the antimeridian, as Natural Earth's are.  Edges near 180 are also
+indexed shifted by 360 degrees, so segments crossing 180 are tested in
+continuous longitudes.  Distances to the coast use a local equirectangular
+approximation, which is plenty for a coastal buffer of some tens of
+nautical miles.
+
+"""
+
+import numpy as np
+import shapefile
+
+from kinematics import NM_PER_DEGREE, wrapLon # Local python module
+
+""" Edges within this many degrees of 180 are also indexed shifted by 360 """
+WRAP_BAND = 30.
+""" Storm positions are moved by this many degrees before testing, so that
+    none lies exactly on a coastline edge, where a point would be on land
+    for one test and at sea for another """
+NUDGE = 1.e-7
+""" Segments tested per batch, to bound the memory used by candidate pairs """
+BATCH_SIZE = 20000
+
+
+def _cross(ax, ay, bx, by):
+    return ax*by - ay*bx
+
+
+def _pointSegmentDistance(px, py, x0, y0, x1, y1):
+    """ Planar distance from points to segments, all arrays """
+    dx = x1 - x0
+    dy = y1 - y0
+    lengthSq = dx*dx + dy*dy
+    t = np.where(lengthSq > 0.,
+                 ((px - x0)*dx + (py - y0)*dy)/np.where(lengthSq > 0., lengthSq, 1.),
+                 0.)
+    t = np.clip(t, 0., 1.)
+    return np.hypot(px - (x0 + t*dx), py - (y0 + t*dy))
+
+
+class LandIndex(object):
+    """ Grid index of coastline edges.
+
+        x0, y0, x1, y1 : edge end points, lon and lat in degrees
+        original       : True for the edges as read, False for the copies
+                         shifted by 360 degrees
+        meridian       : True for edges along 180 that only close polygons
+                         split there; they are not coastline
+    """
+    def __init__(self, x0, y0, x1, y1, cellSize=1.0):
+        x0, y0, x1, y1 = (np.asarray(a, dtype=float) for a in (x0, y0, x1, y1))
+        self.meridian = (x0 == x1) & (np.abs(x0) == 180.)
+        east = np.maximum(x0, x1) > 180. - WRAP_BAND
+        west = np.minimum(x0, x1) < -180. + WRAP_BAND
+        self.x0 = np.concatenate((x0, x0[east] - 360., x0[west] + 360.))
+        self.x1 = np.concatenate((x1, x1[east] - 360., x1[west] + 360.))
+        self.y0 = np.concatenate((y0, y0[east], y0[west]))
+        self.y1 = np.concatenate((y1, y1[east], y1[west]))
+        self.meridian = np.concatenate((self.meridian, self.meridian[east],
+                                        self.meridian[west]))
+        self.original = np.zeros(len(self.x0), dtype=bool)
+        self.original[:len(x0)] = True
+        self.cellSize = float(cellSize)
+        self.numRows = int(np.ceil(180.0/self.cellSize))
+        """ Columns run from -360 to 360 to hold the shifted copies """
+        self.numCols = int(np.ceil(720.0/self.cellSize))
+        self._buildGrid()
+
+    def _cells(self, xMin, yMin, xMax, yMax):
+        """ (item, cell) pairs for the grid cells of each bounding box """
+        cs = self.cellSize
+        row0 = np.clip(np.floor((yMin + 90.)/cs).astype(int), 0, self.numRows - 1)
+        row1 = np.clip(np.floor((yMax + 90.)/cs).astype(int), 0, self.numRows - 1)
+        col0 = np.clip(np.floor((xMin + 360.)/cs).astype(int), 0, self.numCols - 1)
+        col1 = np.clip(np.floor((xMax + 360.)/cs).astype(int), 0, self.numCols - 1)
+        nCols = col1 - col0 + 1
+        counts = (row1 - row0 + 1)*nCols
+        items = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+        cells = ((row0[items] + k // nCols[items])*self.numCols
+                 + col0[items] + k % nCols[items])
+        return items, cells
+
+    def _buildGrid(self):
+        edges, cells = self._cells(np.minimum(self.x0, self.x1),
+                                   np.minimum(self.y0, self.y1),
+                                   np.maximum(self.x0, self.x1),
+                                   np.maximum(self.y0, self.y1))
+        order = np.argsort(cells, kind='stable')
+        self.cellEdges = edges[order]
+        self.cellStart = np.searchsorted(
+            cells[order], np.arange(self.numRows*self.numCols + 1))
+
+    @classmethod
+    def fromShapefile(cls, fileName, cellSize=1.0):
+        """ Reads every ring of every polygon in a shapefile """
+        reader = shapefile.Reader(fileName)
+        x0 = []
+        y0 = []
+        x1 = []
+        y1 = []
+        for shape in reader.iterShapes():
+            points = np.asarray(shape.points, dtype=float)
+            bounds = list(shape.parts) + [len(points)]
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                ring = points[first:last]
+                x0.append(ring[:-1, 0])
+                y0.append(ring[:-1, 1])
+                x1.append(ring[1:, 0])
+                y1.append(ring[1:, 1])
+        reader.close()
+        return cls(np.concatenate(x0), np.concatenate(y0),
+                   np.concatenate(x1), np.concatenate(y1), cellSize)
+
+    def onLand(self, lat, lon):
+        """ True for each point inside the land polygons.  Casts a ray east
+            from each point and counts the original edges it crosses. """
+        lat = np.asarray(lat, dtype=float)
+        lon = wrapLon(lon)
+        inside = np.zeros(len(lat), dtype=bool)
+        cs = self.cellSize
+        rows = np.clip(np.floor((lat + 90.)/cs).astype(int), 0, self.numRows - 1)
+        cols = np.floor((lon + 360.)/cs).astype(int)
+        lastCol = int(np.floor((180. + 360.)/cs))
+        for k in range(len(lat)):
+            start = self.cellStart[rows[k]*self.numCols + cols[k]]
+            end = self.cellStart[rows[k]*self.numCols + lastCol + 1]
+            edges = np.unique(self.cellEdges[start:end])
+            edges = edges[self.original[edges]]
+            x0 = self.x0[edges]
+            y0 = self.y0[edges]
+            x1 = self.x1[edges]
+            y1 = self.y1[edges]
+            straddle = (y0 > lat[k]) != (y1 > lat[k])
+            xCross = x0[straddle] + (lat[k] - y0[straddle])*(
+                (x1[straddle] - x0[straddle])/(y1[straddle] - y0[straddle]))
+            inside[k] = np.count_nonzero(xCross > lon[k]) % 2 == 1
+        return inside
+
+    def crossings(self, lat0, lon0, lat1, lon1, buffer=0.):
+        """ Tests segments against the coastline.  Longitudes need not be
+            wrapped.  Returns, for each segment, the number of coastline
+            edges it crosses, the fraction of the way along it of the first
+            crossing (inf for none) and whether it comes within buffer
+            nautical miles of the coast. """
+        n = len(lat0)
+        numCross = np.zeros(n, dtype=np.int64)
+        firstT = np.full(n, np.inf)
+        near = np.zeros(n, dtype=bool)
+        """ Continuous longitudes: start in -180 to 180, end the short way """
+        sx = wrapLon(lon0)
+        ex = sx + wrapLon(np.asarray(lon1, dtype=float) - np.asarray(lon0, dtype=float))
+        sy = np.asarray(lat0, dtype=float)
+        ey = np.asarray(lat1, dtype=float)
+        pad = buffer/NM_PER_DEGREE
+        for b in range(0, n, BATCH_SIZE):
+            sl = slice(b, min(b + BATCH_SIZE, n))
+            cosLat = np.maximum(np.cos(np.radians(0.5*(sy[sl] + ey[sl]))), 0.01)
+            padX = pad/cosLat
+            segs, cells = self._cells(np.minimum(sx[sl], ex[sl]) - padX,
+                                      np.minimum(sy[sl], ey[sl]) - pad,
+                                      np.maximum(sx[sl], ex[sl]) + padX,
+                                      np.maximum(sy[sl], ey[sl]) + pad)
+            counts = self.cellStart[cells + 1] - self.cellStart[cells]
+            pairSegs = np.repeat(segs, counts)
+            k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                    counts)
+            pairEdges = self.cellEdges[np.repeat(self.cellStart[cells], counts) + k]
+            """ An edge can share several cells with a segment """
+            pairs = np.unique(pairSegs*len(self.x0) + pairEdges)
+            pairSegs = pairs // len(self.x0)
+            pairEdges = pairs % len(self.x0)
+            s = pairSegs + b
+
+            ax = sx[s]
+            ay = sy[s]
+            dx = ex[s] - ax
+            dy = ey[s] - ay
+            bx = self.x0[pairEdges]
+            by = self.y0[pairEdges]
+            fx = self.x1[pairEdges] - bx
+            fy = self.y1[pairEdges] - by
+            denom = _cross(dx, dy, fx, fy)
+            safe = np.where(denom != 0., denom, 1.)
+            t = _cross(bx - ax, by - ay, fx, fy)/safe
+            u = _cross(bx - ax, by - ay, dx, dy)/safe
+            """ Half open along the edge so a shared vertex counts once """
+            hit = (denom != 0.) & (t >= 0.) & (t <= 1.) & (u >= 0.) & (u < 1.)
+            numCross += np.bincount(s[hit], minlength=n)
+            np.minimum.at(firstT, s[hit], t[hit])
+
+            if buffer > 0.:
+                """ Distance between two segments that do not cross is the
+                    least of the four end point to segment distances, in
+                    degrees scaled by the cosine of latitude """
+                coast = ~self.meridian[pairEdges]
+                c = cosLat[pairSegs]
+                ax, dx, bx, fx = ax*c, dx*c, bx*c, fx*c
+                dist = np.minimum.reduce([
+                    _pointSegmentDistance(ax, ay, bx, by, bx + fx, by + fy),
+                    _pointSegmentDistance(ax + dx, ay + dy, bx, by, bx + fx, by + fy),
+                    _pointSegmentDistance(bx, by, ax, ay, ax + dx, ay + dy),
+                    _pointSegmentDistance(bx + fx, by + fy, ax, ay, ax + dx, ay + dy)])
+                close = coast & ((dist <= pad) | hit)
+                near[np.unique(s[close])] = True
+        return numCross, firstT, near
+
+
+def tagStorms(storms, index, coastalNM):
+    """ Landfall and coastal flags for every segment of every storm, in
+        storm then segment order, and the first landfall of each storm.
+
+        Returns (landfall, coastal, firstLandfalls), where landfall and
+        coastal are 0/1 arrays and firstLandfalls has (time, lat, lon) of
+        the first crossing from sea to land for each storm, or None.  A
+        segment is a LANDFALL if it starts at sea and crosses the coast, and
+        COASTAL if it touches land or comes within coastalNM of the coast.
+    """
+    numObs = [len(storm.segs) for storm in storms]
+    segs = [seg for storm in storms for seg in storm.segs]
+    lat0 = np.array([seg.startLat for seg in segs]) + NUDGE
+    lon0 = np.array([seg.startLon for seg in segs]) + NUDGE
+    lat1 = np.array([seg.endLat for seg in segs]) + NUDGE
+    lon1 = np.array([seg.endLon for seg in segs]) + NUDGE
+    numCross, firstT, near = index.crossings(lat0, lon0, lat1, lon1, coastalNM)
+
+    """ Side of the coast at the start of every segment: the first from ray
+        casting, then flipping at every odd number of crossings """
+    firsts = np.cumsum([0] + numObs[:-1])
+    startLand = index.onLand(lat0[firsts], lon0[firsts])
+    odd = (numCross % 2).astype(np.int64)
+    flips = np.cumsum(odd) - odd
+    flips -= np.repeat(flips[firsts], numObs)
+    land = np.repeat(startLand, numObs) ^ (flips % 2 == 1)
+    endLand = land ^ (odd == 1)
+
+    landfall = ~land & (numCross > 0)
+    coastal = land | endLand | (numCross > 0) | near
+
+    firstLandfalls = []
+    for storm, first, count in zip(storms, firsts, numObs):
+        hits = np.nonzero(landfall[first:first + count])[0]
+        if len(hits) == 0:
+            firstLandfalls.append(None)
+            continue
+        k = first + hits[0]
+        j = hits[0]
+        t = float(firstT[k])
+        seg = storm.segs[j]
+        nextTime = storm.segs[j + 1].time if j + 1 < count else seg.time
+        lon = float(wrapLon(lon0[k] + t*wrapLon(lon1[k] - lon0[k])))
+        firstLandfalls.append((seg.time + t*(nextTime - seg.time),
+                               lat0[k] + t*(lat1[k] - lat0[k]), lon))
+    return landfall.astype(int), coastal.astype(int), firstLandfalls
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Historical Hurricane Tracks processing as a library.
+
+    import hht
+    cfg = hht.Config.fromFile('./config.ini')
+    storms, counts = hht.ingest(cfg)
+    storms, counts = hht.dedup(storms, cfg)
+
+Importing the package reads no files and loads none of the processing
+modules.  The stage functions (ingest, dedup, qa, write, run and refresh, see
+hht.pipeline) are imported the first time one of them is used, and the
+lookup tables they need the first time a stage needs them.
+
+annualDataUpdate.py is the command line interface.
+
+"""
+
+from .config import Config
+
+__all__ = ['Config', 'STAGES', 'ingest', 'dedup', 'qa', 'write', 'run',
+           'refresh']
+
+_PIPELINE = set(__all__) - {'Config'}
+
+
+def __getattr__(name):
+    """ Imports hht.pipeline when one of its names is first used """
+    if name in _PIPELINE:
+        from . import pipeline
+        return getattr(pipeline, name)
+    raise AttributeError("module 'hht' has no attribute " + repr(name))
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Settings for one run of the Historical Hurricane Tracks processing.
+
+A Config holds the [PARAMETERS] flags under their config.ini names, the
+directories, and the input and output file names derived from them.
+Nothing is read until Config.fromFile is called, and a Config can also be
+built directly, e.g. Config(dataDir='./data', WEBMERC=True), to process
+data from a notebook or a test.
+
+"""
+
+import math
+import configparser
+
+""" Every [PARAMETERS] setting, its type and its default value """
+PARAMETERS = [
+    # Shuffle the order of the Segments records, the same way every run for
+    # the same SCRAMBLE_SEED and storms
+    ('SCRAMBLE', 'bool', True),
+    ('SCRAMBLE_SEED', 'int', 2019),
+    # Write Web Mercator rather than WGS84 geographic coordinates
+    ('WEBMERC', 'bool', False),
+    # Split segments crossing 180 into two parts, rather than letting the
+    # longitudes run past 180 so they keep their sign
+    ('BREAK180', 'bool', True),
+    # Nudge the end of very short segments and the end of the last segment
+    # of each storm by a tiny amount so that every observation makes a
+    # valid, non-zero length line in the Segments shapefile.  The Tracks
+    # shapefile does not need these offsets.
+    ('OFFSET_POINTS', 'bool', True),
+    # Also write Tracks and Segments into one GeoPackage with its spatial
+    # and attribute indexes already built
+    ('GEOPACKAGE', 'bool', False),
+    # Stream Tracks and Segments straight into the PostgreSQL/PostGIS
+    # database given in the DATABASE section
+    ('LOAD_POSTGIS', 'bool', False),
+    # Tolerances, in degrees, for the generalized Tracks used to draw small
+    # scale maps, e.g. 0.05, 0.25, 1.0.  One simplified Tracks output is
+    # written per tolerance, none if empty.
+    ('SIMPLIFY_TOLERANCES', 'floats', []),
+    # Build or update an MBTiles pyramid of Segments vector tiles for the
+    # zoom levels in TILE_ZOOMS, e.g. 0-7.  WORKERS is the number of
+    # processes to use for them and for the qa stage, 0 for one per CPU.
+    ('VECTOR_TILES', 'bool', False),
+    ('TILE_ZOOMS', 'zooms', [0, 7]),
+    ('WORKERS', 'int', 0),
+    # Prepare the storms of the qa stage in WORKERS processes.  No speedup
+    # has been measured yet, so it is off unless asked for.
+    ('PARALLEL_QA', 'bool', False),
+    # Read the input files and load the lookup tables at the same time, and
+    # write the outputs as the records for them are made, on background
+    # threads, if there is more than one CPU.  The log shows how long each
+    # part took and how full the queues between them were, to find the
+    # slowest.
+    ('PIPELINE', 'bool', True),
+    # Write every storm's quantized track and observation series to per
+    # year JSON files for the web client
+    ('WEB_EXPORT', 'bool', False),
+    # Write tables of counts, ACE and highest winds by year, month, basin,
+    # category and ENSO stage
+    ('STATS', 'bool', False),
+    # Tag Segments that make landfall or come within COASTAL_NM nautical
+    # miles of the coast, and give Tracks the time and place of their first
+    # landfall, using the land polygons in the data directory
+    ('LANDFALL', 'bool', False),
+    ('COASTAL_NM', 'float', 50.),
+    # Write the static JSON index from CELL_SIZE degree grid cells to the
+    # storms that passed through them
+    ('CELL_INDEX', 'bool', False),
+    ('CELL_SIZE', 'float', 0.5),
+    # Keep IBTrACS provisional storms out of the outputs, or add (P) to
+    # their names
+    ('OMIT_PROVISIONAL', 'bool', False),
+    ('LABEL_PROVISIONAL', 'bool', True),
+    # Remove observations failing the QA checks in qaChecks.py.  They are
+    # listed in qaReport.csv either way.
+    ('FLAG_BAD', 'bool', False),
+    # With TESTING, read only part of the data for quick development runs:
+    # the seasons in TEST_SEASONS (e.g. 2005 or 2000-2005), storms starting
+    # in the basins in TEST_BASINS, the IBTrACS or HURDAT2 IDs in
+    # TEST_STORMS, and then about TEST_SAMPLE of those, chosen by storm ID.
+    # Leave a filter empty for no limit.
+    ('TESTING', 'bool', False),
+    ('TEST_SEASONS', 'range', []),
+    ('TEST_BASINS', 'strings', []),
+    ('TEST_STORMS', 'strings', []),
+    ('TEST_SAMPLE', 'float', 1.),
+    # Omit obs at 03:00, 09:00, 15:00 and 21:00 from IBTrACS.  These appear
+    # to be poor quality (DLE's observation) records from different
+    # reporting groups and give the dashed black-colored zig zag look to
+    # many tracks in the Indian Ocean.
+    ('NO391521', 'bool', True),
+    # Use HURDAT2 data as the 'base' data layer for storms in both HURDAT2
+    # and IBTrACS, rather than IBTrACS
+    ('USE_HURDAT', 'bool', True),
+    # Agencies whose IBTrACS wind and pressure are used, taking the first
+    # one with a wind at each observation.  IBTrACSv04_exploring.py counts
+    # the winds each agency has, and can set this from the counts.
+    ('WIND_PRIORITY', 'strings', ['USA', 'DS824', 'WMO', 'CMA', 'TD9636',
+                                  'NEUMANN', 'HKO', 'TOKYO', 'BOM', 'TD9635',
+                                  'MLC', 'REUNION', 'WELLINGTON', 'NADI',
+                                  'NEWDELHI']),
+    ('DUPRANGE', 'int', 5)]
+
+""" Directory and database settings, with the config.ini section and key
+    each one is read from """
+SETTINGS = [
+    ('workDir', 'DIRECTORIES', 'WORKDIR', '.'),
+    ('dataDir', 'DIRECTORIES', 'DATA', './data'),
+    ('resultsDir', 'DIRECTORIES', 'RESULTS', './results/'),
+    ('logDir', 'DIRECTORIES', 'RESULTS_LOG', './results/'),
+    ('checkpointDir', 'DIRECTORIES', 'CHECKPOINTS', './checkpoints'),
+    ('dsn', 'DATABASE', 'DSN', 'dbname=hurricanes'),
+    ('schema', 'DATABASE', 'SCHEMA', 'spatial')]
+
+""" Web Mercator sphere radius in meters """
+EARTH_RADIUS = 6378137.0
+
+""" ESRI prj string for EPSG:3857 WGS84 Web Mercator (Auxiliary Sphere) """
+WEBMERC_PRJ = 'PROJCS["WGS_1984_Web_Mercator_Auxiliary_Sphere",GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Mercator_Auxiliary_Sphere"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],PARAMETER["Standard_Parallel_1",0.0],PARAMETER["Auxiliary_Sphere_Type",0.0],UNIT["Meter",1.0]]'
+""" WGS84 Geographic prj string """
+WGS84_PRJ = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'
+
+
+def _parse(kind, text):
+    """ Value of a [PARAMETERS] setting from its config.ini text """
+    if kind == 'bool':
+        return configparser.ConfigParser.BOOLEAN_STATES[text.strip().lower()]
+    if kind == 'int':
+        return int(text)
+    if kind == 'float':
+        return float(text)
+    if kind == 'floats':
+        return [float(v) for v in text.split(',') if v.strip()]
+    if kind == 'zooms':
+        return [int(z) for z in text.split('-')]
+    if kind == 'range':
+        return [int(v) for v in text.split('-') if v.strip()]
+    if kind == 'strings':
+        return [v.strip() for v in text.split(',') if v.strip()]
+    raise ValueError('Unknown parameter type ' + kind)
+
+
+class Config(object):
+    """ Flags, directories and file names for the processing.  Keyword
+        arguments override the defaults, by [PARAMETERS] name for the flags
+        and by attribute name for the directories. """
+    def __init__(self, **settings):
+        for name, kind, default in PARAMETERS:
+            setattr(self, name, list(default) if isinstance(default, list)
+                    else default)
+        for name, section, key, default in SETTINGS:
+            setattr(self, name, default)
+        known = ({name for name, kind, default in PARAMETERS} |
+                 {setting[0] for setting in SETTINGS})
+        for name, value in settings.items():
+            if name not in known:
+                raise TypeError('Unknown setting ' + name)
+            setattr(self, name, value)
+
+    @classmethod
+    def fromFile(cls, fileName='./config.ini', **settings):
+        """ Config from a config.ini file.  Settings missing from the file
+            keep their defaults, and keyword arguments override both. """
+        parser = configparser.ConfigParser()
+        if not parser.read(fileName):
+            raise FileNotFoundError('No configuration file ' + fileName)
+        values = {}
+        for name, kind, default in PARAMETERS:
+            if parser.has_option('PARAMETERS', name):
+                values[name] = _parse(kind, parser.get('PARAMETERS', name))
+        for name, section, key, default in SETTINGS:
+            if parser.has_option(section, key):
+                values[name] = parser.get(section, key)
+        values.update(settings)
+        return cls(**values)
+
+    def parameters(self):
+        """ The [PARAMETERS] settings as a dictionary """
+        return {name: getattr(self, name) for name, kind, default in PARAMETERS}
+
+    """ Input files """
+    @property
+    def ibtracsFileName(self):
+        return self.dataDir + "/ibtracsData.csv"
+
+    @property
+    def natlFileName(self):
+        return self.dataDir + "/natlData.csv"
+
+    @property
+    def nepacFileName(self):
+        return self.dataDir + "/nepacData.csv"
+
+    @property
+    def hFiles(self):
+        """ HURDAT2 files to read, with hBasin their basins """
+        return [self.natlFileName, self.nepacFileName]
+
+    hBasin = ["NA", "EP"]
+
+    @property
+    def nameMappingFile(self):
+        return self.dataDir + "/nameMapping.txt"
+
+    @property
+    def ensoFileName(self):
+        return self.dataDir + "/ensoData.txt"
+
+    @property
+    def reportFileName(self):
+        return self.dataDir + "/stormreportData.txt"
+
+    @property
+    def landFileName(self):
+        return self.dataDir + "/ne_50m_land"
+
+    """ Output files """
+    @property
+    def logFileName(self):
+        return self.logDir + "/update.log"
+
+    @property
+    def goodSegmentFileName(self):
+        return self.resultsDir + ('/Segments_WebMerc' if self.WEBMERC
+                                  else '/Segments_WGS84')
+
+    @property
+    def goodStormFileName(self):
+        return self.resultsDir + ('/Tracks_WebMerc' if self.WEBMERC
+                                  else '/Tracks_WGS84')
+
+    @property
+    def goodGeoPackageFileName(self):
+        return self.resultsDir + ('/Hurricanes_WebMerc.gpkg' if self.WEBMERC
+                                  else '/Hurricanes_WGS84.gpkg')
+
+    @property
+    def vectorTilesFileName(self):
+        """ Tiles are always Web Mercator """
+        return self.resultsDir + '/Segments.mbtiles'
+
+    @property
+    def namesJS(self):
+        return self.resultsDir + '/stormnames.js'
+
+    @property
+    def yearsJSON(self):
+        return self.resultsDir + '/hurricaneYears.json'
+
+    @property
+    def timeIndexFileName(self):
+        return self.resultsDir + '/timeIndex.npz'
+
+    @property
+    def webExportDir(self):
+        return self.resultsDir + '/web'
+
+    @property
+    def nameIndexDir(self):
+        return self.resultsDir + '/names'
+
+    @property
+    def qaReportFileName(self):
+        return self.resultsDir + '/qaReport.csv'
+
+    @property
+    def manifestFileName(self):
+        return self.resultsDir + '/manifest.csv'
+
+    @property
+    def cellIndexDir(self):
+        return self.resultsDir + '/cells'
+
+    @property
+    def statsFileNames(self):
+        return {'StatsObservations': self.resultsDir + '/statsObservations.csv',
+                'StatsStorms': self.resultsDir + '/statsStorms.csv'}
+
+    def checkpointFileName(self, stage):
+        return self.checkpointDir + '/' + stage + '.pkl'
+
+    """ Output projection """
+    @property
+    def srsID(self):
+        return 3857 if self.WEBMERC else 4326
+
+    @property
+    def srsName(self):
+        return 'WGS 84 / Pseudo-Mercator' if self.WEBMERC else 'WGS 84'
+
+    @property
+    def epsg(self):
+        """ Projection string for the prj files """
+        return WEBMERC_PRJ if self.WEBMERC else WGS84_PRJ
+
+    earthRadius = EARTH_RADIUS
+    earthCircumference = math.pi * 2.0 * EARTH_RADIUS
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Overlapped execution of the independent parts of a stage: functions run on
+background threads, and consumers are fed through bounded queues by the
+loop producing their input, so e.g. the Tracks shapefile is written while
+the storms are still being turned into records.
+
+    executor = Executor()
+    crosswalk = executor.submit('crosswalk', lookups.ibNames, fileName)
+    tracks = executor.consumer('Tracks', writeLines, fileName, fields, epsg)
+    for storm in storms:
+        tracks.put([(coords, params)])
+    tracks.close()
+    numTracks = tracks.result()
+    for line in executor.report(): print(line)
+
+The queues are what tell where the time goes.  A queue that is usually
+full, with its producer waiting on it, means the consumer is the
+bottleneck, and one that is usually empty, with its consumer waiting,
+means the producer is.  report() gives the time each function ran and
+these waits and depths for each queue.
+
+The threads share the interpreter lock, so Python code in them does not
+run at the same time.  What overlaps is the file and database I/O,
+compression and NumPy work, and a stage's parts stop waiting on each
+other.  With one CPU that is not worth the switching between threads,
+and they slow down the worker processes of e.g. the vector tiles, so
+stageExecutor only uses them when there are more.  An Executor made with
+threads=False runs everything in the calling thread in the same order, for
+comparing against and for debugging.
+
+"""
+
+import os
+import queue
+import threading
+import concurrent.futures
+import datetime as dt
+
+""" Items a consumer's queue holds before the producer has to wait """
+QUEUE_DEPTH = 64
+
+""" Put on a queue after the last item """
+_DONE = object()
+
+
+def _seconds(start):
+    return (dt.datetime.now() - start).total_seconds()
+
+
+def stageExecutor(cfg):
+    """ Executor for a stage, with threads if PIPELINE is set and there is
+        more than one CPU """
+    return Executor(cfg.PIPELINE and (os.cpu_count() or 1) > 1)
+
+
+class _Done(object):
+    """ The result of a function run in the calling thread, looking like
+        the concurrent.futures.Future of a background one """
+    def __init__(self, func, args):
+        self._result = self._error = None
+        try:
+            self._result = func(*args)
+        except BaseException as e:
+            self._error = e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def done(self):
+        return True
+
+
+class Channel(object):
+    """ Bounded queue from a producer to a consumer function, with the
+        depth and waiting times of both sides """
+    def __init__(self, name, depth=QUEUE_DEPTH):
+        self.name = name
+        self.queue = queue.Queue(depth)
+        self.depth = depth
+        self.numItems = 0
+        self.depthTotal = 0     # Sum of the depth seen by each put
+        self.numFull = 0        # Puts that found the queue full
+        self.putWait = 0.       # Seconds the producer waited
+        self.getWait = 0.       # Seconds the consumer waited
+        self.failed = False     # The consumer raised, so items are dropped
+        self.future = None
+
+    def put(self, item):
+        """ Hands item to the consumer, waiting if the queue is full """
+        if self.failed:
+            return
+        self.numItems += 1
+        self.depthTotal += self.queue.qsize()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.numFull += 1
+            start = dt.datetime.now()
+            self.queue.put(item)
+            self.putWait += _seconds(start)
+
+    def close(self):
+        """ Tells the consumer there are no more items """
+        self.queue.put(_DONE)
+
+    def items(self):
+        """ The items put, for the consumer, until the queue is closed """
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                start = dt.datetime.now()
+                item = self.queue.get()
+                self.getWait += _seconds(start)
+            if item is _DONE:
+                return
+            yield item
+
+    def _consume(self, func, args):
+        """ Runs the consumer, and if it fails keeps emptying the queue so
+            the producer is never left waiting on it """
+        try:
+            return func(self.items(), *args)
+        except BaseException:
+            self.failed = True
+            for item in self.items():
+                pass
+            raise
+
+    def result(self):
+        """ What the consumer returned, once it has finished """
+        return self.future.result()
+
+    def report(self):
+        """ One line of queue statistics """
+        meanDepth = self.depthTotal/max(self.numItems, 1)
+        if self.putWait > self.getWait:
+            slower = "consumer is the slower side"
+        elif self.getWait > self.putWait:
+            slower = "producer is the slower side"
+        else:
+            slower = "neither side waited"
+        return ("{0}: {1} items, mean depth {2:.1f} of {3}, full {4} times, "
+                "producer waited {5:.1f} s, consumer waited {6:.1f} s, "
+                "{7}".format(self.name, self.numItems, meanDepth, self.depth,
+                             self.numFull, self.putWait, self.getWait, slower))
+
+
+class Executor(object):
+    """ Runs functions and consumers on background threads, or one after
+        the other in the calling thread if threads is False """
+    def __init__(self, threads=True, depth=QUEUE_DEPTH):
+        self.depth = depth
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix='hht') if threads else None
+        self.times = []         # (name, seconds) of each function run
+        self.futures = []       # Futures of everything started
+        self.channels = []
+        self.consumers = []     # Threads of the consumers
+        self.lock = threading.Lock()
+
+    @property
+    def threaded(self):
+        return self.pool is not None
+
+    def _timed(self, name, func, *args):
+        start = dt.datetime.now()
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.times.append((name, _seconds(start)))
+
+    def submit(self, name, func, *args):
+        """ Starts func(*args).  Returns a future of its result. """
+        if self.pool is None:
+            future = _Done(self._timed, (name, func) + args)
+        else:
+            future = self.pool.submit(self._timed, name, func, *args)
+        self.futures.append(future)
+        return future
+
+    def consumer(self, name, func, *args):
+        """ A Channel whose items, until it is closed, are consumed by
+            func(items, *args) """
+        if self.pool is None:
+            return _SerialChannel(name, func, args, self)
+        channel = Channel(name, self.depth)
+        """ On a thread of its own rather than the pool's, since it waits for
+            items for as long as the producer runs.  A daemon, so a producer
+            that fails without closing the channel does not hang the program
+            on exit. """
+        channel.future = concurrent.futures.Future()
+        thread = threading.Thread(target=self._run, name='hht-' + name,
+                                  args=(channel.future, name,
+                                        channel._consume, func, args),
+                                  daemon=True)
+        thread.start()
+        self.consumers.append(thread)
+        self.channels.append(channel)
+        self.futures.append(channel.future)
+        return channel
+
+    def _run(self, future, name, func, *args):
+        """ Runs func(*args) for future """
+        try:
+            future.set_result(self._timed(name, func, *args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def report(self):
+        """ Lines of how long each function ran and how its queues did """
+        lines = ["{0} ran {1:.1f} s".format(name, seconds)
+                 for name, seconds in self.times]
+        return lines + [channel.report() for channel in self.channels]
+
+    def wait(self):
+        """ Waits for everything started to finish, raising the first error
+            any of it had """
+        self.shutdown()
+        for future in self.futures:
+            future.result()
+
+    def shutdown(self):
+        """ Waits for everything started to finish """
+        for thread in self.consumers:
+            thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class _SerialChannel(object):
+    """ A Channel for an Executor without threads.  The items are kept and
+        the consumer runs on all of them when the channel is closed. """
+    def __init__(self, name, func, args, executor):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.executor = executor
+        self.kept = []
+        self.future = None
+
+    def put(self, item):
+        self.kept.append(item)
+
+    def close(self):
+        self.future = self.executor.submit(self.name, self.func,
+                                           iter(self.kept), *self.args)
+        self.kept = None
+
+    def result(self):
+        return self.future.result()
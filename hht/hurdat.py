@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+The HURDAT2 best track files as columns.  A HURDAT2 file is a header line
+for each storm followed by its data lines, e.g.
+    AL011851,            UNNAMED,     14,
+    18510625, 0000,  , HU, 28.0N,  94.8W,  80, -999, -999, -999, ...
+with the date, time, record identifier (L for landfall and so on), status,
+latitude, longitude, wind, pressure, twelve wind radii and, since 2021, the
+radius of maximum wind.
+
+The file is scanned once (see scanner.py) and a field is parsed for every
+data line in one NumPy step: the hemisphere letters become signs, the date
+and time fields times.  Each column is parsed the first time it is used, so
+the ones readHURDAT2 does not need, the record identifiers and radii, cost
+nothing unless asked for.
+
+    with scanner.MappedFile(fileName) as raw:
+        table = hurdat.HurdatTable(raw.block())
+        table = table.select([season >= 2000 for season in table.seasons])
+        for j in range(len(table)):
+            first, last = table.obsRange(j)
+            lats = table.lats[first:last]
+            landfalls = table.records[first:last] == 'L'
+
+"""
+
+import numpy as np
+
+from . import scanner
+
+""" Fields of a data line """
+DATE, TIME, RECORD, STATUS, LAT, LON, WIND, PRESSURE = range(8)
+RADII = range(8, 20)     # 34, 50 and 64 kt, each NE, SE, SW and NW
+MAX_WIND_RADIUS = 20
+
+""" HURDAT2's value for a wind radius or pressure not known """
+MISSING = -999
+
+
+class _Column(object):
+    """ A column of a HurdatTable, parsed the first time it is read and then
+        kept in the table """
+    def __init__(self, parse):
+        self.parse = parse
+        self.__doc__ = parse.__doc__
+
+    def __get__(self, table, owner):
+        if table is None:
+            return self
+        values = table.__dict__[self.parse.__name__] = self.parse(table)
+        return values
+
+
+def _floats(raw):
+    """ Floats of a bytes array, NaN where one does not parse """
+    try:
+        return raw.astype(float)
+    except ValueError:
+        values = []
+        for value in raw.tolist():
+            try:
+                values.append(float(value))
+            except ValueError:
+                values.append(np.nan)
+        return np.array(values, dtype=float)
+
+
+def _integers(raw, missing=MISSING):
+    """ Integers of a bytes array, missing where a field is empty """
+    raw = np.char.strip(raw)
+    return np.where(raw == b'', str(missing).encode(), raw).astype(np.int64)
+
+
+def _position(raw, positive):
+    """ Values of position fields like b' 28.0N', negative unless they end
+        in the letter positive, and NaN where they do not parse """
+    raw = np.char.strip(raw)
+    values = _floats(np.char.rstrip(raw, b'NSEW'))
+    return np.where(np.char.endswith(raw, positive), values, -values)
+
+
+class HurdatTable(object):
+    """ The storms of a Block of a HURDAT2 file, and their observations
+        end to end in the order of the file """
+    def __init__(self, block, headers=None, numObs=None):
+        self.block = block
+        if headers is None:
+            headers, numObs = scanner.hurdatLayout(block)
+        self.headers = headers      # Line index of each storm's header
+        self.numObs = numObs        # Number of data lines after it
+        self.firstObs = np.cumsum(numObs) - numObs
+        """ Line index of every data line """
+        self.dataLines = (np.repeat(headers + 1 - self.firstObs, numObs) +
+                          np.arange(int(numObs.sum()), dtype=np.int64))
+
+    def __len__(self):
+        return len(self.headers)
+
+    def select(self, keep):
+        """ A table of the storms for which keep is True """
+        keep = np.asarray(keep, dtype=bool)
+        return HurdatTable(self.block, self.headers[keep], self.numObs[keep])
+
+    def obsRange(self, j):
+        """ Indexes of the first observation of storm j and the one after its
+            last """
+        first = int(self.firstObs[j])
+        return first, first + int(self.numObs[j])
+
+    def lineText(self, k):
+        """ The data line of observation k, for messages """
+        return self.block.lineText(self.dataLines[k])
+
+    def _header(self, k):
+        return self.block.fieldBytes(k, self.headers)
+
+    def _data(self, k):
+        return self.block.fieldBytes(k, self.dataLines)
+
+    """ Storms """
+
+    @_Column
+    def stormIDs(self):
+        """ HURDAT2 IDs, e.g. AL011851 """
+        return np.char.strip(self._header(0)).astype(str).tolist()
+
+    @_Column
+    def names(self):
+        return np.char.strip(self._header(1)).astype(str).tolist()
+
+    @_Column
+    def declaredObs(self):
+        """ Number of observations given in the headers """
+        return _integers(self._header(2), 0)
+
+    @_Column
+    def seasons(self):
+        """ The year at the end of the IDs """
+        return [int(stormID[-4:]) for stormID in self.stormIDs]
+
+    """ Observations """
+
+    @_Column
+    def times(self):
+        """ Times as datetime64[m] """
+        dates = _integers(self._data(DATE))
+        clock = _integers(self._data(TIME))
+        months = (dates // 10000 - 1970)*12 + dates // 100 % 100 - 1
+        monthStart = months.astype('datetime64[M]')
+        times = monthStart.astype('datetime64[m]') + (
+            (dates % 100 - 1)*1440 + clock // 100*60 +
+            clock % 100).astype('timedelta64[m]')
+        """ A day or time past the end of its month or day rolls over into
+            the next one, so is bad """
+        bad = ((dates // 100 % 100 < 1) | (dates // 100 % 100 > 12) |
+               (dates % 100 < 1) | (clock // 100 > 23) | (clock % 100 > 59) |
+               (times.astype('datetime64[M]') != monthStart))
+        if bad.any():
+            raise ValueError("Bad time in HURDAT2 line: " +
+                             self.lineText(int(np.flatnonzero(bad)[0])))
+        return times
+
+    @_Column
+    def records(self):
+        """ Record identifiers, e.g. L for a landfall, '' for none """
+        return np.char.strip(self._data(RECORD)).astype(str)
+
+    @_Column
+    def natures(self):
+        """ Status, e.g. HU or TS """
+        return np.char.strip(self._data(STATUS)).astype(str).tolist()
+
+    @_Column
+    def lats(self):
+        """ Latitudes, south negative, NaN where bad """
+        return _position(self._data(LAT), b'N')
+
+    @_Column
+    def lons(self):
+        """ Longitudes, west negative, NaN where bad.  Values past 180 east
+            or west, entered the wrong way around, are brought back. """
+        raw = self._data(LON)
+        east = np.char.endswith(np.char.strip(raw), b'E')
+        lons = _position(raw, b'E')
+        lons = np.where(east & (lons > 180.), lons - 360., lons)
+        return np.where(~east & (lons < -180.), lons + 360., lons)
+
+    @_Column
+    def winds(self):
+        """ Maximum sustained winds in knots, -99 where not known """
+        return self._data(WIND).astype(float)
+
+    @_Column
+    def pressures(self):
+        """ Minimum pressures in millibars, -999 where not known """
+        return self._data(PRESSURE).astype(float)
+
+    @_Column
+    def radii(self):
+        """ Wind radii in nautical miles, by observation, 34, 50 and 64 kt
+            and NE, SE, SW and NW, MISSING where not known """
+        return np.stack([_integers(self._data(k)) for k in RADII],
+                        axis=1).reshape(-1, 3, 4)
+
+    @_Column
+    def maxWindRadius(self):
+        """ Radius of maximum wind in nautical miles, MISSING where not
+            known or before the field was added """
+        return _integers(self._data(MAX_WIND_RADIUS))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Lookup tables used while processing the storms.  Each is read the first
+time it is asked for and kept for later calls with the same file.
+
+"""
+
+import functools
+
+import loadENSODict # Local python module
+import loadStormReportDict # Local python module
+import coastline # Local python module
+
+""" Storm Data Page links, by IBTrACS ID """
+detailsBaseURL = "http://ibtracs.unca.edu/index.php?name=v04r00-"
+
+""" Storm report entry for storms with no report """
+Missing = [None, None]
+
+
+@functools.lru_cache(maxsize=None)
+def ensoLookup(fileName):
+    """ ENSO stage by YYYY-MM key, from the data set at:
+ http://www.cpc.ncep.noaa.gov/products/analysis_monitoring/ensostuff/detrend.nino34.ascii.txt
+ For more information on the ENSO index, check out the CPC pages at:
+ http://www.cpc.ncep.noaa.gov/products/analysis_monitoring/ensostuff/ensoyears.shtml
+ http://www.cpc.ncep.noaa.gov/products/analysis_monitoring/ensostuff/ONI_change.shtml
+    """
+    return loadENSODict.ensoDict(fileName)
+
+
+@functools.lru_cache(maxsize=None)
+def reportLookup(fileName):
+    """ NHC Storm report [URL, basin] by storm name and year, from:
+             http://www.nhc.noaa.gov/TCR_StormReportsIndex.xml (DLE)
+    """
+    return loadStormReportDict.rptDict(fileName)
+
+
+@functools.lru_cache(maxsize=None)
+def ibNames(fileName):
+    """ Crosswalk table used to replace HURDAT2 IDs with IBTrACS IDs, which
+        are also used to construct links for Storm Data Pages from
+        http://ibtracs.unca.edu/index.php?name=...
+        Keys are the crosswalk's HURDAT2 and ATCF IDs. """
+    ibName = {}
+    with open(fileName, 'r') as cwFile:
+        for lineVals in cwFile:
+            vals = lineVals.split()
+            if "multiple" in lineVals:
+                """ When storms are in multiple basins, use the ATCF IDs,
+                NOTE BENE: there can be more than one! """
+                atcfID = [s for s in vals if "atcf" in s]
+                for thisID in (atcfID):
+                    thisKey = thisID[:-6]
+                    ibName[thisKey] = vals[0].strip()
+            elif "hurdat" in lineVals:
+                ibName[vals[1]] = vals[0].strip()
+    return ibName
+
+
+@functools.lru_cache(maxsize=None)
+def landIndex(fileName):
+    """ Grid index of the land polygons in the shapefile fileName """
+    return coastline.LandIndex.fromShapefile(fileName)
@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+"""
+The write stage: the Tracks and Segments shapefiles and every other output
+made from the processed storms, and the summary of the run for the log.
+
+"""
+
+import os
+import math
+import random
+import json
+import datetime as dt
+import shapefile
+
+import writeGeoPackage # Local python module
+import loadPostGIS # Local python module
+import timeIndex # Local python module
+import simplifyTracks # Local python module
+import vectorTiles # Local python module
+import webExport # Local python module
+import nameIndex # Local python module
+import statsCube # Local python module
+import kinematics # Local python module
+import coastline # Local python module
+import cellIndex # Local python module
+import stormManifest # Local python module
+
+from . import lookups
+from .storms import numberSegments
+from .executor import stageExecutor
+
+""" Attributes of the Tracks """
+stormFields = [
+               ['STORM_ID','C','56'],
+               ['NAME','C','81'],
+               ['BEGIN_DATE','D','8'],
+               ['END_DATE','D','8'],
+               ['MAX_WIND','N','9'],
+               ['MIN_PRESS','N','10'],
+               ['MAXSSSCALE','C','5'],
+               ['BASIN','C','10'],
+               ['YEARS','C','10'],
+               ['MONTHS','C','10'],
+               ['NHC_URL','C','254'],
+               ['IBTRACSURL','C','254'],
+               ['LF_TIME','C','16'],
+               ['LF_LAT','N','7',2],
+               ['LF_LON','N','8',2]
+            #    ['DateRange','C','140'],
+            #    ['FiltBasins','C','10'],
+            #    ['FiltMaxSS','C','10'],
+            #    ['In10sOrder','N','10'], # End of Previous Attributes
+            #    ['NumObs','C','10'],
+            #    ['ENSO','C','10']
+               ]
+#==============================================================================
+# stormFields = ['UID','Name','StartDate','EndDate','MaxWind','MinPress',
+#                'NumObs','MaxSaffir','ENSO']
+#==============================================================================
+
+""" For SEGMENTS : """
+segmentFields = [
+                 ['SEGMENT_ID','N','16'],
+                 ['STORM_ID','C','58'],
+                 ['NAME','C','150'],
+                 ['TIME','C','20'],
+                 ['MAX_WIND','N','9'],
+                 ['MIN_PRESS','N','10'],
+                 ['SS_SCALE','C','5'],
+                 ['BASIN','C','5'],
+                 ['BEGIN_LAT','C','10'],
+                 ['BEGIN_LON','C','10'],
+                 ['END_LAT','C','20'],
+                 ['END_LON','C','20'],
+                 ['ENSO_STAGE','C','5'],
+                 ['AMM_STAGE','C','5'],
+                 ['PDO_STAGE','C','5'],
+                 ['AMO_STAGE','C','5'],
+                 ['LENGTH_NM','N','10',1],
+                 ['SPEED_KT','N','7',1],
+                 ['HEADING','N','6',1],
+                 ['LANDFALL','N','1'],
+                 ['COASTAL','N','1']
+                #  ['DMSW_1min','C','10'],
+                #  ['BeginObHr','N','9'],
+                #  ['DispDate','C','20'],
+                #  ['DMin_Press','C','10'],
+                #  ['DDateNTime','C','20'],
+                #  ['SegmntOrdr','N','12'],#End of previous attributes
+                #  ['Nature','C','20'],
+                 ]
+
+
+def writeLines(batches, fileName, fields, epsg):
+    """ Writes a line shapefile, and its prj file, from batches (lists) of
+        the (coordinates, attributes) of its records.  Returns the number
+        of records. """
+    lines = shapefile.Writer(fileName)
+    lines.autoBalance = 1 # make sure all shapes have records
+    for attribute in fields:
+        lines.field(*attribute) # Add Fields
+    numLines = 0
+    for batch in batches:
+        for coords, params in batch:
+            lines.line(coords)
+            lines.record(*params)
+            numLines += 1
+    lines.close()
+    # create the PRJ file
+    prj = open("%s.prj" % fileName, "w")
+    prj.write(epsg)
+    prj.close()
+    return numLines
+
+
+def writeNames(cfg, stormNames, stormYears, stormNameIndex):
+    """ The JSON/js files of the unique storm names and years, and the name
+        search shards.  Returns the line for the log. """
+    uniqueNames = sorted(list(set(stormNames)))
+    uniqueYears = sorted(list(set(stormYears)))
+    uniqueYears[:0] = ['All']
+    fNamesJS = open(cfg.namesJS,'w')
+    nameString = 'var stormnames = ' + json.dumps(uniqueNames)
+    fNamesJS.write(nameString)
+    fNamesJS.close()
+    fYears = open(cfg.yearsJSON,'w')
+    json.dump(uniqueYears,fYears)
+    fYears.close()
+    """ The same names as prefix shards for the name search """
+    numShards, largestShard = stormNameIndex.write(cfg.nameIndexDir)
+    return "Name index: {0} unique names in {1} shards, largest {2:.1f} KB".format(
+        len(uniqueNames), numShards, largestShard/1.e3)
+
+
+def write(allStorms, cfg, counts, logFile):
+    """ Writes every output for the storms from the qa stage, then the
+        summary of the run using counts from all of the stages.  Returns
+        counts with those of this stage added.
+
+        With PIPELINE, and more than one CPU, the Tracks and Segments
+        shapefiles are written on background threads as the records are
+        made, and the other outputs on more threads once the records they
+        need are ready.  Their lines in the log are written in the same
+        order either way. """
+    writeStart = dt.datetime.now()
+    executor = stageExecutor(cfg)
+    ensoLookup = lookups.ensoLookup(cfg.ensoFileName)
+    rptLookup = lookups.reportLookup(cfg.reportFileName)
+    Missing = lookups.Missing
+    detailsBaseURL = lookups.detailsBaseURL
+
+    """ The Tracks shapefile, one line & record per storm, is written as
+        the storms are done.  So is the Segments shapefile, unless it is
+        scrambled and has to wait for all of them. """
+    goodTracks = executor.consumer('Tracks', writeLines, cfg.goodStormFileName,
+                                   stormFields, cfg.epsg)
+    goodSegments = None
+    if not cfg.SCRAMBLE:
+        goodSegments = executor.consumer('Segments', writeLines,
+                                         cfg.goodSegmentFileName,
+                                         segmentFields, cfg.epsg)
+    """Lists needed for SCRAMBLING Segments """
+    goodSegCoords = []
+    goodSegParams = []
+    goodSegNum = 0
+    goodSegIndx = []
+    goodSegYears = []
+    """Lists needed for the GeoPackage Tracks """
+    goodTrackCoords = []
+    goodTrackParams = []
+    goodTrackCats = [] # Saffir-Simpson code at each track vertex, for simplifying
+    manifestRows = [] # One row per storm with a hash of what was written
+
+    stormOID = 0 # Counter to make unique ID number for each storm
+    numberSegments(allStorms) # Unique ID number for each segment
+    numTrackVerts = 0 # Vertices written to the Tracks shapefile
+    numTrackParts = 0 # Parts written to the Tracks shapefile
+    numSplitVerts = 0 # Vertices the old one-part-per-segment Tracks would have had
+
+    """ Length, forward speed and heading of every segment, in the same
+        storm and segment order as goodSegNum """
+    segLengths, segSpeeds, segHeadings = kinematics.segmentKinematics(allStorms)
+
+    """ Landfall and coastal flags of every segment, in the same order, and
+        the first landfall of each storm.  Left empty if there is no land file. """
+    segLandfall = segCoastal = [None]*len(segLengths)
+    stormLandfalls = [None]*len(allStorms)
+    if cfg.LANDFALL:
+        if os.path.exists(cfg.landFileName + '.shp'):
+            landStart = dt.datetime.now()
+            landIndex = lookups.landIndex(cfg.landFileName)
+            segLandfall, segCoastal, stormLandfalls = coastline.tagStorms(
+                allStorms, landIndex, cfg.COASTAL_NM)
+            segLandfall = segLandfall.tolist()
+            segCoastal = segCoastal.tolist()
+            landReport = ("LANDFALL: {0} landfall segments, {1} coastal segments, "
+                          "{2} storms made landfall, in {3:.1f} s".format(
+                              sum(segLandfall), sum(segCoastal),
+                              sum(lf is not None for lf in stormLandfalls),
+                              (dt.datetime.now() - landStart).total_seconds()))
+        else:
+            landReport = ("LANDFALL: no land polygons at " + cfg.landFileName +
+                          ".shp, landfall attributes left empty")
+        print("\n" + landReport)
+        logFile.write("\n\n" + landReport)
+
+    """ Make lists for names and years.  Needed for JSON files used by HHT site."""
+    stormNames = []
+    stormYears = []
+    stormNameIndex = nameIndex.NameIndex()
+    numGoodObs = 0
+
+    """ YEARS and MONTHS filter strings for all storms at once """
+    stormFiltYrs, stormFiltMons = timeIndex.filterStrings(
+        [storm.segs[0].time for storm in allStorms],
+        [storm.segs[len(storm.segs)-1].time for storm in allStorms])
+
+    for i, storm in enumerate(allStorms):
+        stormOID = stormOID + 1
+        basin = storm.basin
+        trackCoords = [] # Create list for stormTracks shapefile
+        trackPart = []   # Current continuous part of this storm's track
+        trackCats = []   # Saffir-Simpson code of the segment leaving each vertex
+        trackPartCats = []
+        jLast = len(storm.segs)-1
+        firstSegNum = goodSegNum
+
+        for j, thisSegment in enumerate(storm.segs):
+            segmentOID = storm.firstSegmentID + j
+
+            """ Check for segments spanning the 180 degree line. If they do
+                and BREAK180 is true, create multi-part segments. """
+            if abs(thisSegment.startLon - thisSegment.endLon) > 270.:
+                if cfg.BREAK180:
+                    """ Find new broken coordinates, then convert to webmerc if
+                        needed """
+                    sLon = thisSegment.startLon
+                    sLat = thisSegment.startLat
+                    eLon = thisSegment.endLon
+                    eLat = thisSegment.endLat
+                    mwLon = math.copysign(180.0,sLon)
+                    meLon = math.copysign(180.0,eLon)
+                    """ Interpolate Lat to 180 """
+                    deltaLon = thisSegment.startLon - (
+                    (math.copysign(360.0,thisSegment.startLon)
+                         + thisSegment.endLon)) # Makes Start & end lons same sign
+                    mLat = sLat + (sLat - eLat)* ((thisSegment.startLon -
+                        math.copysign(180.0,thisSegment.startLon))/
+                            deltaLon )
+
+                """ Project to web mercator if need, otherwise just geographic"""
+                if cfg.WEBMERC:
+                    sLon = cfg.earthRadius * sLon * math.pi/180
+                    sLat = cfg.earthRadius * math.log(math.tan((math.pi/4) + (
+                        (sLat*math.pi/180)/2)))
+                    eLon = cfg.earthRadius * eLon * math.pi/180
+                    eLat = cfg.earthRadius * math.log(math.tan((math.pi/4) + (
+                        (eLat*math.pi/180)/2)))
+                    mwLon = cfg.earthRadius * mwLon * math.pi/180
+                    meLon = cfg.earthRadius * meLon * math.pi/180
+                    try:
+                        mLat = cfg.earthRadius * math.log(math.tan((math.pi/4) + (
+                            (mLat*math.pi/180)/2)))
+                    except ValueError:
+                        raise ValueError(
+                            "Bad latitude {0} at 180 for storm {1} (source {2}) "
+                            "segment {3}".format(mLat, storm.uid, storm.source, j))
+
+                """ Done with Web Mercator projection if needed.
+                    Now put the coordinates into the appropriate lists. """
+                """ SEGMENT Coordinates """
+                segCoords = [[[sLon, sLat],[mwLon,mLat]],
+                             [[meLon,mLat],[eLon, eLat]]]
+
+                """ Add coordinates to the Track shapefile list.  The current
+                    part ends at 180 and a new part starts on the other side. """
+                if not trackPart:
+                    trackPart.append([sLon, sLat])
+                    trackPartCats.append(thisSegment.saffir)
+                trackPart.append([mwLon,mLat])
+                trackPartCats.append(thisSegment.saffir)
+                trackCoords.append(trackPart)
+                trackCats.append(trackPartCats)
+                trackPart = [[meLon,mLat],[eLon, eLat]]
+                trackPartCats = [thisSegment.saffir, storm.segs[j+1].saffir]
+                numSplitVerts += 4
+            else:
+                """ Project to web mercator if need, otherwise just geographic"""
+                if cfg.WEBMERC:
+                    sLon = cfg.earthRadius * thisSegment.startLon * math.pi/180
+                    sLat = cfg.earthRadius * math.log(
+                        math.tan((math.pi/4) + ((thisSegment.startLat*math.pi/180)/2)))
+                    eLon = cfg.earthRadius * thisSegment.endLon * math.pi/180
+                    try:
+                        eLat = cfg.earthRadius * math.log(
+                            math.tan((math.pi/4) + ((thisSegment.endLat*math.pi/180)/2)))
+                    except:
+                        print(storm.name, sLon, sLat, thisSegment.endLat)
+                else:
+                    sLon = thisSegment.startLon
+                    sLat = thisSegment.startLat
+                    eLon = thisSegment.endLon
+                    eLat = thisSegment.endLat
+                segCoords = [[[sLon, sLat],[eLon, eLat]]]
+
+                """ Add coordinates to the Track shapefile list.  Segments
+                    share end points, so only the end is added to the current
+                    part.  The last segment just ends at the storm's final
+                    observation (or its offset), so it adds nothing to the track. """
+                if j < jLast:
+                    if not trackPart:
+                        trackPart.append([sLon, sLat])
+                        trackPartCats.append(thisSegment.saffir)
+                    trackPart.append([eLon, eLat])
+                    trackPartCats.append(storm.segs[j+1].saffir)
+                numSplitVerts += 2
+
+            """ We need to output these attributes:
+            ['STORMID','MSW_1min','BeginObHr','BeginLat','BEGINLON',
+                     'Min_Press',
+                     'Basin','SS_Scale','DateNTime','DMSW_1min',
+                     'DispName','DispDate','DMin_Press','DDateNTime', #End of previous attributes
+                     'Nature','ENSO',
+                     'EndLon','EndLat'] """
+            """ Extra values to match old (pre-2015) database structure """
+    #        basin = rptLookup.get(storm.name,Missing)[1]
+            begObsHour = dt.datetime.strftime(thisSegment.time,'%H%M')
+            dateTime = dt.datetime.strftime(thisSegment.time,'%m/%d/%Y %H')
+            dispDate = dt.datetime.strftime(thisSegment.time,'%b %d, %Y')
+            dispDateTime = dt.datetime.strftime(thisSegment.time,'%b %d, %Y %Hz')
+
+
+            """ Add this segment's data to the appropriate segments shapefile """
+            goodSegCoords.append(segCoords)
+            goodSegParams.append([segmentOID,     # Storm Object ID,
+                           storm.uid,           # Storm ID
+                           storm.name,          # Display Storm Name
+                           dateTime,            # Date and Time
+                           thisSegment.wsp,     # Max. Sustained Wind
+                           thisSegment.pres,    # Min Pressure
+                           thisSegment.saffir,  # Saffir Simpson Scale
+                           basin,               # Basin
+                           thisSegment.startLat,# Begin Lat
+                           thisSegment.startLon,# Begin Long.
+                           thisSegment.endLat,  # End Lat
+                           thisSegment.endLon,
+                           thisSegment.enso,    # ENSO Flag
+                           thisSegment.amm,    # ENSO Flag
+                           thisSegment.pdo,   # ENSO Flag
+                           thisSegment.amo,    # ENSO Flag
+                           round(float(segLengths[goodSegNum]), 1), # Great circle length
+                           round(float(segSpeeds[goodSegNum]), 1),  # Forward speed
+                           round(float(segHeadings[goodSegNum]), 1), # Heading
+                           segLandfall[goodSegNum], # Crosses the coast from sea
+                           segCoastal[goodSegNum]   # Over or near land
+                        #    thisSegment.wsp,     # Display Max. Sustained Wind
+                        #    thisSegment.nature,  # Nature (not quite SS)
+                        #    dispDate,            # Display Date
+                        #    thisSegment.pres,    # Display Min Pressure
+                        #    dispDateTime,        # Display Date and Time
+                        #    goodSegNum,          # Segment Order, a unique ID
+                        #     begObsHour,          # Begin Observation Hour Why?
+                           ] )  # End Long.
+            goodSegYears.append(thisSegment.time.year)
+            goodSegIndx.append(goodSegNum)
+            goodSegNum += 1
+
+
+        """ Find ENSO state for start of the storm """
+        thisKey = storm.segs[0].time.strftime('%Y-%m')
+        storm.enso = ensoLookup.get(thisKey) if ensoLookup.get(thisKey) != None else "U"
+
+        """ Extra values to match old (pre-2015) database structure """
+        rptURL = rptLookup.get(storm.name,Missing)[0]
+        detailsURL = detailsBaseURL + storm.uid
+        strmStart = storm.segs[0].time
+        strmEnd = storm.segs[len(storm.segs)-1].time
+
+        dateRng = dt.datetime.strftime(strmStart,'%b %d, %Y to ') + \
+                  dt.datetime.strftime(strmEnd,'%b %d, %Y')
+        filtYrs = stormFiltYrs[i]
+        filtMons = stormFiltMons[i]
+
+        intensOrder = 0
+        filtClimReg = "Dummy"
+        begObDate = dt.datetime.strftime(storm.startTime,'%Y%m%d')
+        endObDate = dt.datetime.strftime(storm.endTime,'%Y%m%d')
+        """   --------  End of Extra fields   ------------    """
+        lfTime = lfLat = lfLon = None
+        if stormLandfalls[i] is not None:
+            lfTime = stormLandfalls[i][0].strftime('%Y-%m-%d %H:%M')
+            lfLat = round(float(stormLandfalls[i][1]), 2)
+            lfLon = round(float(stormLandfalls[i][2]), 2)
+        """ Close out the last part of the track """
+        if len(trackPart) > 1:
+            trackCoords.append(trackPart)
+            trackCats.append(trackPartCats)
+        numTrackParts += len(trackCoords)
+        numTrackVerts += sum(len(part) for part in trackCoords)
+        """ Append track to appropriate stormTracks list """
+        numGoodObs += 1
+        trackParams = [#stormOID,     # Storm Object ID,
+                       storm.uid,       # Storm_ID
+                       storm.name,      # Display Storm Name
+                       begObDate, # Begin Observation Date
+                       endObDate,   # End Observation Date
+                       storm.maxW,      # Max Sustained WInd, 1 min ave period
+                       storm.minP,      # Filter Param: Minimum Pressure
+                       storm.maxSaffir, # Display Saffir Simpson
+                       basin,           # Basin
+                       filtYrs,         # Filter Param. Years
+                       filtMons,        # Filter Param. Months
+                       rptURL,          # Storm Report URL
+                       detailsURL,          # Storm Report URL
+                       lfTime,          # First landfall time
+                       lfLat,           # First landfall latitude
+                       lfLon            # First landfall longitude
+                    #    filtClimReg,     # Filter Param. Climate Regions
+                    #    storm.maxSaffir, # Filter Param. Saffir Simpson 2 letter
+                    #    storm.enso,
+                    #    intensOrder,        # Intensity Order (numeric)
+                    #    # Extra Attributes below
+                    #    dateRng,         # Display Date Range
+                    #    storm.numSegs,   # Number of segments in this Track
+                       ]      # ENSO Flag
+        goodTracks.put([(trackCoords, trackParams)]) # Add the shape and record
+        if goodSegments is not None:
+            goodSegments.put(list(zip(goodSegCoords[firstSegNum:goodSegNum],
+                                      goodSegParams[firstSegNum:goodSegNum])))
+        goodTrackCoords.append(trackCoords)
+        goodTrackCats.append(trackCats)
+        goodTrackParams.append(trackParams + [storm.startTime.year])
+        manifestRows.append([storm.uid, basin, storm.name, storm.startTime.year,
+                             goodSegNum - firstSegNum, storm.firstSegmentID,
+                             stormManifest.stormHash(
+                                 trackCoords, trackParams,
+                                 goodSegCoords[firstSegNum:goodSegNum],
+                                 goodSegParams[firstSegNum:goodSegNum])])
+
+        """ Append the names and the begin and end years to lists so that
+            JSON files of the unique names and years can be created for use
+            in the HHT web application """
+        stormNames.append(storm.name)
+        stormNameIndex.add(storm.name, storm.uid, basin, storm.startTime.year)
+        stormYears.append(dt.datetime.strftime(storm.startTime,'%Y') )
+        stormYears.append(dt.datetime.strftime(storm.endTime,'%Y') )
+
+
+    goodTracks.close()
+
+    """ Save the time index of storm lifetimes and segment times.  goodSegParams
+        are still in storm order, before any scrambling. """
+    executor.submit('time index', timeIndex.TimeIndex.fromStorms(
+        allStorms, [params[0] for params in goodSegParams]).save,
+        cfg.timeIndexFileName)
+
+    """ Manifest of the storms, to find what changed since another run """
+    executor.submit('manifest', stormManifest.writeManifest,
+                    cfg.manifestFileName, manifestRows)
+
+    """ All done, so """
+    """Then scramble Segments if needed.
+        Then populate Segments shapefile"""
+    if (cfg.SCRAMBLE):
+        random.Random(cfg.SCRAMBLE_SEED).shuffle(goodSegIndx)
+        executor.submit('Segments', writeLines,
+                        [[(goodSegCoords[i], goodSegParams[i])
+                          for i in goodSegIndx]],
+                        cfg.goodSegmentFileName, segmentFields, cfg.epsg)
+    else:
+        goodSegments.close()
+
+    """ Outputs from the storms alone can start now """
+    jsonOutputs = []
+    if cfg.WEB_EXPORT:
+        jsonOutputs.append(('web export', executor.submit(
+            'web export', webExport.writeWebExport, cfg.webExportDir, allStorms)))
+    if cfg.CELL_INDEX:
+        jsonOutputs.append(('cell index', executor.submit(
+            'cell index', _timed, cellIndex.writeCellIndex,
+            cfg.cellIndexDir, allStorms, cfg.CELL_SIZE)))
+    jsonOutputs.append(('names', executor.submit(
+        'names', writeNames, cfg, stormNames, stormYears, stormNameIndex)))
+    if cfg.STATS:
+        statsFuture = executor.submit('stats', _buildStats, cfg, allStorms)
+
+    """ Generalized Tracks, one shapefile per tolerance, with the same
+        attributes as Tracks.  Tolerances are in degrees, so scale them to
+        meters for Web Mercator. """
+    simplifiedCoords = []
+    simplifiedParams = []
+    for level, tolerance in enumerate(cfg.SIMPLIFY_TOLERANCES, start=1):
+        outTolerance = tolerance*cfg.earthCircumference/360. if cfg.WEBMERC else tolerance
+        levelCoords, vertsBefore, vertsAfter = simplifyTracks.simplifyTracks(
+            goodTrackCoords, goodTrackCats, outTolerance)
+        executor.submit('Tracks_S%d' % level, writeLines,
+                        [[(coords, params[:len(stormFields)])
+                          for coords, params in zip(levelCoords, goodTrackParams)]],
+                        cfg.goodStormFileName + '_S%d' % level, stormFields,
+                        cfg.epsg)
+        simplifiedCoords += levelCoords
+        simplifiedParams += [params + [level, tolerance] for params in goodTrackParams]
+        levelReport = ("SIMPLIFIED TRACKS level {0}, tolerance {1} deg: {2} of {3} "
+                       "vertices kept, {4:.1f}% reduction".format(
+                           level, tolerance, vertsAfter, vertsBefore,
+                           100.*(vertsBefore - vertsAfter)/max(vertsBefore, 1)))
+        print("\n" + levelReport)
+        logFile.write("\n\n" + levelReport)
+
+    """ The same Tracks and Segments, in the same order, for the GeoPackage
+        and database outputs.  Both tables get an integer YEAR column so that
+        year can be indexed. """
+    outputLayers = [{'name': 'Tracks',
+                     'fields': stormFields + [['YEAR','N','4']],
+                     'coords': goodTrackCoords,
+                     'records': goodTrackParams,
+                     'types': {'YEAR': 'INTEGER'},
+                     'indexes': ['STORM_ID', 'BASIN', 'YEAR', 'MAXSSSCALE']},
+                    {'name': 'Segments',
+                     'fields': segmentFields + [['YEAR','N','4']],
+                     'coords': [goodSegCoords[i] for i in goodSegIndx],
+                     'records': [goodSegParams[i] + [goodSegYears[i]]
+                                 for i in goodSegIndx],
+                     'types': {'SEGMENT_ID': 'INTEGER', 'YEAR': 'INTEGER'},
+                     'indexes': ['STORM_ID', 'BASIN', 'YEAR', 'SS_SCALE']}]
+    if cfg.SIMPLIFY_TOLERANCES:
+        outputLayers.append({'name': 'TracksSimplified',
+                     'fields': stormFields + [['YEAR','N','4'], ['LEVEL','N','2'],
+                                              ['TOLERANCE','N','10']],
+                     'coords': simplifiedCoords,
+                     'records': simplifiedParams,
+                     'types': {'YEAR': 'INTEGER', 'LEVEL': 'INTEGER'},
+                     'indexes': ['STORM_ID', 'YEAR', 'LEVEL']})
+
+    """ Summary tables go in the GeoPackage too, but not the database """
+    statsLayers = []
+    if cfg.STATS:
+        statsLayers, statsReport = statsFuture.result()
+        print("\n" + statsReport)
+        logFile.write("\n\n" + statsReport)
+
+    if cfg.GEOPACKAGE:
+        gpkgFuture = executor.submit(
+            'GeoPackage', writeGeoPackage.writeGeoPackage,
+            cfg.goodGeoPackageFileName, cfg.srsID, cfg.srsName, cfg.epsg,
+            outputLayers + statsLayers)
+    if cfg.LOAD_POSTGIS:
+        pgFuture = executor.submit('PostGIS', loadPostGIS.loadPostGIS, cfg.dsn,
+                                   cfg.schema, cfg.srsID, outputLayers)
+
+    if cfg.GEOPACKAGE:
+        gpkgCounts = gpkgFuture.result()
+        print("\nGeoPackage {0} written with {1} Tracks and {2} Segments".format(
+            cfg.goodGeoPackageFileName, gpkgCounts['Tracks'], gpkgCounts['Segments']))
+
+    jsonOutputs = dict((name, future.result()) for name, future in jsonOutputs)
+    if cfg.WEB_EXPORT:
+        webSizes = jsonOutputs['web export']
+        webReport = ("WEB EXPORT: {0} storms in {1} yearly files, {2:.1f} MB, "
+                     "{3:.1f} MB gzipped".format(
+                         sum(s[0] for s in webSizes.values()), len(webSizes),
+                         sum(s[1] for s in webSizes.values())/1.e6,
+                         sum(s[2] for s in webSizes.values())/1.e6))
+        print("\n" + webReport)
+        logFile.write("\n\n" + webReport)
+
+    if cfg.CELL_INDEX:
+        (numCellShards, numCellDeleted, numCellChanged), cellSeconds = \
+            jsonOutputs['cell index']
+        cellReport = ("CELL INDEX: {0} storms changed, {1} shards written, "
+                      "{2} shards removed in {3:.1f} s".format(
+                          numCellChanged, numCellShards, numCellDeleted,
+                          cellSeconds))
+        print("\n" + cellReport)
+        logFile.write("\n\n" + cellReport)
+
+    if cfg.LOAD_POSTGIS:
+        pgStats = pgFuture.result()
+        for table in pgStats:
+            logFile.write("\n\nPostGIS: " + str(pgStats[table][0]) + " " + table +
+                          " rows loaded in " + "%.1f" % pgStats[table][1] + " s")
+
+    """JSON/js files for unique storm names and unique years."""
+    print("\n" + jsonOutputs['names'])
+
+    """ Wait for the rest, raising any error they had """
+    executor.wait()
+
+    """ The vector tiles are built by forked worker processes, so only once
+        the other threads have finished, as a fork copies the locks they
+        hold """
+    if cfg.VECTOR_TILES:
+        (numBuilt, numDeleted, numChanged), tileSeconds = _timed(
+            vectorTiles.writeVectorTiles, cfg.vectorTilesFileName,
+            goodSegCoords, goodSegParams, segmentFields, cfg.TILE_ZOOMS[0],
+            cfg.TILE_ZOOMS[-1], cfg.WEBMERC, cfg.WORKERS)
+        tileReport = ("VECTOR TILES: {0} storms changed, {1} tiles rebuilt, "
+                      "{2} tiles removed in {3:.1f} s".format(
+                          numChanged, numBuilt, numDeleted, tileSeconds))
+        print("\n" + tileReport)
+        logFile.write("\n\n" + tileReport)
+
+    if executor.threaded:
+        pipelineReport = "PIPELINE: write stage in {0:.1f} s\n    ".format(
+            (dt.datetime.now() - writeStart).total_seconds()) + \
+            "\n    ".join(executor.report())
+        print("\n" + pipelineReport)
+        logFile.write("\n\n" + pipelineReport)
+
+    counts = dict(counts, numTrackParts=numTrackParts,
+                  numTrackVerts=numTrackVerts, numSplitVerts=numSplitVerts,
+                  numGoodObs=numGoodObs)
+    writeSummary(counts, logFile)
+    return counts
+
+
+def _timed(func, *args):
+    """ (func(*args), seconds it took) """
+    start = dt.datetime.now()
+    return func(*args), (dt.datetime.now() - start).total_seconds()
+
+
+def _buildStats(cfg, allStorms):
+    """ The summary tables, written to CSV, and the line for the log """
+    statsLayers = statsCube.buildStats(allStorms)
+    for layer in statsLayers:
+        statsCube.writeCSV(cfg.statsFileNames[layer['name']], layer)
+    statsReport = ("STATS: {0} observation rows, {1} storm rows, "
+                   "total ACE {2:.1f}".format(
+                       len(statsLayers[0]['records']),
+                       len(statsLayers[1]['records']),
+                       sum(rec[6] for rec in statsLayers[1]['records'])))
+    return statsLayers, statsReport
+
+
+def writeSummary(counts, logFile):
+    """ Prints the counts from all of the stages and writes them to the log """
+    ibNum, ibSkipNum, hstormNum = (counts['ibNum'], counts['ibSkipNum'],
+                                   counts['hstormNum'])
+    numSinglePoint, numMultiObs = counts['numSinglePoint'], counts['numMultiObs']
+    nDups, nUnique = counts['nDups'], counts['nUnique']
+    qaReport = counts['qaReport']
+    numTrackParts, numTrackVerts, numSplitVerts = (counts['numTrackParts'],
+        counts['numTrackVerts'], counts['numSplitVerts'])
+    numGoodObs = counts['numGoodObs']
+
+    print("\n    All IBTrACS: {0}, Skipped NA and EP: {1}, Used: {2}".format(
+            ibNum, ibSkipNum, ibNum-ibSkipNum),
+            "\n    HURDAT2_ATL: {0}, HURDAT2_NEPAC: {1}".format(
+            hstormNum[0], hstormNum[1]),
+            "\nQA: TOTAL STORMS INGESTED = {0}\n".format(
+            (ibNum-ibSkipNum)+hstormNum[0]+hstormNum[1]),
+            "\nQA: Single Obs storms removed: {0}, Multi-Obs storms kept: {1}"
+            .format(numSinglePoint,numMultiObs),
+            "\n    STORMS LENGTH CHECKED = {0} \n    (Should equal total ingested.)\n"
+            .format(numMultiObs+numSinglePoint),
+            "\nQA: Duplicate storms removed: {0}, Unique storms = {1}"
+            .format(nDups,nUnique),
+            "\n    STORMS PROCESSED for DUPLICATES = {0}\n".format(
+            nDups+nUnique),
+            "   (This should equal number of Multi-obs storms.)")
+    print ("\n" + qaReport)
+    if counts.get('provisionalNames'):
+        print("\nPROVISIONAL: left out " +
+              ", ".join(counts['provisionalNames']))
+    if counts.get('refreshReport'):
+        print("\n" + counts['refreshReport'])
+    if counts.get('ingestReport'):
+        print("\n" + counts['ingestReport'])
+    print("\nTRACKS: {0} parts, {1} vertices written, {2} vertices removed "
+          "by merging segments".format(numTrackParts, numTrackVerts,
+                                       numSplitVerts - numTrackVerts))
+    print("\n\nQA: If the above QA numbers are consistent, there will be " +
+                  str(numGoodObs) + ' unique storms in the shapefiles')
+
+    logFile.write("\n    All IBTrACS: "+str(ibNum) +
+                  " Skipped NA and EP: " + str(ibSkipNum) +
+                  ", Used: " + str(ibNum-ibSkipNum) +
+                  "\n    HURDAT2_ATL: " + str(hstormNum[0]) +
+                  " HURDAT2_NEPAC: " + str( hstormNum[1]) +
+                  "\nQA: TOTAL STORMS INGESTED (sum IBTracs USED and HURDAT2) = " +
+                  str(ibNum-ibSkipNum+hstormNum[0]+hstormNum[1]))
+    logFile.write("\n\nQA: Single Obs storms removed: " + str(numSinglePoint) +
+                  " Multi-Obs storms kept: " + str(numMultiObs) +
+                  "\n    SUM OF STORMS LENGTH CHECKED = " + str(numMultiObs+numSinglePoint) +
+                  "\n    (Should equal total ingested.)")
+    logFile.write("\n\nQA: Duplicate storms removed: "+str(nDups) +
+                  ", Unique storms = " + str(nUnique) +
+                  "\n    STORMS PROCESSED for DUPLICATES = " +
+                  str(nDups+nUnique) +
+                  "\n    (This should equal number of Multi-obs storms.)")
+    logFile.write("\n\n" + qaReport)
+    if counts.get('provisionalNames'):
+        logFile.write("\n\nPROVISIONAL: left out " +
+                      ", ".join(counts['provisionalNames']))
+    if counts.get('refreshReport'):
+        logFile.write("\n\n" + counts['refreshReport'])
+    if counts.get('ingestReport'):
+        logFile.write("\n\n" + counts['ingestReport'])
+    logFile.write("\n\nTRACKS: " + str(numTrackParts) + " parts, " +
+                  str(numTrackVerts) + " vertices written, " +
+                  str(numSplitVerts - numTrackVerts) +
+                  " vertices removed by merging segments")
+
+    logFile.write("\n\nQA: If the above QA numbers are consistent, there will be " +
+                  str(numGoodObs) + ' unique storms in the "good" shapefiles')
+
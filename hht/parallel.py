@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+The per-storm work of the qa stage, prepareStorm, in a pool of processes.
+
+Each storm is prepared on its own, so the storms are split into chunks of
+about the same number of observations, in their order, and each chunk goes
+to a worker process.  The workers are forked, so they already have the
+storms and a chunk is just its first and last storm.  What prepareStorm
+set is not sent back as Storm and Segment objects, which are slow to
+pickle, but as the columns of the checkpoints: one NumPy array or list per
+attribute, with the segments of every storm of the chunk end to end.  These
+are copied onto the original storms, so the results are the same as
+preparing them one after the other in this process, which is what happens
+where fork is not available.
+
+"""
+
+import time
+import operator
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import checkpoint # Local python module
+
+from . import pipeline
+
+""" Attributes prepareStorm sets """
+SEG_OUTPUTS = ['startLat', 'startLon', 'endLat', 'endLon', 'saffir', 'enso']
+STORM_OUTPUTS = ['numSegs', 'maxW', 'minP', 'maxSaffir']
+
+""" Chunks per worker, so a slow chunk does not leave the others idle """
+CHUNKS_PER_WORKER = 4
+
+""" Fewest observations to start the processes for with PARALLEL_QA.  Not
+    yet measured on more than one CPU: on one, 111k observations ran at
+    0.7x, so this is only a floor below which the pool is surely too slow. """
+MIN_OBSERVATIONS = 50000
+
+""" Storms and settings shared with the worker processes """
+_shared = {}
+
+
+def chunkBounds(numSegs, numChunks):
+    """ Indexes splitting storms with numSegs observations each into at
+        most numChunks runs of about the same number of observations, from
+        0 to the number of storms """
+    ends = np.cumsum(numSegs)
+    targets = ends[-1]*np.arange(1, numChunks)/numChunks if len(ends) else []
+    cuts = np.searchsorted(ends, targets, side='right')
+    return sorted({0, len(numSegs)} | set(cuts.tolist()))
+
+
+def packColumns(objects, keys):
+    """ The keys attributes of the objects as columns, by key """
+    return {key: checkpoint.toColumn([getattr(obj, key) for obj in objects])
+            for key in keys}
+
+
+def unpackColumns(objects, columns):
+    """ Sets the attributes of the objects from columns by packColumns """
+    attributes = [obj.__dict__ for obj in objects]
+    for key, column in columns.items():
+        values = checkpoint.fromColumn(column)
+        if len(values) != len(attributes):
+            raise ValueError(key + ' has ' + str(len(values)) + ' values for ' +
+                             str(len(attributes)) + ' objects')
+        """ Faster than setattr in a loop """
+        list(map(operator.setitem, attributes, itertools.repeat(key), values))
+
+
+def _initWorker(shared):
+    _shared.update(shared)
+
+
+def _prepareChunk(bounds):
+    """ Worker: prepareStorm for the storms from bounds[0] up to bounds[1].
+        Returns the attributes it set of the storms and their segments as
+        columns, and the CPU seconds it took, about what it would have taken
+        in the main process. """
+    storms = _shared['storms'][bounds[0]:bounds[1]]
+    start = time.process_time()
+    for storm in storms:
+        pipeline.prepareStorm(storm, _shared['cfg'], _shared['ensoLookup'])
+    seconds = time.process_time() - start
+    return (packColumns(storms, STORM_OUTPUTS),
+            packColumns([seg for storm in storms for seg in storm.segs],
+                        SEG_OUTPUTS),
+            seconds)
+
+
+def prepareStorms(storms, cfg, ensoLookup, workers):
+    """ prepareStorm for every storm, in a pool of workers processes.
+        Returns the line for the log, with the speedup over the CPU time the
+        processes spent in prepareStorm, about the time it takes in one, or
+        None if the storms were prepared in this process. """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        for storm in storms:
+            pipeline.prepareStorm(storm, cfg, ensoLookup)
+        return None
+    start = time.perf_counter()
+    numSegs = [len(storm.segs) for storm in storms]
+    bounds = chunkBounds(numSegs, workers*CHUNKS_PER_WORKER)
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+    workTime = 0.
+    shared = {'storms': storms, 'cfg': cfg, 'ensoLookup': ensoLookup}
+    with multiprocessing.get_context('fork').Pool(
+            workers, _initWorker, (shared,)) as pool:
+        """ In the order of the chunks, so of the storms """
+        for (first, last), (stormColumns, segColumns, seconds) in zip(
+                chunks, pool.imap(_prepareChunk, chunks)):
+            chunk = storms[first:last]
+            unpackColumns(chunk, stormColumns)
+            unpackColumns([seg for storm in chunk for seg in storm.segs],
+                          segColumns)
+            workTime += seconds
+    seconds = time.perf_counter() - start
+    return ("PREPARE: {0} storms, {1} observations in {2} chunks on {3} "
+            "processes ({4} CPUs) in {5:.2f} s, against {6:.2f} s of "
+            "prepareStorm in the processes, {7:.1f}x speedup".format(
+                len(storms), sum(numSegs), len(chunks), workers,
+                multiprocessing.cpu_count(), seconds, workTime,
+                workTime/max(seconds, 1.e-9)))
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+The processing stages.  Each stage takes the storms from the one before it
+and returns them with a dictionary of counts for the log:
+    ingest  read the IBTrACS and HURDAT2 files
+    dedup   sort the storms and keep one of each
+    qa      check the observations and find the categories, ENSO stages
+            and segment end points
+    write   write all of the outputs
+run() runs a range of them, saving a checkpoint of the storms after each
+stage but the last so a later run can start from there.  refresh() reads
+only the latest seasons again and merges them into the storms of the qa
+checkpoint, for updates during the season.
+
+"""
+
+import os
+import io
+import math
+import datetime as dt
+
+import qaChecks # Local python module
+import kinematics # Local python module
+import checkpoint # Local python module
+
+from .storms import Storm, Segment, getCat, inputDigest, numberSegments
+from . import lookups
+from . import readers
+from . import outputs
+from .executor import stageExecutor
+from . import parallel
+
+STAGES = ['ingest', 'dedup', 'qa', 'write']
+
+""" Observations closer together than this are nudged apart """
+NEAR_POINTS_NM = 0.14*60.
+
+
+def _readAfter(future, func, *args):
+    """ func(*args), once future is done """
+    future.result()
+    return func(*args)
+
+
+def ingest(cfg, firstSeason=None):
+    """ Storms with more than one observation from all of the input files,
+        or from the seasons from firstSeason on.  With PIPELINE, and more
+        than one CPU, the files are read at the same time, each HURDAT2 file
+        once the crosswalk is loaded, and the lookup tables of the later
+        stages load meanwhile. """
+    ingestStart = dt.datetime.now()
+    executor = stageExecutor(cfg)
+    """ Errors loading these are left for the stages using them to raise,
+        as they load them again """
+    executor.submit('ENSO', lookups.ensoLookup, cfg.ensoFileName)
+    executor.submit('storm reports', lookups.reportLookup, cfg.reportFileName)
+    if cfg.LANDFALL and os.path.exists(cfg.landFileName + '.shp'):
+        executor.submit('land', lookups.landIndex, cfg.landFileName)
+    crosswalk = executor.submit('crosswalk', lookups.ibNames,
+                                cfg.nameMappingFile)
+    ibFuture = executor.submit('IBTrACS', readers.readIBTrACS, cfg,
+                               firstSeason)
+    hFutures = [executor.submit(os.path.basename(fileName), _readAfter,
+                                crosswalk, readers.readHURDAT2, cfg, [i],
+                                firstSeason)
+                for i, fileName in enumerate(cfg.hFiles)]
+    executor.shutdown()
+    """ In the same order as reading them one after the other """
+    allStorms, counts = ibFuture.result()
+    counts['hstormNum'] = [0]*len(cfg.hFiles)
+    for i, future in enumerate(hFutures):
+        hStorms, hCounts = future.result()
+        allStorms += hStorms
+        counts['hstormNum'][i] = hCounts['hstormNum'][i]
+        counts['numSinglePoint'] += hCounts['numSinglePoint']
+    if executor.threaded:
+        counts['ingestReport'] = (
+            "PIPELINE: ingest stage in {0:.1f} s\n    ".format(
+                (dt.datetime.now() - ingestStart).total_seconds()) +
+            "\n    ".join(executor.report()))
+        print("\n" + counts['ingestReport'])
+    return allStorms, counts
+
+
+def dedup(allStorms, cfg):
+    """ Sort combined storms and keep unique ones
+        Use storm.source field to pick either HURDAT or IBTrACS storms
+        based on value of use_HURDAT boolean 
+
+        With new IBTrACS crosswalk file to replace HURDAT2 storm ids with IBTrACS 
+        storm ids, we can sort on those instead of names (which don't work well)
+    
+        Can now sort on UID and only need to check successive storms for duplicates
+        """
+
+    allSorted = sorted(allStorms, key = lambda storm: storm.uid)
+
+    allStorms = [] # Clear allStorms variable to use for unique storms
+    allStorms.append(allSorted[0]) # Add first storm to the non-duplicate list
+
+    nUnique = 1 # Initialize number of unique storms
+    nDups = 0   # Initialize number of duplicate storms
+    dupIndex = nUnique-1 # Index of last added storm.  Only need to check this storm.
+
+    for i in range(1,len(allSorted)):  # Cycle through all the Sorted storms
+        if(allSorted[i].uid == allStorms[dupIndex].uid and allSorted[i].basin == allStorms[dupIndex].basin):
+            # Duplicate so pick according to USE_HURDAT flag
+            if cfg.USE_HURDAT:
+                if allSorted[i].source > 0: #This is a HURDAT record so replace old one
+                    allStorms[dupIndex] = allSorted[i]
+                else: # The existing allStorm record is HURDAT, so keep it
+                    pass
+            else: # Want to use IBTrACS for duplicates
+                if allSorted[i].source > 0: #The new record is HURDAT, so skip it
+                    pass
+                else: # The existing allStorm record is HURDAT, so replace it
+                    allStorms[dupIndex] = allSorted[i]
+            nDups = nDups + 1
+        else: # not a duplicate, so add it to allStorms and increment nDups
+            allStorms.append(allSorted[i])
+            dupIndex = nUnique                                         
+            nUnique = nUnique + 1
+
+    return allStorms, {'numMultiObs': len(allSorted), 'nUnique': nUnique,
+                       'nDups': nDups}
+
+
+def qaSummary(obsFlags, numBadObs, reportFileName, numBadRemoved, numBadStorms):
+    """ The QA lines for the log """
+    return ("QA: " + ", ".join("{0} {1}".format(count, name)
+                               for name, count in qaChecks.flagCounts(obsFlags)) +
+            "\n    {0} bad observations listed in {1}, {2} removed, "
+            "{3} storms left with one observation removed".format(
+                numBadObs, reportFileName, numBadRemoved, numBadStorms))
+
+
+def prepareStorm(storm, cfg, ensoLookup):
+    """ Finds the end point, Saffir-Simpson value and ENSO stage of every
+        segment of a storm that passed QA, and its highest wind and lowest
+        pressure """
+    """loop through segments, skipping last"""
+    storm.numSegs = len(storm.segs)
+    jLast = storm.numSegs-1
+    """ Great circle distance from each observation to the next """
+    obsDistances = kinematics.trackLengths(storm)
+    j = -1  # Make a new counter in case we add segments by splitting around 180
+    for jj in range(0,jLast):
+        j+= 1
+
+        """ Find end Lat and Lon for each segment, correcting if needed"""
+        """ Make sure LONGITUDE does not change sign across the +-180 line
+            Fix this by adjusting the STARTLON of the next segment """
+        if abs(storm.segs[j].startLon - storm.segs[j+1].startLon) > 270.:
+            """ Lon crosses 180, so """
+            if (not cfg.BREAK180):
+                """ Adjust next startLons so sign stays consistent. This gets
+                    all following lons as we iterate through them. """
+                adjLon = (
+                    math.copysign(360.0,storm.segs[j].startLon)
+                    + storm.segs[j+1].startLon)
+                print('Adjusting Lon wrap-around: Lon(i), Lon(i+1), adjLon',
+                      storm.segs[j].startLon, storm.segs[j+1].startLon,adjLon)
+                storm.segs[j+1].startLon = adjLon
+        """ put adjusted or NOT adjusted start lat & lon at (j+1)
+            in end lat/lon for (j)"""
+
+        """ NOTE BENE: If start and end are too close, offset End slightly.
+            The limit is the old 0.14 degrees, as nautical miles. """
+        if(cfg.OFFSET_POINTS and obsDistances[j] < NEAR_POINTS_NM):
+            #print('Tweaking identical points, segLength = ', segLength)
+            storm.segs[j+1].startLat += 0.001
+            storm.segs[j+1].startLon += 0.001
+
+        storm.segs[j].endLat = storm.segs[j+1].startLat
+        storm.segs[j].endLon = storm.segs[j+1].startLon
+        """ ---------------------END 180 Stuff ----------------------------"""
+
+
+        """ --- Saffir-Simpson value for each segment"""
+        storm.segs[j].saffir = getCat(storm.segs[j].nature,
+                                    (storm.segs[j].wsp))
+#==============================================================================
+#         """ For each segment in the storm find: """
+# #        allNatures.append(storm.segs[j].nature)
+#         allNatures.append(storm.segs[j].saffir)
+#
+#==============================================================================
+        """ Get data for ENSO stage for each segment by start time """
+       # thisKey = storm.segs[j].time[:7]
+        thisKey = storm.segs[j].time.strftime('%Y-%m')
+        storm.segs[j].enso = ensoLookup.get(thisKey) if ensoLookup.get(thisKey) != None else "U"
+        """ Find Max Winds and Saffir-Simpson and Min Pressures """
+        if (storm.segs[j].wsp > storm.maxW and storm.segs[j].saffir != "ET"): # New Max found so update MaxW and SS
+            storm.maxW = storm.segs[j].wsp
+            storm.maxSaffir = storm.segs[j].saffir
+        if storm.segs[j].pres < storm.minP and storm.segs[j].pres > 0:
+            storm.minP = storm.segs[j].pres
+
+    """ Now need to process the very last segment """
+    """ --- ending Lat and Lon for each segment is just the same
+    starting location, but offset by 0.01 degrees.
+    This allows for the creation of a valid attributed line for every
+    actual observation."""
+    if cfg.OFFSET_POINTS:
+        storm.segs[jLast].endLat = float(storm.segs[jLast].startLat) - (float(storm.segs[jLast].startLat) - float(storm.segs[jLast-1].startLat)) * 0.001
+        storm.segs[jLast].endLon = float(storm.segs[jLast].startLon) - (float(storm.segs[jLast].startLon) - float(storm.segs[jLast-1].startLon)) * 0.001
+ #   storm.segs[jLast].endLon = float(storm.segs[jLast].startLon + 0.0001)
+
+    """ --- Saffir-Simpson value for each segment"""
+    storm.segs[jLast].saffir = getCat(storm.segs[jLast].nature,
+                                (storm.segs[jLast].wsp))
+    """ Find Max Winds and Saffir-Simpson and Min Pressures """
+    if (storm.segs[jLast].wsp > storm.maxW and storm.segs[jLast].saffir != "ET") : # New Max found so update MaxW and SS
+        storm.maxW = storm.segs[jLast].wsp
+        storm.maxSaffir = storm.segs[jLast].saffir
+    if storm.segs[jLast].pres < storm.minP and storm.segs[jLast].pres > 0:
+        storm.minP = storm.segs[jLast].pres
+    """ Get data for ENSO stage for last segment by start time """
+    try:
+        thisKey = storm.segs[jLast].time.strftime('%Y-%m')
+    except:
+        print(j, storm.segs[jLast].time)
+    storm.segs[jLast].enso = ensoLookup.get(thisKey) if ensoLookup.get(thisKey) != None else "U"
+
+    """ If Maximum Wind and Minimum Pressure are still the inital values,
+    replace them with MISSING VALUE FLAGS """
+    if storm.maxW == -99.:
+        storm.maxW = "-1.0"
+    if storm.minP == 9999.:
+        storm.minP = "-1.0"
+
+
+def prepareStorms(storms, cfg, ensoLookup):
+    """ prepareStorm for each storm, in a pool of WORKERS processes with
+        PARALLEL_QA if there is more than one and enough observations.
+        Returns the line for the log, or None if done in this process. """
+    workers = cfg.WORKERS or os.cpu_count() or 1
+    if (cfg.PARALLEL_QA and workers > 1 and sum(len(storm.segs) for storm in storms) >=
+            parallel.MIN_OBSERVATIONS):
+        prepareReport = parallel.prepareStorms(storms, cfg, ensoLookup, workers)
+        if prepareReport:
+            print("\n" + prepareReport)
+        return prepareReport
+    for storm in storms:
+        prepareStorm(storm, cfg, ensoLookup)
+    return None
+
+
+def qa(allStorms, cfg):
+    """ QA of the unique storms, and the values each segment needs for the
+        outputs """
+    ensoLookup = lookups.ensoLookup(cfg.ensoFileName)
+    for storm in allStorms:
+        storm.inputHash = inputDigest(storm)
+
+    """ Check every observation at once and report the bad ones """
+    obsFlags = qaChecks.checkObservations(allStorms)
+    numBadObs = qaChecks.writeReport(cfg.qaReportFileName, allStorms, obsFlags)
+    numBadRemoved = 0
+    numBadStorms = 0
+    if cfg.FLAG_BAD:
+        numQAStorms = len(allStorms)
+        allStorms, numBadRemoved = qaChecks.dropBad(allStorms, obsFlags)
+        numBadStorms = numQAStorms - len(allStorms)
+    qaReport = qaSummary(obsFlags, numBadObs, cfg.qaReportFileName,
+                         numBadRemoved, numBadStorms)
+
+    """ Now process unique storms for QA/QC and finding Saffir-Simpson value """
+    # =============================================================================
+    # """ Make a list of all the Nature types. Needed for setting up Category logic"""
+    #  allNatures = []
+    # 
+    # =============================================================================
+    #for i, storm in enumerate(allStorms[11700:11802:4]):
+    #for i, storm in enumerate(allStorms[1:3]):
+    prepareReport = prepareStorms(allStorms, cfg, ensoLookup)
+    if prepareReport:
+        qaReport += "\n    " + prepareReport
+    numberSegments(allStorms)
+
+    return allStorms, {'qaReport': qaReport}
+
+
+def write(allStorms, cfg, counts, logFile=None):
+    """ Writes every output and the summary of the run to logFile, or to
+        nowhere if it is None.  Returns the counts with this stage's added. """
+    return outputs.write(allStorms, cfg, counts,
+                         io.StringIO() if logFile is None else logFile)
+
+
+def saveCheckpoint(cfg, stage, allStorms, counts):
+    """ Saves the storms and counts at the end of stage """
+    saveStart = dt.datetime.now()
+    fileName = cfg.checkpointFileName(stage)
+    size = checkpoint.saveStorms(fileName, allStorms, counts, cfg.parameters())
+    print("\nCheckpoint {0}: {1} storms, {2:.1f} MB in {3:.1f} s".format(
+        fileName, len(allStorms), size/1.e6,
+        (dt.datetime.now() - saveStart).total_seconds()))
+
+
+def loadCheckpoint(cfg, stage):
+    """ The storms and counts saved at the end of stage.  Warns if the
+        parameters have changed since. """
+    fileName = cfg.checkpointFileName(stage)
+    if not os.path.exists(fileName):
+        raise FileNotFoundError("No checkpoint " + fileName + ", run the " +
+                                stage + " stage first")
+    allStorms, counts, savedParameters = checkpoint.loadStorms(
+        fileName, Storm, Segment)
+    changed = sorted(name for name, value in cfg.parameters().items()
+                     if savedParameters.get(name) != value)
+    if changed:
+        print("WARNING: " + ", ".join(changed) + " changed since " +
+              fileName + " was written, earlier stages may need rerunning")
+    print("Resuming from " + fileName + " with " + str(len(allStorms)) +
+          " storms")
+    return allStorms, counts
+
+
+def run(cfg, firstStage='ingest', lastStage='write', logFile=None):
+    """ Runs the stages from firstStage to lastStage.  Unless firstStage is
+        the first stage, starts from the checkpoint of the one before it.
+        Returns (storms, counts). """
+    first, last = STAGES.index(firstStage), STAGES.index(lastStage)
+    allStorms, counts = [], {}
+    if first > 0:
+        allStorms, counts = loadCheckpoint(cfg, STAGES[first - 1])
+    for stage in STAGES[first:last + 1]:
+        if stage == 'ingest':
+            allStorms, stageCounts = ingest(cfg)
+        elif stage == 'write':
+            stageCounts = write(allStorms, cfg, counts, logFile)
+        else:
+            allStorms, stageCounts = globals()[stage](allStorms, cfg)
+        counts = dict(counts, **stageCounts)
+        if stage != 'write':
+            saveCheckpoint(cfg, stage, allStorms, counts)
+    return allStorms, counts
+
+
+def refresh(cfg, firstSeason, logFile=None):
+    """ Reads the storms of the seasons from firstSeason on again and
+        merges them into the storms of the qa checkpoint, then writes the
+        outputs.  Storms that did not change since they were last read are
+        not checked again.  Segment IDs come from the storm IDs, see
+        numberSegments, so they stay the same.  The merged storms replace
+        the qa checkpoint, so the next refresh starts from them.
+        Returns (storms, counts). """
+    refreshStart = dt.datetime.now()
+    allStorms, counts = loadCheckpoint(cfg, 'qa')
+    recentStorms, recentCounts = ingest(cfg, firstSeason)
+
+    """ Storms of earlier seasons are kept as they are, those of the
+        refreshed seasons only if they are read again unchanged.  Storms
+        from checkpoints older than the season attribute go by start year. """
+    keptStorms = []
+    previous = {}
+    for storm in allStorms:
+        season = getattr(storm, 'season', None) or storm.startTime.year
+        if season < firstSeason:
+            keptStorms.append(storm)
+        else:
+            previous[(storm.uid, storm.basin,
+                      getattr(storm, 'inputHash', None))] = storm
+
+    """ The kept storms go through dedup with those read again, in the
+        order of a full run, since the crosswalk can give a HURDAT2 storm
+        the ID of an IBTrACS storm of another season """
+    kept = {id(storm) for storm in keptStorms}
+    mergedStorms = sorted(keptStorms + recentStorms,
+                          key=lambda storm: (storm.uid, storm.source))
+    dedupCounts = {'numMultiObs': 0, 'nUnique': 0, 'nDups': 0}
+    if mergedStorms:
+        mergedStorms, dedupCounts = dedup(mergedStorms, cfg)
+    freshStorms = []
+    for k, storm in enumerate(mergedStorms):
+        if id(storm) in kept:
+            continue
+        storm.inputHash = inputDigest(storm)
+        key = (storm.uid, storm.basin, storm.inputHash)
+        if key in previous:
+            mergedStorms[k] = previous.pop(key)
+        else:
+            freshStorms.append(storm)
+    numUnchanged = sum(id(storm) not in kept for storm in mergedStorms) - \
+        len(freshStorms)
+
+    """ QA of the new and changed storms only.  Their rows replace those of
+        the storms they replace, or that are gone, in the QA report. """
+    ensoLookup = lookups.ensoLookup(cfg.ensoFileName)
+    obsFlags = qaChecks.checkObservations(freshStorms)
+    replacedIDs = ({storm.uid for storm in previous.values()} |
+                   {storm.uid for storm in freshStorms})
+    numGone = len({(storm.uid, storm.basin) for storm in previous.values()} -
+                  {(storm.uid, storm.basin) for storm in freshStorms})
+    numBadObs = qaChecks.mergeReport(
+        cfg.qaReportFileName, freshStorms, obsFlags, replacedIDs)
+    numFresh = len(freshStorms)
+    numBadRemoved = 0
+    numBadStorms = 0
+    if cfg.FLAG_BAD:
+        checked = {id(storm) for storm in freshStorms}
+        freshStorms, numBadRemoved = qaChecks.dropBad(freshStorms, obsFlags)
+        numBadStorms = numFresh - len(freshStorms)
+        dropped = checked - {id(storm) for storm in freshStorms}
+        mergedStorms = [storm for storm in mergedStorms
+                        if id(storm) not in dropped]
+    prepareReport = prepareStorms(freshStorms, cfg, ensoLookup)
+    numberSegments(mergedStorms)
+
+    """ The counts of the log are those of the merged storms: the kept
+        storms count as read from their source, with those read again, so
+        the totals check against each other as in a full run.  The QA
+        lines are for the storms checked again. """
+    ibNum = recentCounts['ibNum'] + sum(storm.source == 0
+                                        for storm in keptStorms)
+    hstormNum = [recentCounts['hstormNum'][i] +
+                 sum(storm.source == i + 1 for storm in keptStorms)
+                 for i in range(len(cfg.hFiles))]
+    qaReport = qaSummary(obsFlags, numBadObs, cfg.qaReportFileName,
+                         numBadRemoved, numBadStorms)
+    if prepareReport:
+        qaReport += "\n    " + prepareReport
+    counts = dict(counts, ibNum=ibNum, ibSkipNum=recentCounts['ibSkipNum'],
+                  hstormNum=hstormNum,
+                  numSinglePoint=recentCounts['numSinglePoint'],
+                  qaReport=qaReport,
+                  provisionalNames=recentCounts['provisionalNames'],
+                  ingestReport=recentCounts.get('ingestReport'),
+                  refreshReport=(
+        "REFRESH: seasons {0} on, {1} storms read, {2} unchanged, {3} new or "
+        "changed and checked by QA, {4} gone, {5} earlier storms kept, in "
+        "{6:.1f} s".format(
+            firstSeason, len(recentStorms), numUnchanged, numFresh, numGone,
+            len(keptStorms),
+            (dt.datetime.now() - refreshStart).total_seconds())), **dedupCounts)
+    saveCheckpoint(cfg, 'qa', mergedStorms, counts)
+    counts = write(mergedStorms, cfg, counts, logFile)
+    return mergedStorms, counts
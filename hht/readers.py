@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+Readers for the IBTrACS and HURDAT2 best track files.  Each returns the
+storms read, those with more than one observation, and counts of what was
+read for the log.
+
+"""
+
+import hashlib
+
+import numpy as np
+
+from .storms import Storm, Segment, getWindPres, windColumns
+from . import lookups
+from . import hurdat
+from . import scanner
+
+""" Header rows at the top of the IBTrACS file """
+IB_HEADER_ROWS = 3
+
+
+def seasonOffset(fileName, firstYear):
+    """ Offset in the IBTrACS file of the first record of the first storm
+        with an ID from firstYear on.  The file is sorted by ID, which
+        starts with the year the storm was first seen, so this is a binary
+        search over the file rather than a read of all of it. """
+    with open(fileName, 'rb') as f:
+        for row in range(IB_HEADER_ROWS):
+            f.readline()
+        start = f.tell()
+        f.seek(0, 2)
+        lo, hi = start, f.tell()
+
+        def lineAt(pos):
+            """ Offset and contents of the first line starting at or after pos """
+            if pos > start:
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(start)
+            offset = f.tell()
+            return offset, f.readline()
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, line = lineAt(mid)
+            if not line or int(line[:4]) >= firstYear:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lineAt(lo)[0]
+
+
+class Subset(object):
+    """ The storms a TESTING run reads, decided from the raw fields of a
+        storm's first IBTrACS row or HURDAT2 header before anything is
+        parsed.  See TEST_SEASONS, TEST_BASINS, TEST_STORMS and TEST_SAMPLE
+        in config.ini. """
+    def __init__(self, seasons=(), basins=(), storms=(), sample=1.):
+        self.firstSeason = seasons[0] if seasons else None
+        self.lastSeason = seasons[-1] if seasons else None
+        self.basins = set(basins)
+        self.storms = set(storms)
+        self.sample = sample
+        self.lastID = None
+        self.lastKeep = False
+        self.done = False   # Set once the rows are past the last season
+
+    @classmethod
+    def fromConfig(cls, cfg):
+        """ Subset for cfg, or None if it reads everything """
+        if not cfg.TESTING:
+            return None
+        return cls(cfg.TEST_SEASONS, cfg.TEST_BASINS, cfg.TEST_STORMS,
+                   cfg.TEST_SAMPLE)
+
+    def keepBasin(self, basin):
+        return not self.basins or basin in self.basins
+
+    def keepStorm(self, season, basin, ids):
+        """ Whether to read a storm of season starting in basin, with ids its
+            raw ID and IBTrACS ID """
+        if self.firstSeason is not None and not (
+                self.firstSeason <= season <= self.lastSeason):
+            return False
+        if not self.keepBasin(basin):
+            return False
+        if self.storms and not self.storms.intersection(ids):
+            return False
+        if self.sample < 1.:
+            """ The same storms every run, whichever file they come from """
+            digest = hashlib.blake2b(ids[-1].encode(), digest_size=8).digest()
+            return int.from_bytes(digest, 'big') < self.sample*2**64
+        return True
+
+    def keepRow(self, vals):
+        """ Whether to read an IBTrACS row, split into vals.  The rows of a
+            storm follow one another, so this is decided on its first row. """
+        if vals[0] != self.lastID:
+            self.lastID = vals[0]
+            """ IDs start with the year, which is never after the season """
+            if self.lastSeason is not None and int(vals[0][:4]) > self.lastSeason:
+                self.done = True
+            self.lastKeep = not self.done and self.keepStorm(
+                int(vals[1]), vals[3].strip(), [vals[0]])
+        return self.lastKeep
+
+
+def readIBTrACS(cfg, firstSeason=None):
+    """ Storms from the IBTrACS file, or only those of the seasons from
+        firstSeason on.  Returns (storms, counts). """
+    allStorms = []
+    provisionalStorms = []
+    ibProvisional = 0
+    numSinglePoint = 0
+
+    """ Read IBTrACS data
+        This data is not split by storms, rather every row has all info in it
+        Therefore, we must read the data, find out if it is a new storm, and
+        if it is, then write the previous storm object/information to allStorms
+        and create a new thisStorm object and populate it with the first
+        observation.
+
+        We know the IBTrACS data starts with 3 header rows, then the 4th row
+        is our first legitimate data record.
+        Initialize the first thisStorm object from that"""
+    ibFiles = [cfg.ibtracsFileName]
+    #ibFiles = []
+    ibNum = 0 # Initialize IBTrACS storm counter,
+              # it will increment when storm end is found
+    ibSkipNum = 0  # Number of NA and EP storms skipped to prevent HURDAT2 duplicates
+    possibles = windColumns(cfg.WIND_PRIORITY) # Agency wind columns to use
+    subset = Subset.fromConfig(cfg)
+    if subset is not None and subset.firstSeason is not None:
+        firstSeason = max(firstSeason or subset.firstSeason, subset.firstSeason)
+
+    def counted(storm):
+        """ Whether a storm read counts, as the storms of the season before
+            firstSeason are read but left out """
+        return firstSeason is None or storm.season >= firstSeason
+
+    for i, file in enumerate(ibFiles):
+    #    print (i, file)
+    #    print ('IBTrACS file: ', file)
+        with open(cfg.ibtracsFileName, "r") as rawObsFile:
+             head1 = rawObsFile.readline()
+             head2 = rawObsFile.readline()
+             head3 = rawObsFile.readline()
+        #     print(head1, head2, head3)
+             if firstSeason is not None:
+                 """ Southern hemisphere seasons start in the July of the
+                     year before, so start from that year's IDs """
+                 rawObsFile.seek(seasonOffset(cfg.ibtracsFileName,
+                                              firstSeason - 1))
+             """ Read first IBTrACS Record """
+             lineVals = rawObsFile.readline() # First Storm record in IBTrACS
+             while (lineVals and subset is not None
+                    and not subset.keepRow(lineVals.split(","))):
+                 lineVals = "" if subset.done else rawObsFile.readline()
+             if not lineVals:
+                 continue # No storms to read
+             vals = lineVals.split(",")
+             """ The vals used has changed with V04r00.  See pdf documentationon
+             IBTrACS website for all the possibilites.  We will be using the 'USA'
+             values for winds and pressure that should be similar to what was
+             previously provided as a 'CSC' version of the IBTrACSv03 data. """
+    #         print(vals)
+
+             """ Parse vals() to find non-null wind and pressure values from
+                 appropriate preporting agency """
+
+             tmpWind, tmpPres = getWindPres(vals, possibles)
+
+
+             """ Create first storm """
+             thisStorm = Storm(vals[0],          # Unique IBTrACS ID
+                               vals[5].strip())  # Name, spaces removed
+        #     observation = Segment(vals[6],  # ISO 8601 Time
+             observation = Segment(vals[6],  # ISO 8601 Time
+                                   vals[8], # Lat
+                                   vals[9], # Lon
+                                   tmpWind, # Wind from best estimate
+                                   tmpPres, # Pressure from non-missing
+                                   vals[7] ) # Nature
+
+             observation.startLon = observation.startLon if observation.startLon <= 180.0 else observation.startLon - 360.
+             thisStorm.segs.append(observation)
+             thisStorm.startTime = observation.time
+             thisStorm.startLon = observation.startLon
+             thisStorm.startLat = observation.startLat
+             thisStorm.provisional = vals[13] == 'PROVISIONAL'
+             if(cfg.LABEL_PROVISIONAL & thisStorm.provisional ):
+                 thisStorm.name = thisStorm.name + " " \
+                     + thisStorm.startTime.strftime('%Y') \
+                     + "(P)"
+                #  print("Labeling as provisional: ", thisStorm.name )
+             else:
+                 thisStorm.name = thisStorm.name + " " \
+                 + thisStorm.startTime.strftime('%Y')
+
+             # enter end time in case this is only observation.
+             thisStorm.endTime = observation.time
+             nseg = 1
+             thisStorm.source = 0            # Flag data source as IBTrACS
+             thisStorm.basin = vals[3].strip()
+             thisStorm.season = int(vals[1])
+             """ First storm and observation entered, begin looping """
+             while True: # With this and the below break, read to EOF
+                 lineVals = rawObsFile.readline()
+                 if not lineVals: # Finds EOF
+                     break # Break on EOF
+                 else: # Data read: Parse it and test to see if it is a new storm
+                     vals = lineVals.split(",")
+                     if subset is not None and not subset.keepRow(vals):
+                         if subset.done:
+                             break # Past the last season, as if at EOF
+                         continue # Skip rows of storms left out
+                     if vals[0] == thisStorm.uid :  # Same storm so add the record
+                         tmpWind, tmpPres = getWindPres(vals, possibles)
+                         observation = Segment(vals[6], # ISO 8601 Time
+                                               vals[8], # Lat
+                                               vals[9], # Lon
+                                               tmpWind, # Wind from best estimate
+                                               tmpPres, # Pressure from non-missing
+                                               vals[7] ) # Nature
+                         observation.startLon = observation.startLon if observation.startLon <= 180.0 else observation.startLon - 360.
+                         ibHour = observation.time.hour*100+observation.time.minute
+                         if cfg.NO391521 and (ibHour == 300 or ibHour == 900 or
+                                          ibHour == 1500 or ibHour == 2100):
+                            pass #Skip writing this observation
+                         else:
+                             thisStorm.endTime = observation.time #update end time
+                             thisStorm.segs.append(observation)
+                             nseg += 1
+                     else: #Found a new storm so...
+                         thisStorm.numSegs = len(thisStorm.segs)
+                         """ Check if we are keeping provisional storms and
+                             save storm appropriately """
+                         if (cfg.OMIT_PROVISIONAL & thisStorm.provisional ):
+                             # Add old storm to provisionalStorms
+                             ibProvisional += counted(thisStorm)
+                             provisionalStorms.append(thisStorm)
+                         else:
+                             """ Only keep the storm if there is more than ONE observation: """
+                             if(thisStorm.numSegs > 1):
+    #                             # Skip storms in NA or EP to prevent duplicates with HURDAT2 12/12/2016
+    #                             if(thisStorm.basin[0:2] != "NA" and thisStorm.basin[0:2] != "EP"):
+                                 allStorms.append(thisStorm) # Add old storm to allStorms
+    #        #                         print("IBTrACS basin",thisStorm.basin)
+    #                             else:
+    #                                 ibSkipNum += 1
+    #        #                         print("Duplicate in basin",thisStorm.basin)
+                             elif counted(thisStorm):
+                                 numSinglePoint += 1
+                             if counted(thisStorm):
+                                 ibNum += 1 # Increment counter for IBTrACS storms
+        #==============================================================================
+        #                  print("IBTrACS storm # ",ibNum," named ",thisStorm.name,
+        #                        " has ", thisStorm.numSegs," observations \n    which ",
+        #                        "should be ", nseg)
+        #==============================================================================
+                         """ Create a new storm record for the newly read storm """
+                         thisStorm = Storm(vals[0],          # Unique IBTrACS ID
+                                           vals[5].strip())  # Name, spaces removed
+                         """ Add the first segment information to the storm """
+                         tmpWind, tmpPres = getWindPres(vals, possibles)
+                         observation = Segment(vals[6],  # ISO 8601 Time
+                                               vals[8], # Lat
+                                               vals[9], # Lon
+                                               tmpWind, # Wind from best estimate
+                                               tmpPres, # Pressure from non-missing
+                                               vals[7] ) # Nature
+                         observation.startLon = observation.startLon if observation.startLon <= 180.0 else observation.startLon - 360.
+                         thisStorm.segs.append(observation)
+                         thisStorm.startTime = observation.time
+                         thisStorm.startLon = observation.startLon
+                         thisStorm.startLat = observation.startLat
+                         thisStorm.provisional = vals[13] == 'PROVISIONAL'
+                         # enter end time in case this is only observation.
+                         if(cfg.LABEL_PROVISIONAL & thisStorm.provisional ):
+                             thisStorm.name = thisStorm.name + " " \
+                                 + thisStorm.startTime.strftime('%Y') \
+                                 + "(P)"
+                            #  print("Labeling as provisional: ", thisStorm.name )
+                         else:
+                             thisStorm.name = thisStorm.name + " " \
+                             + thisStorm.startTime.strftime('%Y')
+                         thisStorm.endTime = observation.time
+                         nseg = 1 # New storm ready for next record
+                         thisStorm.source = 0 # Flag data source as IBTrACS
+                         thisStorm.basin = vals[3].strip()
+                         thisStorm.season = int(vals[1])
+             """ EOF found on IBTrACS: Write last data and close out """
+             thisStorm.numSegs = len(thisStorm.segs)
+             """ Only keep the storm if there is more than ONE observation: """
+             if (cfg.OMIT_PROVISIONAL & thisStorm.provisional ):
+                 # Add old storm to provisionalStorms
+                 ibProvisional += counted(thisStorm)
+                 provisionalStorms.append(thisStorm)
+             else:
+                 if(thisStorm.numSegs > 1):
+    #                 # Skip storms in NA or EP to prevent duplicates with HURDAT2 12/12/2016
+    #                 if(thisStorm.basin[0:2] != "NA" and thisStorm.basin[0:2] != "EP"):
+                     allStorms.append(thisStorm) # Add old storm to allStorms
+    #                 else:
+    #                     ibSkipNum += 1
+                 elif counted(thisStorm):
+                     numSinglePoint += 1
+                 if counted(thisStorm):
+                     ibNum += 1 # Increment counter for IBTrACS storms
+        #==============================================================================
+        #      print("Last IBTrACS storm # ",ibNum," named ",thisStorm.name,
+        #            " has ", thisStorm.numSegs," observations \n    which ",
+        #            "should be ", nseg)
+        #==============================================================================
+
+    if firstSeason is not None:
+        allStorms = [storm for storm in allStorms if storm.season >= firstSeason]
+        provisionalStorms = [storm for storm in provisionalStorms
+                             if storm.season >= firstSeason]
+
+    """ End of IBTrACS Ingest """
+    return allStorms, {'ibNum': ibNum, 'ibSkipNum': ibSkipNum,
+                       'ibProvisional': ibProvisional,
+                       'provisionalNames': [storm.name for storm in
+                                            provisionalStorms],
+                       'numSinglePoint': numSinglePoint}
+
+
+def readHURDAT2(cfg, fileIndexes=None, firstSeason=None):
+    """ Storms from the HURDAT2 files, or just those of cfg.hFiles with the
+        given indexes, with IBTrACS IDs where the crosswalk has them.  With
+        firstSeason, only the storms of the seasons from then on.  Each file
+        is parsed by column, see hurdat.py.  Returns (storms, counts). """
+    ibName = lookups.ibNames(cfg.nameMappingFile)
+    allStorms = []
+    numSinglePoint = 0
+
+    """ Read HURDAT2 data """
+    subset = Subset.fromConfig(cfg)
+    hstormNum = [0,0]
+    for i, file in enumerate(cfg.hFiles):
+        if fileIndexes is not None and i not in fileIndexes:
+            continue
+        if subset is not None and not subset.keepBasin(cfg.hBasin[i]):
+            continue
+        print (i, file)
+        with scanner.MappedFile(file) as rawObsFile:
+            table = hurdat.HurdatTable(rawObsFile.block())
+            """ Pick the storms to read from their headers, before any of
+                their observations are parsed """
+            keep = [not ((firstSeason is not None and season < firstSeason) or
+                         (subset is not None and not subset.keepStorm(
+                             season, cfg.hBasin[i],
+                             [hID, ibName.get('b' + hID.lower(), hID).strip()])))
+                    for hID, season in zip(table.stormIDs, table.seasons)]
+            table = table.select(keep)
+            hstormNum[i] = len(table)
+
+            """ Every observation of the storms, parsed a column at a time """
+            observations = [Segment(*values) for values in zip(
+                table.times.tolist(),   # datetime
+                table.lats.tolist(),    # Latitude
+                table.lons.tolist(),    # Longitude
+                table.winds.tolist(),   # Wind Speed
+                table.pressures.tolist(),   # Air Pressure
+                table.natures)]         # Nature
+            bad = ~(np.isfinite(table.lats) & np.isfinite(table.lons))
+            for k in np.flatnonzero(bad).tolist():
+                print("Bad position on observation", table.lineText(k))
+                """ Skip it, the segment count check below fixes numSegs """
+                observations[k] = None
+
+            for j, (hID, name, season) in enumerate(zip(
+                    table.stormIDs, table.names, table.seasons)):
+                thisStorm = Storm(hID,  # Create new storm using Unique ID
+                                  name)  # and Name w/out spaces
+
+                """ If this storm has an IBTrACS ID, use it instead.
+                NOTE BENE: The IBTrACS crosswalk file prepends a "b" on to the
+                HURDAT2 (and other) id values.  Therefore, we need to prepend that
+                in the test below. """
+                testUID = 'b'+thisStorm.uid.lower()
+                if (testUID) in ibName:
+                    thisStorm.uid = ibName[testUID].strip()
+
+                thisStorm.numSegs = int(table.declaredObs[j]) # Number of Observations
+                thisStorm.source = i + 1 # Flag data source as HURDAT ATL or NEPAC
+                thisStorm.basin = cfg.hBasin[i]
+                thisStorm.season = season
+                first, last = table.obsRange(j)
+                thisStorm.segs = [observation for observation in
+                                  observations[first:last]
+                                  if observation is not None]
+                if not thisStorm.segs:
+                    print ("Error in Hurdat data record.  No observations for",
+                           hID)
+                    numSinglePoint += 1
+                    continue
+
+                thisStorm.startTime = thisStorm.segs[0].time
+                thisStorm.startLon = thisStorm.segs[0].startLon
+                thisStorm.startLat = thisStorm.segs[0].startLat
+                """ HURDAT2 has no provisional status, so LABEL_PROVISIONAL
+                    only applies to IBTrACS """
+                thisStorm.name = thisStorm.name + " " \
+                    + thisStorm.startTime.strftime('%Y')
+                thisStorm.endTime = thisStorm.segs[len(thisStorm.segs)-1].time
+                """ Only keep the storm if there is more than ONE observation: """
+                if(thisStorm.numSegs != len(thisStorm.segs)):
+                    print ("Error in Hurdat data record.  Segment count mismatch")
+                    thisStorm.numSegs = len(thisStorm.segs)
+                if(thisStorm.numSegs > 1):
+                     allStorms.append(thisStorm) # Add old storm to allStorms
+                else:
+                     numSinglePoint += 1
+    return allStorms, {'hstormNum': hstormNum,
+                       'numSinglePoint': numSinglePoint}
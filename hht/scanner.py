@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Raw input files read as bytes through a memory map.  Line and field
+boundaries are found with NumPy over blocks of the file, and only the fields
+asked for are decoded, rather than decoding every line and splitting all of
+its fields (about 160 for IBTrACS) to use a few of them.
+
+    with scanner.MappedFile(fileName) as raw:
+        start = raw.skipLines(3)            # IBTrACS header rows
+        for block in raw.blocks(start):     # A block of rows at a time
+            lats = block.fieldBytes(8).astype(float)
+            names = block.column(5)
+        headers, numObs = scanner.hurdatLayout(raw.block())    # HURDAT2
+
+A Block gives the byte offsets of a field in every one of its rows, for
+engines that parse whole columns at once, as hurdat.py does.  Lines end at
+\\n, with any \\r before it left out, and may have different numbers of
+fields, as the HURDAT2 header and data lines do.
+
+"""
+
+import os
+import mmap
+
+import numpy as np
+
+""" Bytes scanned for line and field boundaries at a time """
+BLOCK_BYTES = 1 << 24
+
+""" Fewest fields on a HURDAT2 data line.  Header lines have four. """
+HURDAT_DATA_FIELDS = 8
+
+COMMA = ord(',')
+NEWLINE = ord('\n')
+RETURN = ord('\r')
+
+
+class Block(object):
+    """ Line and field boundaries of the whole lines in part of a file """
+    def __init__(self, buf, data, start, stop):
+        self.buf = buf
+        self.data = data
+        newlines = np.flatnonzero(data[start:stop] == NEWLINE) + start
+        if stop == len(data) and stop > start and data[stop - 1] != NEWLINE:
+            """ The last line of the file has no newline """
+            newlines = np.append(newlines, stop)
+        self.next = min(int(newlines[-1]) + 1, len(data)) if len(newlines) else start
+        self.lineStarts = np.concatenate(([start], newlines[:-1] + 1)).astype(np.int64) \
+            if len(newlines) else np.zeros(0, dtype=np.int64)
+        hasReturn = ((newlines > self.lineStarts) &
+                     (data[np.maximum(newlines - 1, 0)] == RETURN))
+        self.lineEnds = newlines - hasReturn
+        self.start = start
+        self.commas = None # Found the first time fields are asked for
+
+    def _findCommas(self):
+        commas = np.flatnonzero(self.data[self.start:self.next] == COMMA) + self.start
+        """ Index into commas of the first comma of each line, and the number
+            of commas on it """
+        self.firstComma = np.searchsorted(commas, self.lineStarts)
+        self.numCommas = np.searchsorted(commas, self.lineEnds) - self.firstComma
+        """ With one more at the end so every index in fieldBounds is valid """
+        self.commas = np.append(commas, 0)
+
+    def __len__(self):
+        return len(self.lineStarts)
+
+    def fieldBounds(self, k):
+        """ (starts, ends, present) byte offsets of field k of every line,
+            with present False, and an empty field, for lines with fewer """
+        if self.commas is None:
+            self._findCommas()
+        last = len(self.commas) - 1
+        present = self.numCommas >= k
+        if k == 0:
+            starts = self.lineStarts
+        else:
+            starts = self.commas[np.minimum(self.firstComma + k - 1, last)] + 1
+        ends = np.where(self.numCommas > k,
+                        self.commas[np.minimum(self.firstComma + k, last)],
+                        self.lineEnds)
+        return (np.where(present, starts, self.lineEnds),
+                np.where(present, ends, self.lineEnds), present)
+
+    def numFields(self):
+        """ Number of fields on every line """
+        if self.commas is None:
+            self._findCommas()
+        return self.numCommas + 1
+
+    def fieldBytes(self, k, lines=None):
+        """ Field k of every line, or of the lines with the indexes lines, as
+            a NumPy bytes array, gathered from the file in one step, empty
+            where a line is shorter.  NumPy can convert it, e.g. with
+            astype(float), or strip it with np.char. """
+        starts, ends, present = self.fieldBounds(k)
+        if lines is not None:
+            starts, ends = starts[lines], ends[lines]
+        lengths = ends - starts
+        width = max(int(lengths.max()) if len(lengths) else 0, 1)
+        offsets = np.arange(width)
+        index = np.minimum(starts[:, None] + offsets, len(self.data) - 1)
+        chars = np.where(offsets < lengths[:, None], self.data[index], 0)
+        return chars.astype(np.uint8).view('S%d' % width).ravel()
+
+    def column(self, k, lines=None):
+        """ Field k of every line, or of lines, as a list of strings """
+        return self.fieldBytes(k, lines).astype(str).tolist()
+
+    def lineText(self, line):
+        """ The whole of line number line """
+        return self.buf[int(self.lineStarts[line]):int(self.lineEnds[line])].decode()
+
+
+class MappedFile(object):
+    """ A file mapped into memory, read only """
+    def __init__(self, fileName):
+        self.file = open(fileName, 'rb')
+        if os.fstat(self.file.fileno()).st_size:
+            self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buf = b''  # Empty files can not be mapped
+        """ The same bytes as a NumPy array, without a copy """
+        self.data = np.frombuffer(self.buf, dtype=np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        del self.data
+        if isinstance(self.buf, mmap.mmap):
+            try:
+                self.buf.close()
+            except BufferError:
+                pass # Blocks still use it, it is unmapped once they are gone
+        self.file.close()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def skipLines(self, numLines, start=0):
+        """ Offset of the line numLines lines after the one at start """
+        for n in range(numLines):
+            end = self.buf.find(b'\n', start)
+            start = len(self.buf) if end < 0 else end + 1
+        return start
+
+    def blocks(self, start=0, blockBytes=BLOCK_BYTES):
+        """ Blocks of whole lines from start to the end of the file """
+        while start < len(self.buf):
+            stop = min(start + blockBytes, len(self.buf))
+            block = Block(self.buf, self.data, start, stop)
+            if not len(block):
+                """ A line longer than the block, so try a bigger one """
+                blockBytes *= 2
+                continue
+            yield block
+            start = block.next
+
+    def block(self, start=0):
+        """ One Block of every line from start to the end of the file """
+        return Block(self.buf, self.data, start, len(self.buf))
+
+
+def hurdatLayout(block):
+    """ Lines of a Block of a HURDAT2 file that are storm headers, e.g.
+            AL011851,            UNNAMED,     14,
+        and the number of data lines that follow each, from the numbers of
+        fields on the lines rather than the counts in the headers.  Returns
+        (header line indexes, numbers of observations).  Reading stops at
+        the first blank line, as the readers do. """
+    blank = np.flatnonzero(block.lineStarts == block.lineEnds)
+    numLines = int(blank[0]) if len(blank) else len(block)
+    isHeader = block.numFields()[:numLines] < HURDAT_DATA_FIELDS
+    headers = np.flatnonzero(isHeader)
+    return headers, np.diff(np.append(headers, numLines)) - 1
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Storm and observation objects, and the classification of each observation.
+
+"""
+
+import hashlib
+import datetime as dt
+
+""" Processing functions """
+
+def getCat(nature, wind):
+    """ This function returns the appropriate classification of
+    Saffir-Simpson scale or other classification given the reported
+    Nature and 1-minute averaged wind speed in nautical miles/hour (Knots).
+    The logic used in the previous SQL calculations for classification was:
+        DESCRIP_NAME HHT_CODE   MIN  MAX    COLOR       LINE     ?   ORIGINAL_NATURE
+        Disturbance      DS      30   70    black       Solid    4      DB
+        Extratropical    ET       0   0     black       dashed   5      EX
+        Category 1       H1      64   83    red         Solid   10      HU
+        Category 2       H2      83   96    red         Solid   11      HU
+        Category 3       H3      96  113    dark red    Solid   12      HU
+        Category 4       H4     113  137    dark red    Solid   13      HU
+        Category 5       H5     137  999    dark red    Solid   14      HU
+        Mixed Reports    MX      30   70    gray        Solid    3      NA or MX
+        Unknown          N/A     -1  999    gray        Solid    2      NA
+        N/A              NR      30   70    blue        Solid    1      NA
+        Subtrop Depr     SD       0   34    orange      Solid    6      SD
+        Subtrop Storm    SS      34  999    blue        Solid    7      SS
+        Trop Depression  TD       0   34    green       Solid    8      TD
+        Tropical Storm   TS      34   64    yellow      Solid    9      TS
+    NOTE: As of 4/29/2015, the IBTrACS and HURDAT2 data files used a total
+       of 13 different Nature names:
+ 'DB', 'DS', 'ET', 'EX', 'HU', 'LO', 'MX', 'NR', 'PT', 'SD', 'SS', 'TD', 'TS'
+ IBTrACS uses just these in v03r06:
+ ['DS', 'ET', 'MX', 'NR', 'SS', 'TS']
+ HURDAT2014/2015 uses:
+ ['DB', 'ET', 'EX', 'HU', 'LO', 'PT', 'SD', 'SS', 'TD', 'TS', 'TY', 'WV']
+
+    Boundary values and naming conventions used here follow the FAQ from
+    NOAA's Hurricane Research Division:
+            http://www.aoml.noaa.gov/hrd/tcfaq/A5.html
+    and the Saffir-Simpson values as revised by the National Hurricane Center
+    and defined in this document:
+            http://www.nhc.noaa.gov/pdf/sshws_2012rev.pdf
+
+    NOTE BENE: In addition, we have extended the UPPER boundary defined
+    by the SS Scale up to, but not including, the lower boundary of the
+    next higher class.  This is necessary because the NHC's Saffir-Simpson
+    definitions are stricly for integer values of wind speed, which makes
+    sense given the lack of precision at which they can accurately be
+    measured.  HOWEVER, when converting from units and averaging intervals
+    from other reporting Centers, there may be convereted 1-minute winds that
+    fall within the 1 knot "gaps" in the NHC's Saffir-Simpson definations.
+    In order to classify those wind speeds, we use the use the following
+    logic to assign a storm to some class X:
+        Lower Bound(Class X) <= Converted 1-min Wind < Upper Bound(Class X+1)
+
+    Questions can be directed to:
+        Dave Eslinger, dave.eslinger@noaa.gov
+
+    """
+
+    """ New (9 June 2016) logic: classify everything as a tropical
+        system according to its wind speed.  Then only reclassify those
+        that specifically are listed as extra-tropical.  This should get
+        rid of many of the NR results, which occur in areas beyond the US
+        reporting areas and which do not use the Saffir-Simpson Scale.
+        """
+    if wind >= 137:
+        catSuffix = 'H5'
+    elif wind >= 113:
+        catSuffix = 'H4'
+    elif wind >= 96:
+        catSuffix = 'H3'
+    elif wind >= 83:
+        catSuffix = 'H2'
+    elif wind >= 64:
+        catSuffix = 'H1'
+    elif wind >= 34:
+        catSuffix = 'TS' # Storm
+    elif wind >= 0:
+        catSuffix = 'TD' # Depression
+    else:
+        catSuffix = "NR"
+#        print('No Wind speed, Nature, wind, suffix = ',nature,wind,catSuffix)
+
+    """ Now figure out what it is """
+    if (nature[0] == 'E'):
+        return 'ET'
+    else:
+        return catSuffix
+
+#==============================================================================
+"""------------------------END OF getCat-------------------------------"""
+
+""" Wind column of each agency in IBTrACSv04, with its pressure in the next
+    column.  WIND_PRIORITY in config.ini orders them, originally by number of
+    observations in IBTrACSv04r00; IBTrACSv04_exploring.py counts them. """
+WIND_COLUMNS = {'USA': 23,
+                'DS824': 129,
+                'WMO': 10,
+                'CMA': 57,          # China
+                'TD9636': 134,
+                'NEUMANN': 144,
+                'HKO': 62,          # Hong Kong
+                'TOKYO': 45,
+                'BOM': 95,          # Australia
+                'TD9635': 138,
+                'MLC': 149,
+                'REUNION': 75,      # France
+                'WELLINGTON': 124,  # New Zealand
+                'NADI': 120,        # Fiji
+                'NEWDELHI': 67}
+
+
+def windColumns(agencies):
+    """ IBTrACS wind columns of the agencies, in their order """
+    unknown = [agency for agency in agencies if agency not in WIND_COLUMNS]
+    if unknown:
+        raise ValueError('Unknown WIND_PRIORITY agencies ' + ', '.join(unknown) +
+                         ', expected some of ' + ', '.join(WIND_COLUMNS))
+    return [WIND_COLUMNS[agency] for agency in agencies]
+
+
+""" getWindPres function to find none NaN wind and pressure in data """
+def getWindPres(values, possibles=tuple(WIND_COLUMNS.values())):
+    windSpd = ' ' # Default to missing value
+    pressure = ' ' # Default to missing value
+
+    # possibles are the wind columns to try, from windColumns(WIND_PRIORITY)
+    for i in possibles:
+        if(values[i] != ' '): # Good data exists, use it
+            windSpd = values[i]
+            pressure = values[i+1]
+            break
+
+    return (windSpd, pressure)
+
+"""------------------------END OF getWindPres-------------------------------"""
+
+
+def inputDigest(storm):
+    """ Digest of everything read for a storm, so equal digests mean the
+        storm did not change between two reads of the inputs """
+    key = repr((storm.uid, storm.name, storm.basin, storm.source,
+                [(seg.time, seg.startLat, seg.startLon, seg.wsp, seg.pres,
+                  seg.nature) for seg in storm.segs]))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+""" SEGMENT_IDs are a storm number followed by four digits of observation
+    index, kept below 2**53 so they stay exact as doubles, e.g. in
+    JavaScript or the DBF readers that use floats """
+SEGMENTS_PER_STORM = 10000
+NUM_STORM_NUMBERS = 2**53 // SEGMENTS_PER_STORM
+
+
+def stormNumber(storm):
+    """ Number for a storm derived from its ID and basin alone """
+    digest = hashlib.blake2b((storm.uid + ' ' + str(storm.basin)).encode(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % NUM_STORM_NUMBERS
+
+
+def numberSegments(storms):
+    """ Gives each storm without one the SEGMENT_ID of its first segment,
+        from its storm number, so a segment's ID depends only on the storm's
+        ID and basin and the index of its observation.  In the unlikely
+        case of two storms with the same number, the later one takes the
+        next free number. """
+    used = {storm.firstSegmentID for storm in storms
+            if getattr(storm, 'firstSegmentID', None) is not None}
+    for storm in storms:
+        if getattr(storm, 'firstSegmentID', None) is None:
+            number = stormNumber(storm)
+            while number*SEGMENTS_PER_STORM in used:
+                number = (number + 1) % NUM_STORM_NUMBERS
+            storm.firstSegmentID = number*SEGMENTS_PER_STORM
+            used.add(storm.firstSegmentID)
+
+
+""" Create needed Objects """
+class Storm(object):
+    def __init__(self,uid,name):
+        self.uid = uid.strip()
+        self.name = name.strip()
+        self.basin = None
+        self.startTime = None
+        self.endTime = None
+        self.maxW = float(-1.)
+        self.minP = float(9999.)
+        self.startLat = 0.0
+        self.startLon = 0.0
+        self.numSegs = 0
+        self.maxSaffir = "NR"
+        self.enso = "Y"
+        self.source = ""  # 0 = IBTrACS, 1 or 2 = HURDAT2 Atl, NEPAC
+        self.season = None
+        self.provisional = False # IBTrACS track marked PROVISIONAL
+        self.inputHash = None # inputDigest() as read, before QA
+        self.firstSegmentID = None # SEGMENT_ID of the first segment
+        self.segs = []
+
+class Observation(object):
+    def __init__(self,time,lat,lon,wsp,pres,nature):
+        if isinstance(time, dt.datetime): # Already parsed, as for HURDAT2
+            self.time = time
+        else:
+            try:
+                self.time = dt.datetime.strptime(time,'%Y-%m-%d %H:%M:%S')
+    #            break
+            except ValueError:
+                try:
+                    self.time = dt.datetime.strptime(time,'%m/%d/%Y %H:%M')
+                except:
+                    pass
+        self.startLat = float(lat)
+        self.startLon = float(lon)
+        if wsp == ' ' or float(wsp) < 0 : # N.B. ' ' is the IBTrACSv04 no data value
+            self.wsp = float(-1.0)
+        else:
+            self.wsp = float(wsp)
+        if pres == ' ' or float(pres) < 0:
+            self.pres = float(-1.0)
+        else:
+            self.pres = float(pres)
+        self.nature = nature.strip()
+
+class Segment(Observation):
+    def __init__(self,time,lat,lon,wsp,pres,nature):
+        super().__init__(time,lat,lon,wsp,pres,nature)
+        self.endLat = float(lat)
+        self.endLon = float(lon)
+        self.saffir = ""
+        self.enso = "X"
+        self.amm = "U"
+        self.pdo = "U"
+        self.amo = "U"
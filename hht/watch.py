@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: keep the parsed storms in memory and rebuild the outputs
+whenever an input file in the data directory changes.
+
+Only the source that changed is read again: the IBTrACS file, or one of the
+HURDAT2 files.  A new crosswalk reads the HURDAT2 files again, and new ENSO,
+storm report or land files are loaded again the next time they are used.
+Storms whose observations did not change keep their QA results, so only new
+and changed storms go through QA.  The outputs are then written to a new
+version directory, copied from the current one so the incremental outputs
+(vector tiles, cell index) only update what changed, and the results
+directory, a symbolic link to the current version, is switched to it in
+one step.  Readers of the results directory see either the old or the new
+outputs, never a mix.
+
+Changes are noticed with inotify on Linux, and by polling the modification
+times and sizes of the files everywhere else.  checkRebuild() runs two
+rebuilds in a scratch directory from the local input files, to check the
+versions and the results link without waiting for a download.
+
+"""
+
+import os
+import copy
+import time
+import shutil
+import tempfile
+import select
+import struct
+import ctypes
+import ctypes.util
+import datetime as dt
+
+import numpy as np
+
+import qaChecks # Local python module
+
+from . import lookups
+from . import readers
+from . import pipeline
+
+""" inotify event bits, from <sys/inotify.h> """
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_CREATE = 0x100
+""" struct inotify_event: int wd; uint32_t mask, cookie, len; char name[] """
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class _Inotify(object):
+    """ Names of the files changed in a directory, from inotify """
+    def __init__(self, dirName):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(dirName),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE |
+                                  IN_CREATE) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def wait(self, timeout):
+        """ Names changed within timeout seconds, empty if none """
+        names = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+
+class _Poller(object):
+    """ Names of the files changed in a directory, by comparing their
+        modification times and sizes every interval seconds """
+    def __init__(self, dirName, interval):
+        self.dirName = dirName
+        self.interval = interval
+        self.state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for entry in os.scandir(self.dirName):
+            if entry.is_file():
+                info = entry.stat()
+                state[entry.name] = (info.st_mtime_ns, info.st_size)
+        return state
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        state = self._scan()
+        names = {name for name in set(state) | set(self.state)
+                 if state.get(name) != self.state.get(name)}
+        self.state = state
+        return names
+
+
+def directoryWatcher(dirName, interval=2.):
+    """ inotify watcher of dirName if the system has it, else a poller """
+    try:
+        return _Inotify(dirName)
+    except (OSError, AttributeError, TypeError):
+        return _Poller(dirName, interval)
+
+
+def stormKey(storm):
+    """ Everything read for a storm, so equal keys mean an unchanged storm """
+    return (storm.uid, storm.name, storm.basin, storm.source,
+            tuple((seg.time, seg.startLat, seg.startLon, seg.wsp, seg.pres,
+                   seg.nature) for seg in storm.segs))
+
+
+def copyStorm(storm):
+    """ Copy of a storm and its observations, for QA to change """
+    newStorm = copy.copy(storm)
+    newStorm.segs = [copy.copy(seg) for seg in storm.segs]
+    return newStorm
+
+
+class Watcher(object):
+    """ The storms of every source, kept between rebuilds of the outputs
+        described by cfg.  keep is the number of output versions kept. """
+    def __init__(self, cfg, keep=2):
+        self.cfg = cfg
+        self.keep = keep
+        self.resultsLink = os.path.normpath(cfg.resultsDir)
+        self.versionsDir = self.resultsLink + '.versions'
+        self.ibStorms = None
+        self.ibCounts = None
+        self.hStorms = {}   # storms and counts by index in cfg.hFiles
+        self.prepared = {}  # (flags, storm after QA or None) by stormKey
+
+    def _files(self):
+        """ Kind of input for the base name of each watched file """
+        cfg = self.cfg
+        files = {os.path.basename(cfg.ibtracsFileName): 'ibtracs',
+                 os.path.basename(cfg.nameMappingFile): 'crosswalk',
+                 os.path.basename(cfg.ensoFileName): 'enso',
+                 os.path.basename(cfg.reportFileName): 'report'}
+        for i, fileName in enumerate(cfg.hFiles):
+            files[os.path.basename(fileName)] = i
+        for ext in ('.shp', '.shx', '.dbf'):
+            files[os.path.basename(cfg.landFileName) + ext] = 'land'
+        return files
+
+    def _read(self, changed):
+        """ Reads the sources affected by the changed inputs again and
+            forgets lookups and QA results that depend on them.  Returns
+            False if none of the changes are inputs. """
+        files = self._files()
+        kinds = set(files.values()) if changed is None else \
+            {files[name] for name in changed if name in files}
+        if not kinds:
+            return False
+        if 'crosswalk' in kinds:
+            lookups.ibNames.cache_clear()
+            kinds.update(range(len(self.cfg.hFiles)))
+        if 'enso' in kinds:
+            lookups.ensoLookup.cache_clear()
+            self.prepared = {}
+        if 'report' in kinds:
+            lookups.reportLookup.cache_clear()
+        if 'land' in kinds:
+            lookups.landIndex.cache_clear()
+        if 'ibtracs' in kinds or self.ibStorms is None:
+            self.ibStorms, self.ibCounts = readers.readIBTrACS(self.cfg)
+        for i in range(len(self.cfg.hFiles)):
+            if i in kinds or i not in self.hStorms:
+                self.hStorms[i] = readers.readHURDAT2(self.cfg, [i])
+        return True
+
+    def _qa(self, allStorms, cfg):
+        """ The qa stage, only checking and preparing storms not seen
+            before.  The report lists the bad observations of all storms. """
+        keys = [stormKey(storm) for storm in allStorms]
+        fresh = {}
+        for key, storm in zip(keys, allStorms):
+            if key not in self.prepared:
+                fresh[key] = storm
+        ensoLookup = lookups.ensoLookup(cfg.ensoFileName)
+        freshFlags = qaChecks.checkObservations(list(fresh.values()))
+        toPrepare = []
+        for (key, storm), flags in zip(fresh.items(), freshFlags):
+            newStorm = copyStorm(storm)
+            if cfg.FLAG_BAD:
+                kept, numRemoved = qaChecks.dropBad([newStorm], [flags])
+                newStorm = kept[0] if kept else None
+            if newStorm is not None:
+                toPrepare.append(newStorm)
+            self.prepared[key] = (flags, newStorm)
+        pipeline.prepareStorms(toPrepare, cfg, ensoLookup)
+        """ Forget storms that are gone """
+        self.prepared = {key: self.prepared[key] for key in keys}
+
+        obsFlags = [self.prepared[key][0] for key in keys]
+        numBadObs = qaChecks.writeReport(cfg.qaReportFileName, allStorms, obsFlags)
+        numBadRemoved = 0
+        numBadStorms = 0
+        if cfg.FLAG_BAD:
+            numBadRemoved = sum(int(np.count_nonzero(flags & qaChecks.BAD))
+                                for flags in obsFlags)
+            numBadStorms = sum(self.prepared[key][1] is None for key in keys)
+        qaStorms = [self.prepared[key][1] for key in keys
+                    if self.prepared[key][1] is not None]
+        qaReport = pipeline.qaSummary(obsFlags, numBadObs,
+                                      cfg.qaReportFileName,
+                                      numBadRemoved, numBadStorms)
+        return qaStorms, {'qaReport': qaReport}, len(fresh)
+
+    def _versionDir(self):
+        """ Name for a new version directory, in time order """
+        return os.path.join(self.versionsDir,
+                            dt.datetime.now().strftime('%Y%m%d%H%M%S%f'))
+
+    def _newVersion(self):
+        """ A new version directory holding a copy of the current outputs,
+            and a Config writing to it """
+        if os.path.isdir(self.resultsLink) and not os.path.islink(self.resultsLink):
+            """ First time: the results directory becomes the first version """
+            firstDir = self._versionDir()
+            os.makedirs(self.versionsDir, exist_ok=True)
+            os.rename(self.resultsLink, firstDir)
+            self._switch(firstDir)
+        newDir = self._versionDir()
+        if os.path.isdir(self.resultsLink):
+            shutil.copytree(os.path.realpath(self.resultsLink), newDir,
+                            symlinks=True)
+        else:
+            os.makedirs(newDir)
+        versionCfg = copy.copy(self.cfg)
+        versionCfg.resultsDir = newDir
+        if os.path.normpath(self.cfg.logDir) == self.resultsLink:
+            versionCfg.logDir = newDir
+        return newDir, versionCfg
+
+    def _switch(self, newDir):
+        """ Points the results link at newDir in one step """
+        tmpLink = self.resultsLink + '.tmp'
+        if os.path.lexists(tmpLink):
+            os.remove(tmpLink)
+        os.symlink(os.path.relpath(newDir, os.path.dirname(self.resultsLink)
+                                   or '.'), tmpLink)
+        os.replace(tmpLink, self.resultsLink)
+
+    def _prune(self):
+        """ Removes all but the newest keep versions """
+        current = os.path.realpath(self.resultsLink)
+        versions = sorted(os.path.join(self.versionsDir, name)
+                          for name in os.listdir(self.versionsDir))
+        versions = [v for v in versions if os.path.realpath(v) != current]
+        for old in versions[:max(len(versions) - self.keep + 1, 0)]:
+            shutil.rmtree(old)
+
+    def rebuild(self, changed=None):
+        """ Brings the outputs up to date after the inputs with base names
+            in changed were written, or everything if changed is None.
+            Returns the counts of the run, or None if nothing needed doing. """
+        start = dt.datetime.now()
+        if not self._read(changed):
+            return None
+        allStorms = list(self.ibStorms)
+        counts = dict(self.ibCounts, hstormNum=[0]*len(self.cfg.hFiles))
+        for i, (storms, hCounts) in sorted(self.hStorms.items()):
+            allStorms += storms
+            counts['hstormNum'][i] = hCounts['hstormNum'][i]
+            counts['numSinglePoint'] += hCounts['numSinglePoint']
+        allStorms, dedupCounts = pipeline.dedup(allStorms, self.cfg)
+        counts.update(dedupCounts)
+
+        newDir, versionCfg = self._newVersion()
+        qaStorms, qaCounts, numFresh = self._qa(allStorms, versionCfg)
+        counts.update(qaCounts)
+        with open(versionCfg.logFileName, 'w') as logFile:
+            counts = pipeline.write(qaStorms, versionCfg, counts, logFile)
+        self._switch(newDir)
+        self._prune()
+        print("\nWATCH: {0} storms checked again, outputs in {1} after "
+              "{2:.1f} s".format(numFresh, newDir,
+                                 (dt.datetime.now() - start).total_seconds()))
+        return counts
+
+    def run(self, interval=2., settle=1.):
+        """ Rebuilds everything, then rebuilds again each time inputs change,
+            once they have gone settle seconds without changing again """
+        watcher = directoryWatcher(self.cfg.dataDir, interval)
+        print("Watching " + self.cfg.dataDir + " with " +
+              ("inotify" if isinstance(watcher, _Inotify) else "polling"))
+        self.rebuild()
+        while True:
+            changed = watcher.wait(interval)
+            if not changed:
+                continue
+            while True:
+                more = watcher.wait(settle)
+                if not more:
+                    break
+                changed |= more
+            self.rebuild(changed)
+
+
+def checkRebuild(cfg):
+    """ Rebuilds the outputs of cfg in a scratch directory, touches the ENSO
+        file and rebuilds again, as run() would after it was downloaded, and
+        checks the second rebuild wrote a new version and switched the
+        results link to it.  The other input files are linked to, not
+        copied.  Returns a list of the problems found. """
+    problems = []
+    workDir = tempfile.mkdtemp(prefix='hhtWatchCheck')
+    try:
+        dataDir = os.path.join(workDir, 'data')
+        os.makedirs(dataDir)
+        ensoName = os.path.basename(cfg.ensoFileName)
+        for name in os.listdir(cfg.dataDir):
+            source = os.path.abspath(os.path.join(cfg.dataDir, name))
+            if name == ensoName:
+                """ A copy, so touching it leaves the original alone """
+                shutil.copy2(source, os.path.join(dataDir, name))
+            else:
+                os.symlink(source, os.path.join(dataDir, name))
+        checkCfg = copy.copy(cfg)
+        checkCfg.dataDir = dataDir
+        checkCfg.resultsDir = checkCfg.logDir = os.path.join(workDir, 'results')
+        checkCfg.checkpointDir = os.path.join(workDir, 'checkpoints')
+        os.makedirs(checkCfg.resultsDir)
+
+        watcher = Watcher(checkCfg)
+        watcher.rebuild()
+        firstDir = os.path.realpath(watcher.resultsLink)
+        os.utime(checkCfg.ensoFileName)
+        if watcher.rebuild({ensoName}) is None:
+            problems.append("touching " + ensoName + " did not rebuild")
+        newDir = os.path.realpath(watcher.resultsLink)
+        if not os.path.islink(watcher.resultsLink):
+            problems.append(watcher.resultsLink + " is not a link")
+        if newDir == firstDir:
+            problems.append("the results link was not switched from " + firstDir)
+        if (os.path.dirname(newDir) != os.path.realpath(watcher.versionsDir)
+                or not os.path.isdir(newDir)):
+            problems.append("no new version directory, the link is to " + newDir)
+        else:
+            """ As the version's Config names it """
+            qaReportFileName = os.path.join(
+                watcher.versionsDir, os.path.basename(newDir)) + '/qaReport.csv'
+            if not os.path.exists(qaReportFileName):
+                problems.append("no " + qaReportFileName)
+            with open(os.path.join(newDir, 'update.log')) as logFile:
+                if qaReportFileName not in logFile.read():
+                    problems.append("the log of " + newDir + " does not name "
+                                    "its own qaReport.csv")
+    finally:
+        shutil.rmtree(workDir)
+    return problems
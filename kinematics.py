@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Track kinematics for every segment: great circle length, forward
+(translation) speed and heading, computed with NumPy for all observations
+at once.
+
+Lengths use the haversine formula and headings the initial great circle
+bearing.  Both only use the sine and cosine of the longitude difference, so
+a segment crossing 180 gets the same answer whether or not its longitudes
+were adjusted to keep their sign.
+
+The Earth constants, wrapLon and the order of the Saffir-Simpson codes are
+here, with only NumPy imported, so the other modules working on segments
+share them.
+
+"""
+
+import numpy as np
+
+""" Mean earth radius in nautical miles """
+EARTH_RADIUS_NM = 3440.065
+""" Nautical miles per degree of latitude """
+NM_PER_DEGREE = 60.0
+
+
+def wrapLon(lon):
+    """ Longitudes, scalar or array, wrapped into [-180, 180) """
+    return (np.asarray(lon, dtype=float) + 180.0) % 360.0 - 180.0
+
+
+""" Saffir-Simpson codes from getCat() in hht/storms.py, weakest first """
+catOrder = ['NR', 'ET', 'TD', 'TS', 'H1', 'H2', 'H3', 'H4', 'H5']
+
+""" Missing value for the speed and heading of segments that have none, i.e.
+    the last observation of a storm or repeated observation times """
+MISSING = -1.0
+
+
+def haversine(lat0, lon0, lat1, lon1):
+    """ Great circle distance in nautical miles between arrays of points """
+    lat0, lon0, lat1, lon1 = (np.radians(np.asarray(a, dtype=float))
+                              for a in (lat0, lon0, lat1, lon1))
+    h = (np.sin((lat1 - lat0)/2.)**2
+         + np.cos(lat0)*np.cos(lat1)*np.sin((lon1 - lon0)/2.)**2)
+    return 2.*EARTH_RADIUS_NM*np.arcsin(np.sqrt(np.clip(h, 0., 1.)))
+
+
+def bearing(lat0, lon0, lat1, lon1):
+    """ Initial bearing in degrees clockwise from north, 0 to 360, from each
+        start point toward its end point """
+    lat0, lon0, lat1, lon1 = (np.radians(np.asarray(a, dtype=float))
+                              for a in (lat0, lon0, lat1, lon1))
+    dLon = lon1 - lon0
+    y = np.sin(dLon)*np.cos(lat1)
+    x = np.cos(lat0)*np.sin(lat1) - np.sin(lat0)*np.cos(lat1)*np.cos(dLon)
+    return np.degrees(np.arctan2(y, x)) % 360.
+
+
+def trackLengths(storm):
+    """ Distances in nautical miles between each observation of a storm and
+        the next, one fewer than the observations """
+    lats = np.array([seg.startLat for seg in storm.segs])
+    lons = np.array([seg.startLon for seg in storm.segs])
+    return haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def segmentKinematics(storms):
+    """ Length (nautical miles), speed (knots) and heading (degrees) of
+        every segment of every storm, as three arrays in storm then segment
+        order.  Each segment runs from its observation to the next one of
+        the same storm.  A storm's last segment has length 0 and MISSING
+        speed and heading. """
+    segs = [seg for storm in storms for seg in storm.segs]
+    lat0 = np.array([seg.startLat for seg in segs])
+    lon0 = np.array([seg.startLon for seg in segs])
+    lat1 = np.array([seg.endLat for seg in segs])
+    lon1 = np.array([seg.endLon for seg in segs])
+    times = np.array([seg.time for seg in segs], dtype='datetime64[m]')
+
+    last = np.cumsum([len(storm.segs) for storm in storms]) - 1
+    hasNext = np.ones(len(segs), dtype=bool)
+    hasNext[last] = False
+    hours = np.zeros(len(segs))
+    hours[:-1] = (times[1:] - times[:-1]).astype(np.int64)/60.
+
+    length = np.where(hasNext, haversine(lat0, lon0, lat1, lon1), 0.)
+    moving = hasNext & (hours > 0.)
+    speed = np.full(len(segs), MISSING)
+    speed[moving] = length[moving]/hours[moving]
+    heading = np.where(hasNext & (length > 0.),
+                       bearing(lat0, lon0, lat1, lon1), MISSING)
+    return length, speed, heading
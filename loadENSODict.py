@@ -15,13 +15,16 @@ to create a dictionary to tag each segment with it's ENSO state.
 
 """
 import configparser
-""" Declarations and Parameters from Configuration file"""
-config = configparser.ConfigParser()
-config.read('./config.ini')
-dataDir = config.get('DIRECTORIES','DATA')
-ensoFile = dataDir + "/ensoData.txt"
 
-def ensoDict():
+def ensoDict(ensoFile=None):
+    """ ENSO state by YYYY-MM key from ensoFile, by default ensoData.txt in
+        the DATA directory of config.ini """
+    if ensoFile is None:
+        """ Declarations and Parameters from Configuration file"""
+        config = configparser.ConfigParser()
+        config.read('./config.ini')
+        dataDir = config.get('DIRECTORIES','DATA')
+        ensoFile = dataDir + "/ensoData.txt"
 # =============================================================================
 #     """ This bit will get the raw text data from the CPO data site """
 #     ensoURL = config.get('DOWNLOAD','ENSOURL')
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk loads the Tracks and Segments produced by annualDataUpdate.py straight
+into a PostgreSQL/PostGIS database, the planned version 3 back end for the
+Historical Hurricane Tracks web site.
+
+Rows are streamed with COPY ... FROM STDIN in CSV format.  Geometries are
+sent in the same stream as hex EWKB, which PostGIS accepts as text input
+for geometry columns, so no separate geometry step is needed.  Each layer
+is loaded into a staging table, indexed and analyzed, and then swapped in
+for the live table in a single transaction, so the web application never
+sees a half loaded table.
+
+This needs the psycopg2 package, which is only imported when a load is
+actually run.  To try it against a throwaway local database:
+    createdb hht_test && psql -d hht_test -c "CREATE EXTENSION postgis"
+    python3 loadPostGIS.py --dsn "dbname=hht_test" results/Hurricanes_WGS84.gpkg
+
+To check that a second load swaps in over the tables of the first, which
+is skipped unless HHT_TEST_DSN gives a database to use:
+    HHT_TEST_DSN="dbname=hht_test" python3 loadPostGIS.py --check
+
+"""
+
+import io
+import os
+import csv
+import sys
+import time
+import sqlite3
+import argparse
+
+import writeGeoPackage # Local python module
+
+""" Shapefile field types mapped to PostgreSQL column types.  Callers can
+    override any column type by name. """
+columnTypes = {'C': 'text', 'N': 'double precision', 'D': 'date',
+               'L': 'boolean'}
+
+""" EWKB flag marking that an SRID follows the geometry type """
+EWKB_SRID_FLAG = 0x20000000
+
+
+def multiLineEWKB(parts, srsID):
+    """ Returns hex EWKB, i.e. WKB with the SRID embedded, for a
+    MultiLineString made from shapefile style parts """
+    wkb, envelope = writeGeoPackage.multiLineWKB(parts)
+    """ Little endian WKB: byte order, uint32 type, then the geometry.
+        EWKB sets the SRID flag on the type and puts the SRID after it. """
+    wkbType = int.from_bytes(wkb[1:5], 'little') | EWKB_SRID_FLAG
+    return (wkb[0:1] + wkbType.to_bytes(4, 'little')
+            + srsID.to_bytes(4, 'little') + wkb[5:]).hex()
+
+
+class _CopyStream(object):
+    """ File-like object handed to cursor.copy_expert().  It formats rows as
+        CSV only as COPY asks for more data, so a whole layer is never held
+        in memory as text. """
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.pending = ''
+        self.numRows = 0
+        self.numBytes = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.writer.writerow(row)
+            self.numRows += 1
+            self.pending += self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        if size < 0:
+            size = len(self.pending)
+        chunk = self.pending[:size]
+        self.pending = self.pending[size:]
+        self.numBytes += len(chunk)
+        return chunk
+
+
+def _pgValue(fieldType, value):
+    """ CSV text for one attribute.  An empty, unquoted value is NULL. """
+    if value is None:
+        return ''
+    if fieldType == 'N':
+        try:
+            value = float(value)
+        except ValueError:
+            return ''
+        """ Whole numbers are written without a decimal point so that they
+            also load into integer columns """
+        return str(int(value)) if value.is_integer() else repr(value)
+    return value
+
+
+def _loadLayer(cursor, schema, layer, srsID):
+    """ COPYs one layer into a fresh staging table and builds its indexes.
+        Returns (rows, bytes) sent. """
+    table = layer['name'].lower()
+    staging = table + '_staging'
+    fields = layer['fields']
+    types = dict(layer.get('types', {}))
+    columns = [field[0].lower() for field in fields]
+    colDefs = ['ogc_fid serial PRIMARY KEY',
+               'geom geometry(MultiLineString, %d)' % srsID]
+    for field, column in zip(fields, columns):
+        colType = types.get(field[0], columnTypes.get(field[1], 'text'))
+        """ GeoPackage INTEGER columns hold 64 bit values """
+        colDefs.append('"%s" %s' % (column,
+            'bigint' if colType == 'INTEGER' else colType))
+    cursor.execute('DROP TABLE IF EXISTS "%s"."%s"' % (schema, staging))
+    cursor.execute('CREATE TABLE "%s"."%s" (%s)'
+                   % (schema, staging, ', '.join(colDefs)))
+
+    fieldTypes = [field[1] for field in fields]
+    rows = ([multiLineEWKB(parts, srsID)] +
+            [_pgValue(ft, v) for ft, v in zip(fieldTypes, record)]
+            for parts, record in zip(layer['coords'], layer['records']))
+    stream = _CopyStream(rows)
+    cursor.copy_expert(
+        'COPY "%s"."%s" (geom, %s) FROM STDIN WITH (FORMAT csv)'
+        % (schema, staging, ', '.join('"%s"' % c for c in columns)), stream)
+
+    """ Indexes are built after the COPY, on the staging table, and get
+        their final names when the table is swapped in """
+    cursor.execute('CREATE INDEX "%s_geom_idx" ON "%s"."%s" USING GIST (geom)'
+                   % (staging, schema, staging))
+    for column in layer.get('indexes', []):
+        cursor.execute('CREATE INDEX "%s_%s_idx" ON "%s"."%s" ("%s")'
+                       % (staging, column.lower(), schema, staging,
+                          column.lower()))
+    cursor.execute('ANALYZE "%s"."%s"' % (schema, staging))
+    return stream.numRows, stream.numBytes
+
+
+""" Views and materialized views using a table, directly or through other
+    views, with the greatest depth at which each uses it, so a view comes
+    after the views it uses """
+DEPENDENT_VIEWS = """
+    WITH RECURSIVE uses(oid, depth) AS (
+        SELECT r.ev_class, 1
+        FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.classid = 'pg_rewrite'::regclass
+            AND d.refobjid = to_regclass(%s) AND r.ev_class <> d.refobjid
+      UNION
+        SELECT r.ev_class, uses.depth + 1
+        FROM uses JOIN pg_depend d ON d.refobjid = uses.oid
+            JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.classid = 'pg_rewrite'::regclass AND r.ev_class <> d.refobjid)
+    SELECT format('%%I.%%I', n.nspname, c.relname), c.relkind,
+        pg_get_viewdef(c.oid), max(uses.depth)
+    FROM uses JOIN pg_class c ON c.oid = uses.oid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+    GROUP BY c.oid, n.nspname, c.relname, c.relkind
+    ORDER BY max(uses.depth), 1"""
+
+
+def _dependentViews(cursor, schema, table):
+    """ (name, relkind, definition) of the views using schema.table, each
+        after the views it uses """
+    cursor.execute(DEPENDENT_VIEWS, ('"%s"."%s"' % (schema, table),))
+    return [row[:3] for row in cursor.fetchall()]
+
+
+def _swapLayer(cursor, schema, layer):
+    """ Replaces the live table with the staging table, renaming its
+        indexes and sequence to match.  Views on the live table are dropped
+        and made again from their definitions on the new one, losing any
+        grants or comments on them.  Other objects depending on it, e.g.
+        foreign keys, make the swap fail.  Run inside the swap
+        transaction. """
+    table = layer['name'].lower()
+    staging = table + '_staging'
+    views = _dependentViews(cursor, schema, table)
+    for name, kind, definition in reversed(views):
+        cursor.execute('DROP %sVIEW %s'
+                       % ('MATERIALIZED ' if kind == 'm' else '', name))
+    cursor.execute('DROP TABLE IF EXISTS "%s"."%s"' % (schema, table))
+    cursor.execute('ALTER TABLE "%s"."%s" RENAME TO "%s"'
+                   % (schema, staging, table))
+    cursor.execute('ALTER INDEX "%s"."%s_pkey" RENAME TO "%s_pkey"'
+                   % (schema, staging, table))
+    cursor.execute('ALTER SEQUENCE "%s"."%s_ogc_fid_seq" RENAME TO "%s_ogc_fid_seq"'
+                   % (schema, staging, table))
+    cursor.execute('ALTER INDEX "%s"."%s_geom_idx" RENAME TO "%s_geom_idx"'
+                   % (schema, staging, table))
+    for column in layer.get('indexes', []):
+        cursor.execute('ALTER INDEX "%s"."%s_%s_idx" RENAME TO "%s_%s_idx"'
+                       % (schema, staging, column.lower(),
+                          table, column.lower()))
+    for name, kind, definition in views:
+        cursor.execute('CREATE %sVIEW %s AS %s'
+                       % ('MATERIALIZED ' if kind == 'm' else '', name,
+                          definition))
+
+
+def loadPostGIS(dsn, schema, srsID, layers):
+    """ Loads all layers into PostGIS and swaps them in atomically.
+
+    dsn is a libpq connection string, e.g. "dbname=hurricanes".  layers uses
+    the same dictionaries as writeGeoPackage.writeGeoPackage():
+        'name', 'fields', 'coords', 'records', 'indexes' and 'types'.
+    The live tables are schema.<name in lower case>.
+
+    Returns a dictionary of table name to (rows, seconds) for each layer.
+    """
+    import psycopg2 # Only needed when actually loading a database
+
+    stats = {}
+    connection = psycopg2.connect(dsn)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('CREATE SCHEMA IF NOT EXISTS "%s"' % schema)
+        connection.commit()
+        for layer in layers:
+            start = time.time()
+            numRows, numBytes = _loadLayer(cursor, schema, layer, srsID)
+            connection.commit()
+            seconds = time.time() - start
+            stats[layer['name']] = (numRows, seconds)
+            print("PostGIS: {0} rows ({1:.1f} MB) loaded into {2}.{3}_staging "
+                  "in {4:.1f} s, {5:.0f} rows/s".format(
+                      numRows, numBytes/1.e6, schema, layer['name'].lower(),
+                      seconds, numRows/max(seconds, 1.e-6)))
+
+        """ All layers loaded, so swap them all in at once """
+        for layer in layers:
+            _swapLayer(cursor, schema, layer)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return stats
+
+
+def layersFromGeoPackage(fileName):
+    """ Reads the layers written by writeGeoPackage back in the form
+        loadPostGIS() takes, so a finished results directory can be loaded
+        without rerunning annualDataUpdate.py.  Returns (srsID, layers). """
+    db = sqlite3.connect(fileName)
+    layers = []
+    srsID = 0
+    for table, srsID in db.execute(
+            "SELECT table_name, srs_id FROM gpkg_geometry_columns").fetchall():
+        info = db.execute('PRAGMA table_info("%s")' % table).fetchall()
+        names = [c[1] for c in info if c[1] not in ('fid', 'geom')]
+        types = {'C': 'TEXT', 'N': 'REAL', 'D': 'DATE'}
+        fields = [[c[1], {v: k for k, v in types.items()}.get(c[2], 'C'), '0']
+                  for c in info if c[1] not in ('fid', 'geom')]
+        coords = []
+        records = []
+        for row in db.execute('SELECT geom, %s FROM "%s" ORDER BY fid'
+                              % (', '.join('"%s"' % n for n in names), table)):
+            coords.append(_partsFromGeometry(row[0]))
+            records.append(list(row[1:]))
+        """ Integer columns stay integers """
+        intTypes = {c[1]: 'INTEGER' for c in info if c[2] == 'INTEGER'
+                    and c[1] != 'fid'}
+        """ Attribute indexes are named idx_<table>_<column> """
+        prefix = 'idx_%s_' % table
+        indexes = [r[0][len(prefix):] for r in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = ? ORDER BY name", (table,))
+            if r[0].startswith(prefix)]
+        layers.append({'name': table, 'fields': fields, 'coords': coords,
+                       'records': records, 'types': intTypes,
+                       'indexes': indexes})
+    db.close()
+    return srsID, layers
+
+
+def _partsFromGeometry(blob):
+    """ Shapefile style parts from a GeoPackage MultiLineString blob """
+    flags = blob[3]
+    envelopeBytes = [0, 32, 48, 48, 64][(flags >> 1) & 0x07]
+    wkb = memoryview(blob)[8 + envelopeBytes:]
+    numParts = int.from_bytes(wkb[5:9], 'little')
+    parts = []
+    offset = 9
+    for p in range(numParts):
+        numPoints = int.from_bytes(wkb[offset+5:offset+9], 'little')
+        offset += 9
+        points = wkb[offset:offset + 16*numPoints].cast('d')
+        parts.append([[points[2*k], points[2*k+1]] for k in range(numPoints)])
+        offset += 16*numPoints
+    return parts
+
+
+""" Environment variable with the DSN of the database checkSwap() uses """
+CHECK_DSN_VARIABLE = 'HHT_TEST_DSN'
+
+
+def _checkLayer(numRows):
+    """ A small layer of numRows two point tracks for checkSwap() """
+    return {'name': 'Tracks',
+            'fields': [['STORM_ID', 'C', '20'], ['YEAR', 'N', '4']],
+            'coords': [[[[-80. - k, 25.], [-81. - k, 26.]]]
+                       for k in range(numRows)],
+            'records': [['CHECK%02d' % k, 2000 + k] for k in range(numRows)],
+            'types': {'YEAR': 'INTEGER'},
+            'indexes': ['STORM_ID', 'YEAR']}
+
+
+def checkSwap(dsn, schema='hht_check'):
+    """ Loads a small layer into schema twice, so the second swap has to
+        replace the live table of the first, and checks the live table
+        after each load: its rows, the names of its indexes and sequence
+        and that no staging table is left.  Before the second load a view
+        and a materialized view on that view are made on the live table,
+        and they are checked to show the rows of the second.  schema is
+        dropped at the end.  Returns a list of the problems found. """
+    import psycopg2 # Only needed when actually loading a database
+
+    problems = []
+    table = 'tracks'
+    expectedIndexes = {table + '_pkey', table + '_geom_idx',
+                       table + '_storm_id_idx', table + '_year_idx'}
+    connection = psycopg2.connect(dsn)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('DROP SCHEMA IF EXISTS "%s" CASCADE' % schema)
+        connection.commit()
+        for load, numRows in enumerate((2, 3), start=1):
+            try:
+                loadPostGIS(dsn, schema, 4326, [_checkLayer(numRows)])
+            except Exception as e:
+                problems.append("load %d failed: %s" % (load, e))
+                break
+            cursor.execute('SELECT count(*) FROM "%s"."%s"' % (schema, table))
+            found = cursor.fetchone()[0]
+            if found != numRows:
+                problems.append("load %d: %d rows in %s, expected %d"
+                                % (load, found, table, numRows))
+            cursor.execute("SELECT tablename FROM pg_tables WHERE "
+                           "schemaname = %s", (schema,))
+            tables = {row[0] for row in cursor.fetchall()}
+            if tables != {table}:
+                problems.append("load %d: tables %s, expected only %s"
+                                % (load, sorted(tables), table))
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE "
+                           "schemaname = %s AND tablename = %s",
+                           (schema, table))
+            indexes = {row[0] for row in cursor.fetchall()}
+            if indexes != expectedIndexes:
+                problems.append("load %d: indexes %s, expected %s"
+                                % (load, sorted(indexes),
+                                   sorted(expectedIndexes)))
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'ogc_fid')",
+                           ('"%s"."%s"' % (schema, table),))
+            sequence = cursor.fetchone()[0]
+            if sequence != '%s.%s_ogc_fid_seq' % (schema, table):
+                problems.append("load %d: ogc_fid sequence %s, expected "
+                                "%s.%s_ogc_fid_seq"
+                                % (load, sequence, schema, table))
+            if load == 1:
+                cursor.execute('CREATE VIEW "%s".track_years AS SELECT '
+                               'storm_id, year FROM "%s"."%s"'
+                               % (schema, schema, table))
+                cursor.execute('CREATE MATERIALIZED VIEW "%s".recent_tracks AS '
+                               'SELECT storm_id FROM "%s".track_years WHERE '
+                               'year > 2000' % (schema, schema))
+            else:
+                for view, expected in (('track_years', numRows),
+                                       ('recent_tracks', numRows - 1)):
+                    cursor.execute('SELECT count(*) FROM "%s"."%s"'
+                                   % (schema, view))
+                    found = cursor.fetchone()[0]
+                    if found != expected:
+                        problems.append("load %d: %d rows in view %s, "
+                                        "expected %d" % (load, found, view,
+                                                         expected))
+            connection.commit()
+        cursor.execute('DROP SCHEMA "%s" CASCADE' % schema)
+        connection.commit()
+    finally:
+        connection.close()
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load a HHT GeoPackage into PostgreSQL/PostGIS')
+    parser.add_argument('geopackage', nargs='?',
+                        help='GeoPackage from annualDataUpdate.py')
+    parser.add_argument('--dsn',
+                        help='libpq connection string, e.g. "dbname=hurricanes"')
+    parser.add_argument('--schema', default='spatial',
+                        help='schema for the tracks and segments tables')
+    parser.add_argument('--check', action='store_true',
+                        help='check loading twice into the database given by '
+                        'the ' + CHECK_DSN_VARIABLE + ' environment variable '
+                        'instead, skipped if it is not set')
+    args = parser.parse_args()
+
+    if args.check:
+        dsn = os.environ.get(CHECK_DSN_VARIABLE)
+        if not dsn:
+            print("Skipped, " + CHECK_DSN_VARIABLE + " is not set")
+            sys.exit()
+        problems = checkSwap(dsn)
+        for problem in problems:
+            print("PROBLEM: " + problem)
+        sys.exit("Swap check failed" if problems else None)
+    if args.geopackage is None or args.dsn is None:
+        parser.error('a geopackage and --dsn are required unless --check is given')
+    srsID, layers = layersFromGeoPackage(args.geopackage)
+    if not layers:
+        sys.exit("No feature tables found in " + args.geopackage)
+    loadPostGIS(args.dsn, args.schema, srsID, layers)
@@ -19,13 +19,15 @@ https://docs.python.org/3.4/library/xml.etree.elementtree.html#module-xml.etree.
 import xml.etree.ElementTree as ET
 import configparser
 
-config = configparser.ConfigParser()
-config.read('./config.ini')
-dataDir = config.get('DIRECTORIES','DATA')
-stormReportFile = dataDir + "/stormreportData.txt"
-
-def rptDict():
-    """ Declarations and Parameters from Configuration file"""
+def rptDict(stormReportFile=None):
+    """ Storm report URL and basin by name and year from stormReportFile, by
+        default stormreportData.txt in the DATA directory of config.ini """
+    if stormReportFile is None:
+        """ Declarations and Parameters from Configuration file"""
+        config = configparser.ConfigParser()
+        config.read('./config.ini')
+        dataDir = config.get('DIRECTORIES','DATA')
+        stormReportFile = dataDir + "/stormreportData.txt"
 
     file = open(stormReportFile)
     data = file.read()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded prefix index of storm names for the HHT web site's name search, so
+autocomplete fetches a few KB instead of all of stormnames.js.
+
+Names are keyed in upper case with anything other than A-Z and 0-9 turned
+into '_'; the client must normalize what is typed the same way.  Keys are
+bucketed by their first character and any bucket holding more than
+SHARD_SIZE names is split again on the next character, so the shards form
+the top of a trie.  The shards are written to names/<prefix>.json, each a
+sorted list of
+    [name, [[storm ID, basin, year], ...]]
+and names/index.json lists every shard prefix with its number of names.
+To look up typed text, fetch the shard whose prefix is the longest one the
+text starts with, or, for text shorter than the shard prefixes, every shard
+whose prefix starts with the text.
+
+"""
+
+import os
+import re
+import glob
+import json
+
+""" Most names held by one shard before it is split on the next character """
+SHARD_SIZE = 200
+
+
+def nameKey(name):
+    """ Normalized search key for a storm name """
+    return re.sub('[^A-Z0-9]', '_', name.upper())
+
+
+class NameIndex(object):
+    """ Storm names collected storm by storm, then written as shards """
+    def __init__(self):
+        self.storms = {}
+
+    def add(self, name, uid, basin, year):
+        """ Adds one storm under its display name """
+        self.storms.setdefault(name, []).append([uid, basin, year])
+
+    def shards(self, maxNames=SHARD_SIZE):
+        """ Dictionary of shard prefix to the sorted names in that shard """
+        names = sorted(self.storms, key=nameKey)
+        shards = {}
+        self._split(names, 1, maxNames, shards)
+        return shards
+
+    def _split(self, names, depth, maxNames, shards):
+        buckets = {}
+        for name in names:
+            buckets.setdefault(nameKey(name)[:depth], []).append(name)
+        for prefix, bucket in buckets.items():
+            if (len(bucket) > maxNames
+                    and any(len(nameKey(n)) > depth for n in bucket)):
+                self._split(bucket, depth + 1, maxNames, shards)
+            else:
+                shards[prefix] = bucket
+
+    def write(self, dirName, maxNames=SHARD_SIZE):
+        """ Writes the shards and index.json, removing shards left from an
+            earlier run.  Returns (number of shards, largest shard in
+            bytes). """
+        os.makedirs(dirName, exist_ok=True)
+        shards = self.shards(maxNames)
+        largest = 0
+        for prefix, names in shards.items():
+            text = json.dumps([[name, self.storms[name]] for name in names],
+                              separators=(',', ':'))
+            with open(os.path.join(dirName, prefix + '.json'), 'w') as f:
+                f.write(text)
+            largest = max(largest, len(text))
+        with open(os.path.join(dirName, 'index.json'), 'w') as f:
+            json.dump({'shardSize': maxNames,
+                       'shards': {p: len(n) for p, n in sorted(shards.items())}},
+                      f, separators=(',', ':'))
+        for path in glob.glob(os.path.join(dirName, '*.json')):
+            prefix = os.path.basename(path)[:-len('.json')]
+            if prefix != 'index' and prefix not in shards:
+                os.remove(path)
+        return len(shards), largest
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Quality checks of every observation of every storm, run at once with NumPy
+after the storms are read and de-duplicated.
+
+Each observation gets a bit flag for each problem found:
+    BAD_LAT, BAD_LON    latitude outside -90 to 90, or longitude outside
+                        -360 to 360 (longitudes a little past 180 are
+                        legitimate and are handled by the 180 checks)
+    BAD_WIND, BAD_PRES  wind or pressure reported but outside WIND_RANGE or
+                        PRES_RANGE
+    TIME_REVERSED       earlier than the observation before it in the storm
+    DUPLICATE_TIME      at the same time as the observation before it
+    TOO_FAST            reached from the previous observation at more than
+                        MAX_SPEED_KT.  A lone bad position makes both the
+                        segment in and the segment out too fast, and then
+                        only that observation is flagged.
+    MISSING_WIND, MISSING_PRES
+Every flag but the two MISSING ones marks an observation as bad.  The bad
+observations are listed in a CSV report and, when FLAG_BAD is set in
+config.ini, removed from their storms.
+
+"""
+
+import os
+import csv
+
+import numpy as np
+
+import kinematics # Local python module
+
+""" Flag bits """
+BAD_LAT = 1
+BAD_LON = 2
+BAD_WIND = 4
+BAD_PRES = 8
+TIME_REVERSED = 16
+DUPLICATE_TIME = 32
+TOO_FAST = 64
+MISSING_WIND = 128
+MISSING_PRES = 256
+
+flagNames = [(BAD_LAT, 'BAD_LAT'), (BAD_LON, 'BAD_LON'),
+             (BAD_WIND, 'BAD_WIND'), (BAD_PRES, 'BAD_PRES'),
+             (TIME_REVERSED, 'TIME_REVERSED'),
+             (DUPLICATE_TIME, 'DUPLICATE_TIME'), (TOO_FAST, 'TOO_FAST'),
+             (MISSING_WIND, 'MISSING_WIND'), (MISSING_PRES, 'MISSING_PRES')]
+
+""" Flags that make an observation bad, as opposed to just incomplete """
+BAD = (BAD_LAT | BAD_LON | BAD_WIND | BAD_PRES | TIME_REVERSED |
+       DUPLICATE_TIME | TOO_FAST)
+
+""" Limits for reported values.  Winds are 1 minute winds in knots and
+    pressures are in mb. """
+WIND_RANGE = (0., 200.)
+PRES_RANGE = (850., 1050.)
+""" Fastest believable forward speed, in knots """
+MAX_SPEED_KT = 80.
+
+
+def checkObservations(storms):
+    """ Flags for every observation, one array per storm """
+    if not storms:
+        return []
+    segs = [seg for storm in storms for seg in storm.segs]
+    numObs = [len(storm.segs) for storm in storms]
+    lats = np.array([seg.startLat for seg in segs])
+    lons = np.array([seg.startLon for seg in segs])
+    winds = np.array([seg.wsp for seg in segs])
+    pres = np.array([seg.pres for seg in segs])
+    times = np.array([seg.time for seg in segs], dtype='datetime64[m]')
+
+    flags = np.zeros(len(segs), dtype=np.int32)
+    flags[np.abs(lats) > 90.] |= BAD_LAT
+    flags[np.abs(lons) > 360.] |= BAD_LON
+    flags[winds < 0.] |= MISSING_WIND
+    flags[(winds >= 0.) & ((winds < WIND_RANGE[0]) | (winds > WIND_RANGE[1]))] |= BAD_WIND
+    flags[pres < 0.] |= MISSING_PRES
+    flags[(pres >= 0.) & ((pres < PRES_RANGE[0]) | (pres > PRES_RANGE[1]))] |= BAD_PRES
+
+    """ Checks against the previous observation of the same storm """
+    first = np.zeros(len(segs), dtype=bool)
+    first[np.cumsum([0] + numObs[:-1])] = True
+    hasPrev = ~first
+    minutes = np.zeros(len(segs), dtype=np.int64)
+    minutes[1:] = (times[1:] - times[:-1]).astype(np.int64)
+    flags[hasPrev & (minutes < 0)] |= TIME_REVERSED
+    flags[hasPrev & (minutes == 0)] |= DUPLICATE_TIME
+
+    distance = np.zeros(len(segs))
+    distance[1:] = kinematics.haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    fastIn = np.zeros(len(segs), dtype=bool)
+    moving = hasPrev & (minutes > 0)
+    fastIn[moving] = distance[moving]/(minutes[moving]/60.) > MAX_SPEED_KT
+    fastOut = np.zeros(len(segs), dtype=bool)
+    fastOut[:-1] = fastIn[1:]
+    spike = fastIn & fastOut
+    afterSpike = np.zeros(len(segs), dtype=bool)
+    afterSpike[1:] = spike[:-1]
+    flags[spike | (fastIn & ~afterSpike)] |= TOO_FAST
+
+    return np.split(flags, np.cumsum(numObs)[:-1])
+
+
+def flagCounts(stormFlags):
+    """ Number of observations with each flag, as a list of (name, count) """
+    allFlags = np.concatenate(stormFlags) if stormFlags else np.zeros(0, int)
+    return [(name, int(np.count_nonzero(allFlags & bit)))
+            for bit, name in flagNames]
+
+
+def describe(flags):
+    """ Flag names for one observation, e.g. 'TOO_FAST|MISSING_PRES' """
+    return '|'.join(name for bit, name in flagNames if flags & bit)
+
+
+""" Columns of the CSV report """
+REPORT_FIELDS = ['STORM_ID', 'NAME', 'TIME', 'LAT', 'LON', 'WIND', 'PRESSURE',
+                 'FLAGS']
+
+
+def reportRows(storms, stormFlags):
+    """ A row of the report for each bad observation """
+    for storm, flags in zip(storms, stormFlags):
+        for k in np.nonzero(flags & BAD)[0]:
+            seg = storm.segs[k]
+            yield [storm.uid, storm.name, seg.time.strftime('%Y-%m-%d %H:%M'),
+                   seg.startLat, seg.startLon, seg.wsp, seg.pres,
+                   describe(flags[k])]
+
+
+def writeReport(fileName, storms, stormFlags):
+    """ Writes the bad observations to a CSV file.  Returns the number of
+        rows written. """
+    numRows = 0
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        for row in reportRows(storms, stormFlags):
+            writer.writerow(row)
+            numRows += 1
+    return numRows
+
+
+def mergeReport(fileName, storms, stormFlags, replacedIDs):
+    """ Replaces the rows of the storms with IDs in replacedIDs in a report
+        written by writeReport with the bad observations of storms, keeping
+        the rows in storm ID order.  Returns the number of rows added. """
+    rows = []
+    if os.path.exists(fileName):
+        with open(fileName, newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            rows = [row for row in reader if row[0] not in replacedIDs]
+    newRows = list(reportRows(storms, stormFlags))
+    rows = sorted(rows + newRows, key=lambda row: row[0])
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        writer.writerows(rows)
+    return len(newRows)
+
+
+def dropBad(storms, stormFlags):
+    """ Removes bad observations from each storm, updating its start and
+        end.  Returns (storms left with more than one observation, number
+        of observations removed). """
+    kept = []
+    numRemoved = 0
+    for storm, flags in zip(storms, stormFlags):
+        bad = flags & BAD
+        if bad.any():
+            storm.segs = [seg for seg, b in zip(storm.segs, bad) if not b]
+            numRemoved += int(np.count_nonzero(bad))
+            if storm.segs:
+                storm.startTime = storm.segs[0].time
+                storm.endTime = storm.segs[-1].time
+                storm.startLat = storm.segs[0].startLat
+                storm.startLon = storm.segs[0].startLon
+        storm.numSegs = len(storm.segs)
+        if storm.numSegs > 1:
+            kept.append(storm)
+    return kept, numRemoved
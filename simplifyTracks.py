@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Generalized versions of the storm Tracks for drawing at small map scales.
+
+Each track part is simplified with the Douglas-Peucker algorithm, with the
+distances from each run of vertices to its chord computed with NumPy.  The
+vertices where the storm's Saffir-Simpson category changes are always kept,
+as are the ends of every part, so the parts split at 180 by BREAK180 still
+meet the antimeridian exactly and no category boundary moves.
+
+"""
+
+import numpy as np
+
+
+def douglasPeucker(points, tolerance):
+    """ Boolean mask of the vertices of points, an (n, 2) array, kept by
+        Douglas-Peucker simplification at tolerance (in the same units as
+        the coordinates).  The first and last vertices are always kept. """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[n-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        interior = points[first+1:last]
+        chord = points[last] - points[first]
+        rel = interior - points[first]
+        length = np.hypot(chord[0], chord[1])
+        if length > 0.:
+            """ Perpendicular distance from the chord """
+            dist = np.abs(chord[0]*rel[:, 1] - chord[1]*rel[:, 0])/length
+        else:
+            """ Closed run, so use distance from the end point """
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            split = first + 1 + k
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplifyParts(parts, cats, tolerance):
+    """ Simplified copy of a track.
+
+    parts are the track parts as written to the Tracks shapefile, lists of
+    [x, y].  cats has the same shape and gives the Saffir-Simpson code of
+    the segment starting at each vertex.  Each part is cut at every vertex
+    where the code changes and each run is simplified on its own, so those
+    vertices and the part ends are kept.
+    """
+    newParts = []
+    for part, partCats in zip(parts, cats):
+        points = np.asarray(part, dtype=float)
+        changes = [k for k in range(1, len(partCats))
+                   if partCats[k] != partCats[k-1]]
+        bounds = [0] + changes + [len(points) - 1]
+        keep = np.zeros(len(points), dtype=bool)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if last > first:
+                keep[first:last+1] |= douglasPeucker(points[first:last+1],
+                                                      tolerance)
+        keep[bounds] = True
+        newParts.append(points[keep].tolist())
+    return newParts
+
+
+def simplifyTracks(trackCoords, trackCats, tolerance):
+    """ Simplifies every track.  Returns (tracks, vertices before, vertices
+        after) """
+    simplified = [simplifyParts(parts, cats, tolerance)
+                  for parts, cats in zip(trackCoords, trackCats)]
+    before = sum(len(part) for parts in trackCoords for part in parts)
+    after = sum(len(part) for parts in simplified for part in parts)
+    return simplified, before, after
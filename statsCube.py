@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed summary statistics of the processed storms, so counts by year,
+basin, category and ENSO phase are a lookup instead of a scan of Segments.
+
+Two tables are built with NumPy in one pass over the observations:
+    StatsObservations  keyed by YEAR, MONTH, BASIN, SS_SCALE and ENSO of
+                       each observation: the number of observations, the
+                       number of distinct storms, accumulated cyclone
+                       energy and the highest wind
+    StatsStorms        keyed by the YEAR and MONTH the storm started, its
+                       BASIN, its MAXSSSCALE and the ENSO state at its
+                       start: the number of storms, their total ACE and
+                       the highest wind
+
+Accumulated cyclone energy (ACE) is the sum of the squares of the 1 minute
+winds in knots, times 1e-4, over the synoptic (00, 06, 12 and 18 UTC)
+observations with winds of at least 35 knots that are not extratropical:
+    https://www.cpc.ncep.noaa.gov/products/outlooks/Background.html
+
+Totals for any coarser grouping, e.g. storms per year and basin, are sums
+over the matching rows.
+
+"""
+
+import csv
+
+import numpy as np
+
+""" Lowest wind, in knots, counted toward ACE """
+ACE_MIN_WIND = 35.
+
+statsObsFields = [['YEAR','N','4'],
+                  ['MONTH','N','2'],
+                  ['BASIN','C','2'],
+                  ['SS_SCALE','C','2'],
+                  ['ENSO','C','1'],
+                  ['OBS','N','10'],
+                  ['STORMS','N','10'],
+                  ['ACE','N','13'],
+                  ['MAX_WIND','N','5']]
+
+statsStormFields = [['YEAR','N','4'],
+                    ['MONTH','N','2'],
+                    ['BASIN','C','2'],
+                    ['MAXSSSCALE','C','2'],
+                    ['ENSO','C','1'],
+                    ['STORMS','N','10'],
+                    ['ACE','N','13'],
+                    ['MAX_WIND','N','5']]
+
+
+def _codes(values):
+    """ (distinct values, code of each value) """
+    names, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return names, codes
+
+
+def _groups(keys):
+    """ Groups rows by several integer key columns.  Returns (group of each
+        row, first row of each group) with the groups in key order. """
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        combined = combined*(int(key.max()) + 1 if len(key) else 1) + key
+    _, first, group = np.unique(combined, return_index=True,
+                                return_inverse=True)
+    return group, first
+
+
+def buildStats(storms):
+    """ Builds both tables from processed Storm objects.  Returns a list of
+        two layer dictionaries, like those handed to
+        writeGeoPackage.writeGeoPackage() but without coords. """
+    numObs = [len(storm.segs) for storm in storms]
+    stormOfObs = np.repeat(np.arange(len(storms)), numObs)
+    segs = [seg for storm in storms for seg in storm.segs]
+    years = np.array([seg.time.year for seg in segs], dtype=np.int64)
+    months = np.array([seg.time.month for seg in segs], dtype=np.int64)
+    synoptic = np.array([seg.time.hour % 6 == 0 and seg.time.minute == 0
+                         for seg in segs], dtype=bool)
+    winds = np.array([seg.wsp for seg in segs], dtype=float)
+    basins, basinCodes = _codes([storm.basin for storm in storms])
+    cats, catCodes = _codes([seg.saffir for seg in segs])
+    ensos, ensoCodes = _codes([seg.enso for seg in segs])
+
+    tropical = cats[catCodes] != 'ET'
+    ace = np.where(synoptic & tropical & (winds >= ACE_MIN_WIND),
+                   winds**2*1.e-4, 0.)
+
+    """ Observation cube """
+    group, first = _groups([years, months, basinCodes[stormOfObs],
+                            catCodes, ensoCodes])
+    numGroups = len(first)
+    obsCount = np.bincount(group, minlength=numGroups)
+    aceSum = np.bincount(group, weights=ace, minlength=numGroups)
+    maxWind = np.full(numGroups, -1.)
+    np.maximum.at(maxWind, group, winds)
+    """ Distinct storms per group from the distinct (group, storm) pairs """
+    pairs = np.unique(group*len(storms) + stormOfObs)
+    stormCount = np.bincount(pairs // len(storms), minlength=numGroups)
+    obsRecords = [[int(years[k]), int(months[k]),
+                   basins[basinCodes[stormOfObs[k]]], cats[catCodes[k]],
+                   ensos[ensoCodes[k]], int(obsCount[g]), int(stormCount[g]),
+                   round(float(aceSum[g]), 4), float(maxWind[g])]
+                  for g, k in enumerate(first)]
+
+    """ Storm table, from each storm's totals """
+    stormACE = np.bincount(stormOfObs, weights=ace, minlength=len(storms))
+    stormMax = np.full(len(storms), -1.)
+    np.maximum.at(stormMax, stormOfObs, winds)
+    startYears = np.array([storm.startTime.year for storm in storms],
+                          dtype=np.int64)
+    startMonths = np.array([storm.startTime.month for storm in storms],
+                           dtype=np.int64)
+    maxCats, maxCatCodes = _codes([storm.maxSaffir for storm in storms])
+    stormEnsos, stormEnsoCodes = _codes([storm.enso for storm in storms])
+    group, first = _groups([startYears, startMonths, basinCodes,
+                            maxCatCodes, stormEnsoCodes])
+    numGroups = len(first)
+    count = np.bincount(group, minlength=numGroups)
+    aceSum = np.bincount(group, weights=stormACE, minlength=numGroups)
+    maxWind = np.full(numGroups, -1.)
+    np.maximum.at(maxWind, group, stormMax)
+    stormRecords = [[int(startYears[k]), int(startMonths[k]),
+                     basins[basinCodes[k]], maxCats[maxCatCodes[k]],
+                     stormEnsos[stormEnsoCodes[k]], int(count[g]),
+                     round(float(aceSum[g]), 4), float(maxWind[g])]
+                    for g, k in enumerate(first)]
+
+    intTypes = {'YEAR': 'INTEGER', 'MONTH': 'INTEGER', 'OBS': 'INTEGER',
+                'STORMS': 'INTEGER'}
+    return [{'name': 'StatsObservations',
+             'fields': statsObsFields,
+             'coords': None,
+             'records': obsRecords,
+             'types': intTypes,
+             'indexes': ['YEAR', 'BASIN', 'SS_SCALE', 'ENSO']},
+            {'name': 'StatsStorms',
+             'fields': statsStormFields,
+             'coords': None,
+             'records': stormRecords,
+             'types': intTypes,
+             'indexes': ['YEAR', 'BASIN', 'MAXSSSCALE', 'ENSO']}]
+
+
+def writeCSV(fileName, layer):
+    """ Writes one stats table as CSV with a header row """
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([field[0] for field in layer['fields']])
+        writer.writerows(layer['records'])
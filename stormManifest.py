@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Per-storm manifest of the outputs, and the difference between two of them,
+so a downstream database can apply the storms that changed rather than
+reload everything.
+
+annualDataUpdate.py writes results/manifest.csv with one row per storm:
+    STORM_ID, BASIN   the storm's key
+    NAME, YEAR
+    SEGMENTS          number of Segments records
+    FIRST_SEGMENT_ID  SEGMENT_ID of the first one, the rest follow on
+    HASH              BLAKE2b of the storm's Tracks record and Segments
+                      records, attributes and coordinates
+Segment IDs depend only on the storm ID, basin and observation index, and
+the hash only on what was written for the storm, so rows of storms that did
+not change are the same from run to run.
+
+diffManifests joins two manifests on the storm key in one pass: the old one
+is loaded into a dictionary, the new one streamed past it, and what is left
+of the old one was removed.  Only added, changed and removed storms come
+out, with the new row, or the old one for removed storms.
+
+Use it as a library:
+    for change, row in stormManifest.diffManifests(oldFile, newFile): ...
+or from the command line:
+    python3 stormManifest.py old/manifest.csv results/manifest.csv -o changes.csv
+
+"""
+
+import csv
+import sys
+import hashlib
+import argparse
+
+FIELDS = ['STORM_ID', 'BASIN', 'NAME', 'YEAR', 'SEGMENTS', 'FIRST_SEGMENT_ID',
+          'HASH']
+
+
+def stormHash(trackCoords, trackParams, segCoords, segParams):
+    """ Hash of a storm's Tracks record and its Segments records, each given
+        as coordinates and attributes """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((trackCoords, trackParams)).encode('utf-8'))
+    for coords, params in zip(segCoords, segParams):
+        h.update(repr((coords, params)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def writeManifest(fileName, rows):
+    """ Writes the manifest rows, lists in FIELDS order.  Returns the
+        number of rows. """
+    numRows = 0
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            numRows += 1
+    return numRows
+
+
+def readManifest(fileName):
+    """ The rows of a manifest as dictionaries by field name """
+    with open(fileName, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def diffManifests(oldFileName, newFileName):
+    """ (change, row) for each storm 'added', 'changed' or 'removed' between
+        the old and new manifests, in the order of the new one and then the
+        removed storms in the order of the old one """
+    old = {(row['STORM_ID'], row['BASIN']): row
+           for row in readManifest(oldFileName)}
+    for row in readManifest(newFileName):
+        oldRow = old.pop((row['STORM_ID'], row['BASIN']), None)
+        if oldRow is None:
+            yield 'added', row
+        elif oldRow['HASH'] != row['HASH']:
+            yield 'changed', row
+    for row in old.values():
+        yield 'removed', row
+
+
+def writeChanges(f, changes):
+    """ Writes the changes from diffManifests to the open file f as CSV, a
+        CHANGE column then the manifest fields.  Returns the number of each
+        kind of change. """
+    counts = {'added': 0, 'changed': 0, 'removed': 0}
+    writer = csv.writer(f)
+    writer.writerow(['CHANGE'] + FIELDS)
+    for change, row in changes:
+        writer.writerow([change] + [row[field] for field in FIELDS])
+        counts[change] += 1
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='List the storms added, changed or removed between two '
+        'manifests written by annualDataUpdate.py')
+    parser.add_argument('old', help='manifest of the earlier run')
+    parser.add_argument('new', help='manifest of the later run')
+    parser.add_argument('-o', '--output',
+                        help='CSV file for the changes, standard output if none')
+    args = parser.parse_args()
+
+    changes = diffManifests(args.old, args.new)
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            counts = writeChanges(f, changes)
+    else:
+        counts = writeChanges(sys.stdout, changes)
+    print("{added} added, {changed} changed, {removed} removed".format(**counts),
+          file=sys.stderr)
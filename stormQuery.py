@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Proximity queries over the processed storm segments, i.e. the main HHT web
+site question: which storms passed within N nautical miles of a location?
+
+A SegmentIndex puts every segment into the cells of a regular lat/lon grid
+that its bounding box touches.  Segments crossing the antimeridian are
+indexed on both sides of it.  A query only looks at the cells within the
+search distance of the point, applies the year, basin and Saffir-Simpson
+filters to those candidates, and then computes the exact great circle
+distance from the point to each candidate segment in one vectorized pass.
+
+Use it as a library:
+    index = stormQuery.SegmentIndex.fromResults('./results/')
+    storms = index.stormsNear(25.77, -80.19, 60., basins=['NA'])
+or from the command line over the results directory:
+    python3 stormQuery.py --lat 25.77 --lon -80.19 --distance 60
+    python3 stormQuery.py --benchmark 1000
+
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import configparser
+
+import numpy as np
+import shapefile
+
+from kinematics import (EARTH_RADIUS_NM, NM_PER_DEGREE, # Local python module
+                        wrapLon, catOrder)
+
+
+def _unitVectors(lat, lon):
+    """ Unit vectors, shape (n, 3), for arrays of lat and lon in degrees """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    cosLat = np.cos(lat)
+    return np.stack((cosLat*np.cos(lon), cosLat*np.sin(lon), np.sin(lat)),
+                    axis=-1)
+
+
+def _angle(u, v):
+    """ Angle in radians between rows of unit vectors u and v.  atan2 of the
+        cross and dot products stays accurate for very small angles. """
+    return np.arctan2(np.linalg.norm(np.cross(u, v), axis=-1),
+                      np.einsum('ij,ij->i', u, v))
+
+
+def segmentDistance(lat, lon, lat0, lon0, lat1, lon1):
+    """ Great circle distance in nautical miles from the point (lat, lon) to
+    each of the segments (lat0, lon0) -> (lat1, lon1), given as arrays.
+
+    If the closest point of the great circle through a segment lies between
+    its ends, the distance is the cross track distance.  Otherwise it is the
+    distance to the nearer end.  Zero length segments use their end point.
+    """
+    a = _unitVectors(lat0, lon0)
+    b = _unitVectors(lat1, lon1)
+    p = np.broadcast_to(_unitVectors(np.array([lat]), np.array([lon])),
+                        a.shape)
+    dEnds = np.minimum(_angle(p, a), _angle(p, b))
+
+    n = np.cross(a, b)
+    nNorm = np.linalg.norm(n, axis=-1)
+    good = nNorm > 1.e-12
+    n[good] /= nNorm[good][:, None]
+    sinXT = np.einsum('ij,ij->i', p, n)
+    """ Projection of p onto the great circle, then check it falls between
+        a and b by the sign of the triple products with the normal """
+    c = p - sinXT[:, None]*n
+    inside = (good
+              & (np.einsum('ij,ij->i', np.cross(a, c), n) >= 0.)
+              & (np.einsum('ij,ij->i', np.cross(c, b), n) >= 0.))
+    dXT = np.abs(np.arcsin(np.clip(sinXT, -1., 1.)))
+    return EARTH_RADIUS_NM * np.where(inside, dXT, dEnds)
+
+
+class SegmentIndex(object):
+    """ Grid index over storm segments.
+
+    Arrays held for every segment, in the order given:
+        lat0, lon0, lat1, lon1 : segment ends in degrees, lon in [-180, 180)
+        years                  : integer year of the segment start time
+        basins, cats           : basin and Saffir-Simpson codes (str arrays)
+        stormIDs, names        : storm ID and display name (str arrays)
+        segmentIDs             : SEGMENT_ID from the output
+    The grid is stored in compressed row form: cellStart[k]:cellStart[k+1]
+    slices cellSegs to give the segments touching cell k.
+    """
+    def __init__(self, lat0, lon0, lat1, lon1, years, basins, cats,
+                 stormIDs, names, segmentIDs, cellSize=1.0):
+        self.lat0 = np.asarray(lat0, dtype=float)
+        self.lon0 = wrapLon(lon0)
+        self.lat1 = np.asarray(lat1, dtype=float)
+        self.lon1 = wrapLon(lon1)
+        self.years = np.asarray(years, dtype=int)
+        self.basins = np.asarray(basins, dtype=str)
+        self.cats = np.asarray(cats, dtype=str)
+        self.stormIDs = np.asarray(stormIDs, dtype=str)
+        self.names = np.asarray(names, dtype=str)
+        self.segmentIDs = np.asarray(segmentIDs, dtype=np.int64)
+        self.cellSize = float(cellSize)
+        self.numRows = int(np.ceil(180.0/self.cellSize))
+        self.numCols = int(np.ceil(360.0/self.cellSize))
+        self._buildGrid()
+
+    def _buildGrid(self):
+        """ Expands every segment to the grid cells of its bounding box and
+            sorts the (cell, segment) pairs by cell """
+        cs = self.cellSize
+        """ Segments crossing the antimeridian: unwrap the end so the bounding
+            box is the short way round.  Its columns wrap modulo numCols. """
+        lon1 = self.lon1.copy()
+        lon1[lon1 - self.lon0 > 180.] -= 360.
+        lon1[lon1 - self.lon0 < -180.] += 360.
+        row0 = np.floor((np.minimum(self.lat0, self.lat1) + 90.)/cs).astype(int)
+        row1 = np.floor((np.maximum(self.lat0, self.lat1) + 90.)/cs).astype(int)
+        row0 = np.clip(row0, 0, self.numRows - 1)
+        row1 = np.clip(row1, 0, self.numRows - 1)
+        col0 = np.floor((np.minimum(self.lon0, lon1) + 180.)/cs).astype(int)
+        col1 = np.floor((np.maximum(self.lon0, lon1) + 180.)/cs).astype(int)
+        nRows = row1 - row0 + 1
+        nCols = col1 - col0 + 1
+        counts = nRows*nCols
+
+        segs = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+        rows = row0[segs] + k // nCols[segs]
+        cols = (col0[segs] + k % nCols[segs]) % self.numCols
+        cells = rows*self.numCols + cols
+
+        order = np.argsort(cells, kind='stable')
+        self.cellSegs = segs[order]
+        self.cellStart = np.searchsorted(
+            cells[order], np.arange(self.numRows*self.numCols + 1))
+
+    @classmethod
+    def fromRecords(cls, fields, records, cellSize=1.0):
+        """ Builds the index from Segments attribute records, e.g. the rows
+            read from the Segments shapefile or goodSegParams in
+            annualDataUpdate.py, with fields listing their column names """
+        names = [f[0] for f in fields]
+        col = {name: names.index(name) for name in names}
+        def column(name):
+            return [r[col[name]] for r in records]
+        """ TIME is formatted as %m/%d/%Y %H """
+        years = [int(str(t)[6:10]) for t in column('TIME')]
+        return cls(np.array(column('BEGIN_LAT'), dtype=float),
+                   np.array(column('BEGIN_LON'), dtype=float),
+                   np.array(column('END_LAT'), dtype=float),
+                   np.array(column('END_LON'), dtype=float),
+                   years, column('BASIN'), column('SS_SCALE'),
+                   column('STORM_ID'), column('NAME'), column('SEGMENT_ID'),
+                   cellSize)
+
+    @classmethod
+    def fromResults(cls, resultsDir, webMerc=False, cellSize=1.0):
+        """ Builds the index from a results directory, reading the GeoPackage
+            if there is one and the Segments shapefile attributes otherwise.
+            The BEGIN/END lat and lon attributes are always geographic, so
+            either projection works. """
+        suffix = 'WebMerc' if webMerc else 'WGS84'
+        fields = [['SEGMENT_ID'], ['STORM_ID'], ['NAME'], ['TIME'],
+                  ['SS_SCALE'], ['BASIN'], ['BEGIN_LAT'], ['BEGIN_LON'],
+                  ['END_LAT'], ['END_LON']]
+        gpkgName = os.path.join(resultsDir, 'Hurricanes_%s.gpkg' % suffix)
+        if os.path.exists(gpkgName):
+            db = sqlite3.connect(gpkgName)
+            records = db.execute('SELECT %s FROM Segments' % ', '.join(
+                '"%s"' % f[0] for f in fields)).fetchall()
+            db.close()
+        else:
+            reader = shapefile.Reader(os.path.join(resultsDir,
+                                                   'Segments_%s' % suffix))
+            names = [f[0] for f in reader.fields[1:]]
+            keep = [names.index(f[0]) for f in fields]
+            records = [[r[k] for k in keep] for r in reader.iterRecords()]
+            reader.close()
+        return cls.fromRecords(fields, records, cellSize)
+
+    def candidates(self, lat, lon, distance):
+        """ Indexes of segments in the grid cells within distance (nautical
+            miles) of the point, wrapping across the antimeridian """
+        cs = self.cellSize
+        dLat = distance/NM_PER_DEGREE
+        lat0 = max(lat - dLat, -90.)
+        lat1 = min(lat + dLat, 90.)
+        row0 = min(int(np.floor((lat0 + 90.)/cs)), self.numRows - 1)
+        row1 = min(int(np.floor((lat1 + 90.)/cs)), self.numRows - 1)
+        """ Longitude half width at the most poleward latitude of the band.
+            Near the poles the search covers every column. """
+        cosLat = np.cos(np.radians(max(abs(lat0), abs(lat1))))
+        if cosLat*180.*NM_PER_DEGREE <= distance:
+            cols = np.arange(self.numCols)
+        else:
+            dLon = distance/(NM_PER_DEGREE*cosLat)
+            lon = float(wrapLon(lon))
+            col0 = int(np.floor((lon - dLon + 180.)/cs))
+            col1 = int(np.floor((lon + dLon + 180.)/cs))
+            cols = np.arange(col0, min(col1, col0 + self.numCols - 1) + 1) \
+                % self.numCols
+        cells = (np.arange(row0, row1 + 1)[:, None]*self.numCols
+                 + cols[None, :]).ravel()
+        starts = self.cellStart[cells]
+        ends = self.cellStart[cells + 1]
+        if not np.any(ends > starts):
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(
+            [self.cellSegs[s:e] for s, e in zip(starts, ends) if e > s]))
+
+    def _filter(self, segs, years, basins, cats):
+        """ Applies the optional year range (first, last) and the basin and
+            Saffir-Simpson lists to candidate segment indexes """
+        keep = np.ones(len(segs), dtype=bool)
+        if years is not None:
+            keep &= (self.years[segs] >= years[0]) & (self.years[segs] <= years[1])
+        if basins:
+            keep &= np.isin(self.basins[segs], list(basins))
+        if cats:
+            keep &= np.isin(self.cats[segs], list(cats))
+        return segs[keep]
+
+    def query(self, lat, lon, distance, years=None, basins=None, cats=None):
+        """ Segments within distance (nautical miles) of the point.
+        Returns (segment indexes, distances in nautical miles), nearest
+        first.  years is an inclusive (first, last) tuple, basins and cats
+        are lists of codes, e.g. ['NA', 'EP'] and ['H3', 'H4', 'H5']. """
+        segs = self._filter(self.candidates(lat, lon, distance),
+                            years, basins, cats)
+        dist = segmentDistance(lat, lon, self.lat0[segs], self.lon0[segs],
+                               self.lat1[segs], self.lon1[segs])
+        near = dist <= distance
+        segs = segs[near]
+        dist = dist[near]
+        order = np.argsort(dist, kind='stable')
+        return segs[order], dist[order]
+
+    def bruteForce(self, lat, lon, distance, years=None, basins=None,
+                   cats=None):
+        """ Same as query() but over every segment, for checking and timing """
+        segs = self._filter(np.arange(len(self.lat0)), years, basins, cats)
+        dist = segmentDistance(lat, lon, self.lat0[segs], self.lon0[segs],
+                               self.lat1[segs], self.lon1[segs])
+        near = dist <= distance
+        order = np.argsort(dist[near], kind='stable')
+        return segs[near][order], dist[near][order]
+
+    def stormsNear(self, lat, lon, distance, **filters):
+        """ Storms with any segment within distance of the point, as a list of
+        (storm ID, name, closest distance, highest Saffir-Simpson code within
+        the distance), nearest storm first """
+        segs, dist = self.query(lat, lon, distance, **filters)
+        storms = {}
+        for s, d in zip(segs, dist):  # Nearest first, so first seen is closest
+            uid = self.stormIDs[s]
+            if uid not in storms:
+                storms[uid] = [uid, self.names[s], float(d), self.cats[s]]
+            elif _catRank(self.cats[s]) > _catRank(storms[uid][3]):
+                storms[uid][3] = self.cats[s]
+        return list(storms.values())
+
+
+def _catRank(cat):
+    return catOrder.index(cat) if cat in catOrder else -1
+
+
+def benchmark(index, numQueries, distance, seed=0):
+    """ Times numQueries random queries centred on segment start points,
+        checks they agree with a brute force scan of every segment and
+        prints latency statistics for both """
+    rng = np.random.RandomState(seed)
+    picks = rng.randint(0, len(index.lat0), numQueries)
+    indexTimes = []
+    bruteTimes = []
+    for k in picks:
+        lat, lon = index.lat0[k], index.lon0[k]
+        start = time.perf_counter()
+        segs, dist = index.query(lat, lon, distance)
+        indexTimes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        bSegs, bDist = index.bruteForce(lat, lon, distance)
+        bruteTimes.append(time.perf_counter() - start)
+        if set(segs) != set(bSegs):
+            print("MISMATCH at", lat, lon, len(segs), len(bSegs))
+    indexTimes = np.array(indexTimes)*1000.
+    bruteTimes = np.array(bruteTimes)*1000.
+    for label, t in (('grid index', indexTimes), ('brute force', bruteTimes)):
+        print("{0:>12}: mean {1:.3f} ms, median {2:.3f} ms, p95 {3:.3f} ms"
+              .format(label, t.mean(), np.median(t), np.percentile(t, 95)))
+    print("     speedup: {0:.1f}x over {1} segments, {2} queries at {3} nmi"
+          .format(bruteTimes.mean()/indexTimes.mean(), len(index.lat0),
+                  numQueries, distance))
+
+
+if __name__ == '__main__':
+    config = configparser.ConfigParser()
+    config.read('./config.ini')
+    parser = argparse.ArgumentParser(
+        description='Find storm segments within a distance of a point')
+    parser.add_argument('--results', default=config.get(
+        'DIRECTORIES', 'RESULTS', fallback='./results/'),
+        help='results directory written by annualDataUpdate.py')
+    parser.add_argument('--lat', type=float, help='latitude, degrees north')
+    parser.add_argument('--lon', type=float, help='longitude, degrees east')
+    parser.add_argument('--distance', type=float, default=60.,
+                        help='search radius in nautical miles')
+    parser.add_argument('--years', help='year or inclusive range, e.g. 1990-2000')
+    parser.add_argument('--basins', help='comma separated basins, e.g. NA,EP')
+    parser.add_argument('--categories',
+                        help='comma separated Saffir-Simpson codes, e.g. H3,H4,H5')
+    parser.add_argument('--cellsize', type=float, default=1.0,
+                        help='grid cell size in degrees')
+    parser.add_argument('--segments', action='store_true',
+                        help='list every segment rather than one line per storm')
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='time N random queries instead')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = SegmentIndex.fromResults(
+        args.results, config.getboolean('PARAMETERS', 'WEBMERC', fallback=False),
+        args.cellsize)
+    print("Indexed {0} segments in {1:.2f} s".format(
+        len(index.lat0), time.perf_counter() - start), file=sys.stderr)
+
+    if args.benchmark:
+        benchmark(index, args.benchmark, args.distance)
+        sys.exit()
+    if args.lat is None or args.lon is None:
+        parser.error('--lat and --lon are required unless --benchmark is given')
+
+    filters = {}
+    if args.years:
+        first, _, last = args.years.partition('-')
+        filters['years'] = (int(first), int(last or first))
+    if args.basins:
+        filters['basins'] = args.basins.split(',')
+    if args.categories:
+        filters['cats'] = args.categories.split(',')
+    if args.segments:
+        segs, dist = index.query(args.lat, args.lon, args.distance, **filters)
+        for s, d in zip(segs, dist):
+            print("{0}\t{1}\t{2}\t{3}\t{4:.1f}".format(
+                index.segmentIDs[s], index.stormIDs[s], index.names[s],
+                index.cats[s], d))
+    else:
+        for uid, name, d, cat in index.stormsNear(args.lat, args.lon,
+                                                  args.distance, **filters):
+            print("{0}\t{1}\t{2}\t{3:.1f}".format(uid, name, cat, d))
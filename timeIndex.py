@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Time index over storm lifetimes and segment times, for "which storms (or
+segments) were active between T1 and T2" and "which storms touched month M"
+without scanning every storm.
+
+Storms are kept sorted by start time along with the longest storm duration.
+Any storm active in [T1, T2] must have started in [T1 - longest, T2], so a
+query is two binary searches and a check of the end times of only the
+storms in that slice.  Segments, which run from one observation to the
+next, are handled the same way.  Calendar month membership is precomputed.
+
+The index is saved in the results directory as timeIndex.npz and can be
+loaded again with TimeIndex.load().
+
+This module also builds the YEARS and MONTHS filter strings of the Tracks
+shapefile for all storms at once from small lookup tables.
+
+"""
+
+import datetime as dt
+
+import numpy as np
+
+""" Index times are whole minutes since 1970-01-01 """
+TIME_UNIT = 'datetime64[m]'
+
+
+def toMinutes(times):
+    """ Array of minutes since the epoch from datetimes or numpy datetime64s """
+    return np.array(times, dtype=TIME_UNIT).astype(np.int64)
+
+
+""" MONTHS filter strings for every (start month, end month) pair.  A storm
+    whose end month is earlier than its start month ran over the new year, so
+    it gets start through December, then January through end. """
+_monthStrings = {}
+for _m1 in range(1, 13):
+    for _m2 in range(1, 13):
+        if _m2 < _m1:
+            _months = list(range(_m1, 13)) + list(range(1, _m2 + 1))
+        else:
+            _months = list(range(_m1, _m2 + 1))
+        _monthStrings[(_m1, _m2)] = ', '.join(str(m) for m in _months)
+
+_yearStrings = {}
+
+
+def filterYears(year1, year2):
+    """ YEARS filter string, e.g. '1999, 2000', built once per year pair """
+    key = (year1, year2)
+    if key not in _yearStrings:
+        _yearStrings[key] = ', '.join(str(y) for y in range(year1, max(year1, year2) + 1))
+    return _yearStrings[key]
+
+
+def filterMonths(month1, month2):
+    """ MONTHS filter string, e.g. '11, 12, 1' """
+    return _monthStrings[(month1, month2)]
+
+
+def filterStrings(startTimes, endTimes):
+    """ YEARS and MONTHS filter strings for lists of storm start and end
+        datetimes.  Returns two lists in the same order as the input. """
+    years = [filterYears(s.year, e.year) for s, e in zip(startTimes, endTimes)]
+    months = [_monthStrings[(s.month, e.month)]
+              for s, e in zip(startTimes, endTimes)]
+    return years, months
+
+
+class _Intervals(object):
+    """ Sorted intervals [start, end] in minutes with an ID for each """
+    def __init__(self, ids, starts, ends):
+        order = np.argsort(starts, kind='stable')
+        self.ids = np.asarray(ids)[order]
+        self.starts = np.asarray(starts, dtype=np.int64)[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.longest = int((self.ends - self.starts).max()) if len(self.ids) else 0
+
+    def active(self, t1, t2):
+        """ Positions of the intervals overlapping [t1, t2] """
+        lo = np.searchsorted(self.starts, t1 - self.longest, side='left')
+        hi = np.searchsorted(self.starts, t2, side='right')
+        return lo + np.nonzero(self.ends[lo:hi] >= t1)[0]
+
+
+class TimeIndex(object):
+    """ Storm and segment time index.
+
+        storms    : storm IDs with start and end of each storm
+        segments  : segment IDs with their start and end (the next
+                    observation, or the start for the last segment)
+        months    : for each calendar month 1 to 12, the positions (in
+                    storms) of the storms that touch that month
+    """
+    def __init__(self, stormIDs, stormStarts, stormEnds,
+                 segmentIDs, segmentStarts, segmentEnds):
+        self.storms = _Intervals(stormIDs, stormStarts, stormEnds)
+        self.segments = _Intervals(segmentIDs, segmentStarts, segmentEnds)
+        self._buildMonths()
+
+    def _buildMonths(self):
+        """ Month membership straight from the start and end months, with the
+            same wrap over the new year as the MONTHS filter """
+        starts = self.storms.starts.astype(TIME_UNIT).astype('datetime64[M]')
+        ends = self.storms.ends.astype(TIME_UNIT).astype('datetime64[M]')
+        m1 = starts.astype(np.int64) % 12 + 1
+        m2 = ends.astype(np.int64) % 12 + 1
+        spansYear = (ends - starts).astype(np.int64) >= 12
+        self.months = {}
+        for m in range(1, 13):
+            inside = np.where(m2 >= m1, (m >= m1) & (m <= m2),
+                              (m >= m1) | (m <= m2))
+            self.months[m] = np.nonzero(inside | spansYear)[0]
+
+    @classmethod
+    def fromStorms(cls, storms, segmentIDs):
+        """ Builds the index from processed Storm objects.  segmentIDs are
+            the SEGMENT_IDs of every observation, storm by storm, in the same
+            order as the storms and their segs. """
+        segTimes = [seg.time for storm in storms for seg in storm.segs]
+        segStarts = toMinutes(segTimes)
+        """ Each segment ends at the next observation of its storm """
+        segEnds = np.empty_like(segStarts)
+        segEnds[:-1] = segStarts[1:]
+        last = np.cumsum([len(storm.segs) for storm in storms]) - 1
+        segEnds[last] = segStarts[last]
+        return cls([storm.uid for storm in storms],
+                   toMinutes([storm.segs[0].time for storm in storms]),
+                   toMinutes([storm.segs[-1].time for storm in storms]),
+                   np.asarray(segmentIDs, dtype=np.int64), segStarts, segEnds)
+
+    def stormsActive(self, t1, t2):
+        """ IDs of storms active at any time between datetimes t1 and t2 """
+        return self.storms.ids[self.storms.active(toMinutes(t1), toMinutes(t2))]
+
+    def segmentsActive(self, t1, t2):
+        """ IDs of segments active at any time between datetimes t1 and t2 """
+        return self.segments.ids[
+            self.segments.active(toMinutes(t1), toMinutes(t2))]
+
+    def stormsInMonth(self, month, year=None):
+        """ IDs of storms touching calendar month 1-12, in any year or, if
+            year is given, in that month of that year """
+        if year is None:
+            return self.storms.ids[self.months[month]]
+        first = dt.datetime(year, month, 1)
+        nextMonth = dt.datetime(year + month // 12, month % 12 + 1, 1)
+        return self.stormsActive(first, nextMonth - dt.timedelta(minutes=1))
+
+    def save(self, fileName):
+        """ Writes the sorted arrays to a compressed .npz file """
+        arrays = {'storm_ids': self.storms.ids,
+                  'storm_starts': self.storms.starts,
+                  'storm_ends': self.storms.ends,
+                  'segment_ids': self.segments.ids,
+                  'segment_starts': self.segments.starts,
+                  'segment_ends': self.segments.ends}
+        np.savez_compressed(fileName, **arrays)
+
+    @classmethod
+    def load(cls, fileName):
+        """ Reads an index written by save() """
+        with np.load(fileName) as f:
+            return cls(f['storm_ids'], f['storm_starts'], f['storm_ends'],
+                       f['segment_ids'], f['segment_starts'],
+                       f['segment_ends'])
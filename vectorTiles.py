@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-generates a Mapbox Vector Tile (MVT) pyramid of the storm Segments and
+stores it as an MBTiles file, so the HHT site can serve static tiles rather
+than query the segments on every map request.
+
+Segments are in Web Mercator meters (projected here when the run is in
+WGS84).  For each zoom level, every segment is assigned to the tiles its
+bounding box touches.  The segment is clipped to each of those tiles (plus
+a small buffer) and its coordinates are quantized to the 4096 unit tile
+grid.  Tiles are encoded in parallel across a process pool.
+
+Regeneration is incremental.  The MBTiles file keeps a hash of each storm's
+segments and the tiles each storm touches.  On the next run only the tiles
+touched by added, changed or removed storms are rebuilt.
+
+MVT encoding follows the Mapbox Vector Tile Specification 2.1:
+    https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+and the file layout the MBTiles 1.3 specification:
+    https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+
+"""
+
+import io
+import os
+import gzip
+import json
+import math
+import struct
+import sqlite3
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+""" Half the width of the Web Mercator world in meters """
+MERC_HALF = math.pi * 6378137.0
+""" Web Mercator latitude limit """
+MAX_LAT = 85.0511287798
+EXTENT = 4096  # Tile coordinate units
+BUFFER = 64    # Tile units kept outside each tile edge
+LAYER_NAME = 'segments'
+
+
+def mercator(lon, lat):
+    """ Web Mercator x, y in meters for arrays of lon, lat in degrees """
+    lat = np.clip(lat, -MAX_LAT, MAX_LAT)
+    x = np.radians(lon) * 6378137.0
+    y = np.log(np.tan(np.pi/4. + np.radians(lat)/2.)) * 6378137.0
+    return x, y
+
+
+""" ----------------------- Protocol buffer encoding ----------------------"""
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, wireType):
+    return _varint((number << 3) | wireType)
+
+
+def _message(number, payload):
+    """ Length delimited field (wire type 2) """
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    return _message(number, b''.join(_varint(v) for v in values))
+
+
+def _zigzag(n):
+    """ ZigZag encoding of a signed 64 bit value, as sint64 (and the 32 bit
+        geometry parameters, which are in range) use """
+    return (n << 1) ^ (n >> 63)
+
+
+def _value(v):
+    """ MVT Value message for a string, integer or float attribute """
+    if isinstance(v, str):
+        return _message(1, v.encode('utf-8'))
+    if isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+        if v >= 0:
+            return _field(5, 0) + _varint(int(v))          # uint_value
+        return _field(6, 0) + _varint(_zigzag(int(v)))   # sint_value
+    return _field(3, 1) + struct.pack('<d', float(v))    # double_value
+
+
+def _lineGeometry(parts):
+    """ Command integers for a (multi) linestring in tile coordinates """
+    commands = []
+    cx = cy = 0
+    for part in parts:
+        x, y = part[0]
+        commands += [(1 << 3) | 1, _zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+        commands.append(((len(part) - 1) << 3) | 2)
+        for x, y in part[1:]:
+            commands += [_zigzag(x - cx), _zigzag(y - cy)]
+            cx, cy = x, y
+    return commands
+
+
+def _fieldTypes(fieldNames, records):
+    """ TileJSON type of each field, from the first value encodeTile writes
+        for it, String if it has none """
+    types = {}
+    for attrs in records:
+        for name, v in zip(fieldNames, attrs):
+            if name not in types and v is not None and v != '':
+                types[name] = 'String' if isinstance(v, str) else 'Number'
+        if len(types) == len(fieldNames):
+            break
+    return {name: types.get(name, 'String') for name in fieldNames}
+
+
+def _gzip(data):
+    """ data gzipped with no time in the header, so the same tile gives
+        the same bytes in every run """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def encodeTile(features, fieldNames):
+    """ Encodes one MVT tile with a single layer.  features is a list of
+        (id, parts in tile coordinates, attribute values) """
+    keys = {name: k for k, name in enumerate(fieldNames)}
+    values = {}
+    encoded = []
+    for fid, parts, attrs in features:
+        tags = []
+        for name, v in zip(fieldNames, attrs):
+            if v is None or v == '':
+                continue
+            vKey = (type(v).__name__, v)
+            if vKey not in values:
+                values[vKey] = len(values)
+            tags += [keys[name], values[vKey]]
+        encoded.append(_message(2, _field(1, 0) + _varint(int(fid))
+                                + _packed(2, tags)
+                                + _field(3, 0) + _varint(2)  # LINESTRING
+                                + _packed(4, _lineGeometry(parts))))
+    layer = (_field(15, 0) + _varint(2)
+             + _message(1, LAYER_NAME.encode('utf-8'))
+             + b''.join(encoded)
+             + b''.join(_message(3, name.encode('utf-8')) for name in fieldNames)
+             + b''.join(_message(4, _value(v[1])) for v in
+                        sorted(values, key=values.get))
+             + _field(5, 0) + _varint(EXTENT))
+    return _message(3, layer)
+
+
+""" --------------------------- Clipping --------------------------------- """
+
+def _clip(x0, y0, x1, y1, xmin, ymin, xmax, ymax):
+    """ Liang-Barsky clip of one line to a rectangle.  Returns the clipped
+        end points or None when the line misses the rectangle. """
+    dx = x1 - x0
+    dy = y1 - y0
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x0 - xmin), (dx, xmax - x0),
+                 (-dy, y0 - ymin), (dy, ymax - y0)):
+        if p == 0.:
+            if q < 0.:
+                return None
+        else:
+            t = q/p
+            if p < 0.:
+                if t > t1:
+                    return None
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return None
+                t1 = min(t1, t)
+    return (x0 + t0*dx, y0 + t0*dy, x0 + t1*dx, y0 + t1*dy)
+
+
+""" Segment data shared with the worker processes """
+_shared = {}
+
+
+def _initWorker(shared):
+    _shared.update(shared)
+
+
+def _buildTiles(tileJobs):
+    """ Worker: encodes tiles.  tileJobs is a list of ((z, x, y), part
+        indexes).  Returns a list of ((z, x, y), gzipped tile or None). """
+    x0 = _shared['x0']
+    y0 = _shared['y0']
+    x1 = _shared['x1']
+    y1 = _shared['y1']
+    partSeg = _shared['partSeg']
+    segIDs = _shared['segIDs']
+    attrs = _shared['attrs']
+    fieldNames = _shared['fieldNames']
+    results = []
+    for (z, tx, ty), parts in tileJobs:
+        size = 2.*MERC_HALF/(1 << z)
+        left = -MERC_HALF + tx*size
+        top = MERC_HALF - ty*size
+        pad = size*BUFFER/EXTENT
+        scale = EXTENT/size
+        bySegment = {}
+        for p in parts:
+            c = _clip(x0[p], y0[p], x1[p], y1[p], left - pad, top - size - pad,
+                      left + size + pad, top + pad)
+            if c is None:
+                continue
+            q = [(int(round((c[0] - left)*scale)), int(round((top - c[1])*scale))),
+                 (int(round((c[2] - left)*scale)), int(round((top - c[3])*scale)))]
+            if q[0] == q[1]:
+                continue  # Shorter than one tile unit at this zoom
+            bySegment.setdefault(partSeg[p], []).append(q)
+        if bySegment:
+            features = [(segIDs[s], bySegment[s], attrs[s])
+                        for s in sorted(bySegment)]
+            results.append(((z, tx, ty),
+                            _gzip(encodeTile(features, fieldNames))))
+        else:
+            results.append(((z, tx, ty), None))
+    return results
+
+
+""" ------------------------ Tile assignment ------------------------------ """
+
+def _tilesForZoom(z, x0, y0, x1, y1):
+    """ (part index, tile x, tile y) for every tile touched by the buffered
+        bounding box of every part at zoom z """
+    n = 1 << z
+    size = 2.*MERC_HALF/n
+    pad = size*BUFFER/EXTENT
+    def col(x):
+        return np.clip(np.floor((x + MERC_HALF)/size).astype(np.int64), 0, n-1)
+    def row(y):
+        return np.clip(np.floor((MERC_HALF - y)/size).astype(np.int64), 0, n-1)
+    c0 = col(np.minimum(x0, x1) - pad)
+    c1 = col(np.maximum(x0, x1) + pad)
+    r0 = row(np.maximum(y0, y1) + pad)
+    r1 = row(np.minimum(y0, y1) - pad)
+    nCols = c1 - c0 + 1
+    counts = nCols*(r1 - r0 + 1)
+    parts = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return parts, c0[parts] + k % nCols[parts], r0[parts] + k // nCols[parts]
+
+
+def _openMBTiles(fileName):
+    db = sqlite3.connect(fileName)
+    db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+    db.execute("""CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER,
+        tile_column INTEGER, tile_row INTEGER, tile_data BLOB)""")
+    db.execute("""CREATE UNIQUE INDEX IF NOT EXISTS tile_index
+        ON tiles (zoom_level, tile_column, tile_row)""")
+    """ Bookkeeping for incremental updates """
+    db.execute("""CREATE TABLE IF NOT EXISTS storm_hashes
+        (storm_id TEXT PRIMARY KEY, hash TEXT)""")
+    db.execute("""CREATE TABLE IF NOT EXISTS storm_tiles
+        (storm_id TEXT, z INTEGER, x INTEGER, y INTEGER)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS storm_tiles_storm
+        ON storm_tiles (storm_id)""")
+    return db
+
+
+def writeVectorTiles(fileName, segCoords, segParams, fields, minZoom, maxZoom,
+                     webMerc=False, workers=0):
+    """ Writes or updates the MBTiles file of Segments vector tiles.
+
+    segCoords and segParams are the Segments shapefile geometry (list of
+    parts for each segment) and attributes, with fields the shapefile field
+    list.  Coordinates are Web Mercator if webMerc is True and lon/lat
+    otherwise.  workers is the process pool size, 0 for one per CPU.
+
+    Returns (tiles rebuilt, tiles deleted, storms changed).
+    """
+    fieldNames = [f[0] for f in fields]
+    iStorm = fieldNames.index('STORM_ID')
+    iSegment = fieldNames.index('SEGMENT_ID')
+
+    """ Flatten every part of every segment into arrays """
+    partSeg = []
+    xs0, ys0, xs1, ys1 = [], [], [], []
+    for s, parts in enumerate(segCoords):
+        for part in parts:
+            for (ax, ay), (bx, by) in zip(part[:-1], part[1:]):
+                partSeg.append(s)
+                xs0.append(ax)
+                ys0.append(ay)
+                xs1.append(bx)
+                ys1.append(by)
+    partSeg = np.array(partSeg, dtype=np.int64)
+    x0, y0, x1, y1 = (np.array(v, dtype=float) for v in (xs0, ys0, xs1, ys1))
+    if not webMerc:
+        x0, y0 = mercator(x0, y0)
+        x1, y1 = mercator(x1, y1)
+
+    """ Hash each storm's segments to find what changed since the last run """
+    stormHashes = {}
+    for coords, params in zip(segCoords, segParams):
+        h = stormHashes.setdefault(params[iStorm], hashlib.sha1())
+        h.update(repr((coords, params)).encode('utf-8'))
+    stormHashes = {uid: h.hexdigest() for uid, h in stormHashes.items()}
+
+    db = _openMBTiles(fileName)
+    """ A different zoom range means every tile has to be rebuilt """
+    oldMeta = dict(db.execute("SELECT name, value FROM metadata"))
+    if (oldMeta.get('minzoom') != str(minZoom)
+            or oldMeta.get('maxzoom') != str(maxZoom)):
+        for table in ('tiles', 'storm_hashes', 'storm_tiles'):
+            db.execute("DELETE FROM %s" % table)
+    oldHashes = dict(db.execute("SELECT storm_id, hash FROM storm_hashes"))
+    changed = ({uid for uid in stormHashes if oldHashes.get(uid) != stormHashes[uid]}
+               | (set(oldHashes) - set(stormHashes)))
+
+    """ Tiles formerly touched by changed or removed storms """
+    dirty = set()
+    for uid in changed:
+        dirty.update(db.execute(
+            "SELECT z, x, y FROM storm_tiles WHERE storm_id = ?", (uid,)))
+
+    """ Current tile contents, plus tiles touched by changed storms """
+    segStorm = [params[iStorm] for params in segParams]
+    changedPart = np.array([segStorm[s] in changed for s in partSeg],
+                           dtype=bool)
+    tileParts = {}
+    newStormTiles = set()
+    for z in range(minZoom, maxZoom + 1):
+        parts, tx, ty = _tilesForZoom(z, x0, y0, x1, y1)
+        order = np.lexsort((parts, ty, tx))
+        parts, tx, ty = parts[order], tx[order], ty[order]
+        newKey = np.ones(len(parts), dtype=bool)
+        newKey[1:] = (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])
+        starts = np.nonzero(newKey)[0]
+        for start, end in zip(starts, np.append(starts[1:], len(parts))):
+            tileParts[(z, int(tx[start]), int(ty[start]))] = parts[start:end]
+        for p, x, y in zip(parts[changedPart[parts]], tx[changedPart[parts]],
+                           ty[changedPart[parts]]):
+            newStormTiles.add((segStorm[partSeg[p]], z, int(x), int(y)))
+    dirty.update((z, x, y) for uid, z, x, y in newStormTiles)
+    dirty = sorted(dirty)
+
+    """ Encode the dirty tiles in parallel.  Workers are forked so they
+        share the segment arrays without copying them.  Where fork is not
+        available the tiles are encoded in this process. """
+    shared = {'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1, 'partSeg': partSeg,
+              'segIDs': [params[iSegment] for params in segParams],
+              'attrs': segParams, 'fieldNames': fieldNames}
+    jobs = [(key, tileParts.get(key, np.zeros(0, dtype=np.int64)))
+            for key in dirty]
+    chunk = max(1, len(jobs)//((workers or os.cpu_count() or 1)*8))
+    batches = [jobs[k:k + chunk] for k in range(0, len(jobs), chunk)]
+    numBuilt = 0
+    numDeleted = 0
+    if 'fork' in multiprocessing.get_all_start_methods() and workers != 1:
+        pool = multiprocessing.get_context('fork').Pool(
+            workers or None, _initWorker, (shared,))
+        allResults = pool.imap_unordered(_buildTiles, batches)
+    else:
+        pool = None
+        _initWorker(shared)
+        allResults = map(_buildTiles, batches)
+    try:
+        for results in allResults:
+            for (z, tx, ty), data in results:
+                tmsRow = (1 << z) - 1 - ty
+                if data is None:
+                    numDeleted += db.execute("""DELETE FROM tiles WHERE
+                        zoom_level = ? AND tile_column = ? AND tile_row = ?""",
+                        (z, tx, tmsRow)).rowcount
+                else:
+                    db.execute("INSERT OR REPLACE INTO tiles VALUES (?,?,?,?)",
+                               (z, tx, tmsRow, data))
+                    numBuilt += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    """ Save the bookkeeping for the next run """
+    db.executemany("DELETE FROM storm_tiles WHERE storm_id = ?",
+                   ((uid,) for uid in changed))
+    db.executemany("INSERT INTO storm_tiles VALUES (?,?,?,?)", newStormTiles)
+    db.executemany("DELETE FROM storm_hashes WHERE storm_id = ?",
+                   ((uid,) for uid in changed))
+    db.executemany("INSERT INTO storm_hashes VALUES (?,?)",
+                   ((uid, stormHashes[uid]) for uid in changed
+                    if uid in stormHashes))
+    db.execute("DELETE FROM metadata")
+    db.executemany("INSERT INTO metadata VALUES (?,?)", [
+        ('name', 'HHT Segments'),
+        ('format', 'pbf'),
+        ('type', 'overlay'),
+        ('minzoom', str(minZoom)),
+        ('maxzoom', str(maxZoom)),
+        ('bounds', '-180.0,-85.0511,180.0,85.0511'),
+        ('json', json.dumps({'vector_layers': [{
+            'id': LAYER_NAME, 'minzoom': minZoom, 'maxzoom': maxZoom,
+            'fields': _fieldTypes(fieldNames, segParams)}]}))])
+    db.commit()
+    db.close()
+    return numBuilt, numDeleted, len(changed)
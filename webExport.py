@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Compact export of every storm's track and observation series for the track
+detail view of the HHT web client, so it can draw a storm without a
+database round trip per storm.
+
+Storms are written to one JSON file per year, web/tracks_<year>.json, so
+the client only loads the years it needs, plus web/index.json listing the
+years and the lookup tables needed to decode them.  Within a storm:
+    xy  flat list of quantized positions, the first observation as
+        [lon, lat] in units of SCALE degrees and every later one as the
+        change from the one before.  Longitude changes are taken the short
+        way around, so a track crossing 180 stays continuous.
+    dt  minutes from the storm's start time t0 (minutes since 1970-01-01
+        UTC) to the first observation, then from each observation to the
+        next
+    w   1 minute sustained winds in knots, p pressures in mb, both
+        rounded, with -1 for missing
+    c   Saffir-Simpson category and ENSO state of each observation packed
+        into one small integer, category*len(ENSO) + ENSO, indexing the
+        CATS and ENSO tables in index.json
+
+"""
+
+import os
+import glob
+import gzip
+import json
+import datetime as dt
+
+""" Quantization step for positions, in degrees """
+SCALE = 0.01
+
+""" Decoding tables for the packed category and ENSO codes.  Anything not
+    in a table is written as its last entry. """
+CATS = ['TD', 'TS', 'H1', 'H2', 'H3', 'H4', 'H5', 'ET', 'NR']
+ENSO = ['N', '0', 'P', 'U']
+
+_epoch = dt.datetime(1970, 1, 1)
+
+
+def _minutes(time):
+    return int((time - _epoch).total_seconds()) // 60
+
+
+def _packCode(saffir, enso):
+    cat = CATS.index(saffir) if saffir in CATS else len(CATS) - 1
+    state = ENSO.index(enso) if enso in ENSO else len(ENSO) - 1
+    return cat*len(ENSO) + state
+
+
+def encodeStorm(storm):
+    """ Compact dictionary for one processed Storm """
+    xy = []
+    times = []
+    lastX = lastY = None
+    lastTime = storm.segs[0].time
+    for seg in storm.segs:
+        x = int(round(seg.startLon/SCALE))
+        y = int(round(seg.startLat/SCALE))
+        if lastX is None:
+            xy += [x, y]
+        else:
+            dx = (x - lastX + int(180/SCALE)) % int(360/SCALE) - int(180/SCALE)
+            xy += [dx, y - lastY]
+            """ Keep the running position continuous across 180 """
+            x = lastX + dx
+        lastX, lastY = x, y
+        times.append(_minutes(seg.time) - _minutes(lastTime))
+        lastTime = seg.time
+    return {'id': storm.uid,
+            'name': storm.name,
+            'basin': storm.basin,
+            't0': _minutes(storm.segs[0].time),
+            'xy': xy,
+            'dt': times,
+            'w': [int(round(seg.wsp)) if seg.wsp >= 0 else -1
+                  for seg in storm.segs],
+            'p': [int(round(seg.pres)) if seg.pres >= 0 else -1
+                  for seg in storm.segs],
+            'c': [_packCode(seg.saffir, seg.enso) for seg in storm.segs]}
+
+
+def writeWebExport(dirName, storms):
+    """ Writes the per year files and index.json for the processed storms
+        in one pass over them.  Files for years no longer present are
+        removed.  Returns a dictionary of year to (storms, bytes, gzipped
+        bytes). """
+    os.makedirs(dirName, exist_ok=True)
+    years = {}
+    for storm in storms:
+        years.setdefault(storm.startTime.year, []).append(encodeStorm(storm))
+
+    sizes = {}
+    index = {'scale': SCALE, 'cats': CATS, 'enso': ENSO, 'years': {}}
+    for year in sorted(years):
+        fileName = 'tracks_%d.json' % year
+        text = json.dumps({'year': year, 'storms': years[year]},
+                          separators=(',', ':')).encode('utf-8')
+        with open(os.path.join(dirName, fileName), 'wb') as f:
+            f.write(text)
+        sizes[year] = (len(years[year]), len(text),
+                       len(gzip.compress(text, 9)))
+        index['years'][str(year)] = {'file': fileName,
+                                     'storms': sizes[year][0],
+                                     'bytes': sizes[year][1],
+                                     'gzip': sizes[year][2]}
+    with open(os.path.join(dirName, 'index.json'), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+    current = set(v['file'] for v in index['years'].values())
+    for path in glob.glob(os.path.join(dirName, 'tracks_*.json')):
+        if os.path.basename(path) not in current:
+            os.remove(path)
+    return sizes
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Writes the Tracks and Segments layers produced by annualDataUpdate.py into a
+single OGC GeoPackage using only the sqlite3 module from the standard library.
+
+All features are bulk inserted in one transaction.  The R-tree spatial index
+for every geometry column and the attribute indexes requested by the caller
+are built after the load, so the file comes out ready to query (or to copy
+straight into place for the HHT web application).
+
+GeoPackage encoding details follow the OGC GeoPackage Encoding Standard 1.2:
+    http://www.geopackage.org/spec120/
+
+"""
+
+import os
+import struct
+import sqlite3
+
+""" 'GPKG' application id and version 1.2.0 """
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+
+""" Shapefile field types from annualDataUpdate.py mapped to GeoPackage
+    column types.  Numeric fields default to REAL, callers can override
+    any column type by name. """
+columnTypes = {'C': 'TEXT', 'N': 'REAL', 'D': 'DATE', 'L': 'BOOLEAN'}
+
+""" WKB type code for MultiLineString.  Shapefile polylines can have many
+    parts, so both layers are stored as MULTILINESTRING. """
+WKB_MULTILINESTRING = 5
+WKB_LINESTRING = 2
+
+
+def multiLineWKB(parts):
+    """ Returns little endian WKB for a MultiLineString built from a list of
+    parts, each a list of [x, y] pairs, exactly as handed to
+    shapefile.Writer.line(). Also returns the envelope as
+    (minx, maxx, miny, maxy). """
+    chunks = [struct.pack('<BII', 1, WKB_MULTILINESTRING, len(parts))]
+    xs = []
+    ys = []
+    for part in parts:
+        chunks.append(struct.pack('<BII', 1, WKB_LINESTRING, len(part)))
+        for x, y in part:
+            chunks.append(struct.pack('<dd', x, y))
+            xs.append(x)
+            ys.append(y)
+    return b''.join(chunks), (min(xs), max(xs), min(ys), max(ys))
+
+
+def gpkgGeometry(parts, srsID):
+    """ Wraps the WKB of parts in the GeoPackage binary header:
+        magic 'GP', version 0, flags (little endian, xy envelope),
+        srs_id and the envelope.  Returns (blob, envelope) """
+    wkb, envelope = multiLineWKB(parts)
+    header = struct.pack('<2sBBi4d', b'GP', 0, 0b00000011, srsID, *envelope)
+    return header + wkb, envelope
+
+
+def _gpkgValue(fieldType, value):
+    """ Converts a shapefile record value to what sqlite should store """
+    if value is None:
+        return None
+    if fieldType == 'D':  # YYYYMMDD -> YYYY-MM-DD
+        value = str(value)
+        return value[0:4] + '-' + value[4:6] + '-' + value[6:8]
+    if fieldType == 'N':
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return value
+
+
+def _createCoreTables(db, srsID, srsName, srsWKT):
+    """ The mandatory GeoPackage metadata tables and spatial reference
+        systems """
+    db.execute("""CREATE TABLE gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL, description TEXT)""")
+    db.execute("""CREATE TABLE gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE, description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT
+            (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+        srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+            REFERENCES gpkg_spatial_ref_sys(srs_id))""")
+    db.execute("""CREATE TABLE gpkg_geometry_columns (
+        table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL,
+        z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name)
+            REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id)
+            REFERENCES gpkg_spatial_ref_sys (srs_id))""")
+    db.execute("""CREATE TABLE gpkg_extensions (
+        table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL, scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))""")
+    srsRows = [
+        ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined',
+         'undefined cartesian coordinate reference system'),
+        ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined',
+         'undefined geographic coordinate reference system')]
+    if srsID > 0:
+        srsRows.append((srsName, srsID, 'EPSG', srsID, srsWKT, srsName))
+    db.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)',
+                   srsRows)
+
+
+def _createRTree(db, table, geomColumn, envelopes):
+    """ Builds and fills the R-tree for one layer from the envelopes computed
+        during the insert, then adds the triggers from the GeoPackage R-tree
+        extension so later edits (e.g. in QGIS or GDAL) keep it current.  The
+        triggers call ST_* functions that only GeoPackage aware readers
+        provide, so they are created after the bulk load. """
+    rtree = 'rtree_%s_%s' % (table, geomColumn)
+    db.execute('CREATE VIRTUAL TABLE "%s" USING rtree(id, minx, maxx, miny, maxy)'
+               % rtree)
+    db.executemany('INSERT INTO "%s" VALUES (?,?,?,?,?)' % rtree,
+                   ((fid,) + env for fid, env in envelopes))
+    db.execute("""INSERT INTO gpkg_extensions VALUES (?, ?, 'gpkg_rtree_index',
+        'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')""",
+               (table, geomColumn))
+    t = {'t': table, 'c': geomColumn, 'r': rtree, 'i': 'fid'}
+    triggers = [
+        """CREATE TRIGGER "{r}_insert" AFTER INSERT ON "{t}"
+        WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}",
+            ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),
+            ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+        """CREATE TRIGGER "{r}_update1" AFTER UPDATE OF "{c}" ON "{t}"
+        WHEN OLD."{i}" = NEW."{i}" AND
+             (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}",
+            ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),
+            ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+        """CREATE TRIGGER "{r}_update2" AFTER UPDATE OF "{c}" ON "{t}"
+        WHEN OLD."{i}" = NEW."{i}" AND
+             (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}"; END""",
+        """CREATE TRIGGER "{r}_update3" AFTER UPDATE ON "{t}"
+        WHEN OLD."{i}" != NEW."{i}" AND
+             (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}";
+            INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}",
+            ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),
+            ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END""",
+        """CREATE TRIGGER "{r}_update4" AFTER UPDATE ON "{t}"
+        WHEN OLD."{i}" != NEW."{i}" AND
+             (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "{r}" WHERE id IN (OLD."{i}", NEW."{i}"); END""",
+        """CREATE TRIGGER "{r}_delete" AFTER DELETE ON "{t}"
+        WHEN old."{c}" NOT NULL
+        BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}"; END"""]
+    for trigger in triggers:
+        db.execute(trigger.format(**t))
+
+
+def writeGeoPackage(fileName, srsID, srsName, srsWKT, layers):
+    """ Writes all layers to a new GeoPackage, replacing any existing file.
+
+    layers is a list of dictionaries, one per feature table, with keys:
+        'name'    : table name, e.g. 'Tracks'
+        'fields'  : shapefile style field list [[name, type, size], ...]
+        'coords'  : list of polyline parts for each feature, or None for
+                    a table without geometry (an attributes table)
+        'records' : list of attribute lists, in the same order as fields
+        'indexes' : column names that get an attribute index
+        'types'   : (optional) dict of column name to GeoPackage type
+
+    Returns a dictionary of table name to number of features written.
+    """
+    if os.path.exists(fileName):
+        os.remove(fileName)
+    """ Manage the transaction explicitly so the table creation and all the
+        inserts are one transaction.  The file is new and removed on any
+        failure, so there is no need to sync to disk along the way. """
+    db = sqlite3.connect(fileName, isolation_level=None)
+    db.execute('PRAGMA application_id = %d' % GPKG_APPLICATION_ID)
+    db.execute('PRAGMA user_version = %d' % GPKG_USER_VERSION)
+    db.execute('PRAGMA synchronous = OFF')
+    db.execute('BEGIN')
+    counts = {}
+    try:
+        _createCoreTables(db, srsID, srsName, srsWKT)
+        for layer in layers:
+            table = layer['name']
+            fields = layer['fields']
+            types = dict(layer.get('types', {}))
+            spatial = layer['coords'] is not None
+            colDefs = ['fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL']
+            if spatial:
+                colDefs.append('geom MULTILINESTRING')
+            for field in fields:
+                colType = types.get(field[0], columnTypes.get(field[1], 'TEXT'))
+                colDefs.append('"%s" %s' % (field[0], colType))
+            db.execute('CREATE TABLE "%s" (%s)' % (table, ', '.join(colDefs)))
+
+            """ Build all the rows first, keeping each envelope for the
+                R-tree and the layer extent for gpkg_contents """
+            fieldTypes = [field[1] for field in fields]
+            rows = []
+            envelopes = []
+            minX = minY = float('inf')
+            maxX = maxY = float('-inf')
+            if not spatial:
+                rows = [[fid] + [_gpkgValue(ft, v)
+                                 for ft, v in zip(fieldTypes, record)]
+                        for fid, record in enumerate(layer['records'], start=1)]
+            for fid, (parts, record) in enumerate(
+                    zip(layer['coords'] or [], layer['records']), start=1):
+                blob, env = gpkgGeometry(parts, srsID)
+                envelopes.append((fid, env))
+                minX = min(minX, env[0])
+                maxX = max(maxX, env[1])
+                minY = min(minY, env[2])
+                maxY = max(maxY, env[3])
+                rows.append([fid, blob] +
+                            [_gpkgValue(ft, v) for ft, v in zip(fieldTypes, record)])
+            placeholders = ', '.join(['?'] * len(colDefs))
+            db.executemany('INSERT INTO "%s" VALUES (%s)' % (table, placeholders),
+                           rows)
+            if not envelopes:
+                minX = minY = maxX = maxY = None
+
+            if spatial:
+                db.execute("""INSERT INTO gpkg_contents (table_name, data_type,
+                    identifier, min_x, min_y, max_x, max_y, srs_id)
+                    VALUES (?, 'features', ?, ?, ?, ?, ?, ?)""",
+                    (table, table, minX, minY, maxX, maxY, srsID))
+                db.execute("""INSERT INTO gpkg_geometry_columns
+                    VALUES (?, 'geom', 'MULTILINESTRING', ?, 0, 0)""",
+                    (table, srsID))
+            else:
+                db.execute("""INSERT INTO gpkg_contents (table_name, data_type,
+                    identifier) VALUES (?, 'attributes', ?)""", (table, table))
+
+            """ Indexes are cheaper to build once all rows are in """
+            if spatial:
+                _createRTree(db, table, 'geom', envelopes)
+            for column in layer.get('indexes', []):
+                db.execute('CREATE INDEX "idx_%s_%s" ON "%s" ("%s")'
+                           % (table, column, table, column))
+            counts[table] = len(rows)
+        db.execute('COMMIT')
+    except Exception:
+        db.rollback()
+        db.close()
+        os.remove(fileName)
+        raise
+    db.close()
+    return counts